@@ -14,6 +14,7 @@ import webbrowser
 import subprocess
 import sqlite3
 import requests
+from requests.adapters import HTTPAdapter
 import io
 import feedparser
 from pydub import AudioSegment
@@ -32,10 +33,660 @@ import tempfile
 import base64
 import wikipedia
 import re
+import csv
+import json
+import mmap
+import struct
+import hashlib
+import http.cookiejar
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import atexit
+import time
+from urllib.parse import quote
+import zlib
+import numpy as np
 from difflib import SequenceMatcher
-from collections import defaultdict
+from collections import defaultdict, deque, Counter, OrderedDict
+from array import array
 
-wikipedia.set_lang("es")
+WIKIPEDIA_LANGUAGE = "es"
+wikipedia.set_lang(WIKIPEDIA_LANGUAGE)
+
+# ============= AUTÓMATA DE FRASES (AHO-CORASICK) =============
+class PhraseMatcher:
+    """Autómata Aho-Corasick que encuentra todas las frases de un texto en una sola pasada"""
+    
+    def __init__(self, alphabet, table, out_start, out_ids):
+        # Alfabeto compacto: cada carácter de las frases tiene una columna,
+        # la última columna representa cualquier otro carácter
+        self.alphabet = {ch: i for i, ch in enumerate(alphabet)}
+        self.width = len(alphabet) + 1
+        # Tabla de transiciones (estados multiplicados por el ancho de fila,
+        # negativos si el estado reconoce alguna frase)
+        self.table = table
+        # Frases reconocidas en cada estado: out_ids[out_start[s]:out_start[s + 1]]
+        self.out_start = out_start
+        self.out_ids = out_ids
+    
+    @classmethod
+    def build(cls, phrases):
+        """Construye el autómata a partir de una lista de frases (id = posición)"""
+        alphabet = ''.join(sorted({ch for phrase in phrases for ch in phrase}))
+        columns = {ch: i for i, ch in enumerate(alphabet)}
+        width = len(alphabet) + 1
+        
+        # Trie de frases
+        goto = [{}]
+        outputs = [[]]
+        for phrase_id, phrase in enumerate(phrases):
+            state = 0
+            for ch in phrase:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    outputs.append([])
+                state = nxt
+            outputs[state].append(phrase_id)
+        
+        # Enlaces de fallo (BFS) y tabla de transiciones completa (DFA)
+        table = array('i', [0]) * (len(goto) * width)
+        fail = [0] * len(goto)
+        for ch, nxt in goto[0].items():
+            table[columns[ch]] = nxt
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            row = state * width
+            fail_row = fail[state] * width
+            for col in range(width):
+                table[row + col] = table[fail_row + col]
+            for ch, nxt in goto[state].items():
+                col = columns[ch]
+                fail[nxt] = table[fail_row + col]
+                outputs[nxt].extend(outputs[fail[nxt]])
+                table[row + col] = nxt
+                queue.append(nxt)
+        
+        # Estados ya multiplicados por el ancho de fila, así cada carácter cuesta
+        # una sola indexación; el signo marca los estados con frases
+        table = array('i', (-nxt * width if outputs[nxt] else nxt * width for nxt in table))
+        out_start = array('i', [0])
+        out_ids = array('i')
+        for ids in outputs:
+            out_ids.extend(ids)
+            out_start.append(len(out_ids))
+        return cls(alphabet, table, out_start, out_ids)
+    
+    def find(self, text):
+        """Devuelve el conjunto de ids de frases contenidas en el texto"""
+        table = self.table
+        width = self.width
+        other = width - 1
+        alphabet = self.alphabet
+        out_start = self.out_start
+        out_ids = self.out_ids
+        found = set()
+        state = 0
+        for ch in text:
+            state = table[state + alphabet.get(ch, other)]
+            if state < 0:
+                state = -state
+                target = state // width
+                found.update(out_ids[out_start[target]:out_start[target + 1]])
+        return found
+
+# ============= ÍNDICE DIFUSO POR LONGITUD =============
+class FuzzyIndex:
+    """Índice de textos agrupados por longitud que poda candidatos antes de usar SequenceMatcher"""
+    
+    def __init__(self, texts, entries, length_start, count_start, count_chars, count_values):
+        self.texts = texts
+        # Posiciones de los textos ordenadas por longitud; length_start[n] marca
+        # dónde empiezan los de longitud n
+        self.entries = entries
+        self.length_start = length_start
+        # Conteo de caracteres de cada entrada para la cota de quick_ratio
+        self.count_start = count_start
+        self.count_chars = count_chars
+        self.count_values = count_values
+        self._length_order = {}
+    
+    @classmethod
+    def build(cls, texts):
+        """Construye el índice a partir de una lista de textos"""
+        texts = list(texts)
+        # Entradas ordenadas por longitud (y por posición original dentro de cada longitud)
+        entries = array('i', sorted(range(len(texts)), key=lambda i: (len(texts[i]), i)))
+        max_len = max((len(t) for t in texts), default=0)
+        length_start = array('i', [0]) * (max_len + 2)
+        for text in texts:
+            length_start[len(text) + 1] += 1
+        for length in range(1, max_len + 2):
+            length_start[length] += length_start[length - 1]
+        
+        count_start = array('i', [0])
+        count_chars = array('i')
+        count_values = array('i')
+        for index in entries:
+            for ch, n in sorted(Counter(texts[index]).items()):
+                count_chars.append(ord(ch))
+                count_values.append(n)
+            count_start.append(len(count_chars))
+        return cls(texts, entries, length_start, count_start, count_chars, count_values)
+    
+    def _lengths_for(self, la):
+        """Longitudes candidatas ordenadas de mayor a menor cota de similitud"""
+        lengths = self._length_order.get(la)
+        if lengths is None:
+            lengths = tuple(sorted(
+                range(1, len(self.length_start) - 1),
+                key=lambda lb: -2.0 * min(la, lb) / (la + lb)
+            ))
+            self._length_order[la] = lengths
+        return lengths
+    
+    def best_match(self, text, cutoff, floor=0.0):
+        """Devuelve (posición, similitud) del texto más parecido por encima de cutoff.
+        
+        Equivale a recorrer todos los textos con SequenceMatcher(None, text, t).ratio()
+        quedándose con el primero de mayor similitud; floor descarta candidatos que
+        no podrían alcanzar un puntaje ya conocido.
+        """
+        la = len(text)
+        if not la:
+            return None, 0
+        
+        texts = self.texts
+        entries = self.entries
+        length_start = self.length_start
+        count_start = self.count_start
+        count_chars = self.count_chars
+        count_values = self.count_values
+        counts = Counter(map(ord, text))
+        
+        best_index = None
+        best_score = 0
+        for lb in self._lengths_for(la):
+            total = la + lb
+            # Cota por longitud (real_quick_ratio)
+            bound = 2.0 * min(la, lb) / total
+            if bound <= cutoff or bound < floor or bound < best_score:
+                break
+            for pos in range(length_start[lb], length_start[lb + 1]):
+                index = entries[pos]
+                # Cota por caracteres compartidos (quick_ratio)
+                shared = 0
+                for k in range(count_start[pos], count_start[pos + 1]):
+                    have = counts.get(count_chars[k])
+                    if have:
+                        shared += have if have < count_values[k] else count_values[k]
+                bound = 2.0 * shared / total
+                if bound <= cutoff or bound < floor or bound < best_score:
+                    continue
+                if bound == best_score and index > best_index:
+                    continue
+                
+                score = SequenceMatcher(None, text, texts[index]).ratio()
+                if score <= cutoff or score < floor:
+                    continue
+                if score > best_score or (score == best_score and index < best_index):
+                    best_index = index
+                    best_score = score
+        
+        return best_index, best_score
+
+# ============= N-GRAMAS DE CARACTERES =============
+def char_ngrams(text, n=3):
+    """N-gramas de caracteres del texto, con un espacio de relleno en cada extremo"""
+    padded = f" {text} "
+    return [padded[i:i + n] for i in range(len(padded) - n + 1)]
+
+# ============= CLASIFICADOR ESTADÍSTICO DE RESPALDO =============
+class IntentClassifier:
+    """Centroides TF-IDF de n-gramas de caracteres por intención, en formato disperso.
+    
+    Los pesos se guardan por columnas (estilo CSC): para el n-grama g, sus
+    intenciones están en indices[indptr[g]:indptr[g + 1]] con pesos en data.
+    La similitud coseno con cada centroide pasa por un softmax con temperatura
+    calibrada para que la confianza se parezca a una probabilidad.
+    """
+    
+    TEMPERATURES = (0.02, 0.03, 0.05, 0.07, 0.1, 0.15, 0.2, 0.3, 0.5)
+    
+    def __init__(self, n=3):
+        self.n = n
+        self.labels = []
+        self.vocab = {}
+        self.idf = np.zeros(0, dtype=np.float32)
+        self.indptr = np.zeros(1, dtype=np.int32)
+        self.indices = np.zeros(0, dtype=np.int32)
+        self.data = np.zeros(0, dtype=np.float32)
+        self.temperature = 0.1
+    
+    def _counts(self, text):
+        """Ids y frecuencias de los n-gramas conocidos del texto"""
+        counts = Counter(char_ngrams(text, self.n))
+        ids = [self.vocab[g] for g in counts if g in self.vocab]
+        tf = [counts[g] for g in counts if g in self.vocab]
+        return np.array(ids, dtype=np.int32), np.array(tf, dtype=np.float32)
+    
+    def _vector(self, text):
+        """Vector TF-IDF (ids, pesos) normalizado L2"""
+        ids, tf = self._counts(text)
+        weights = (1 + np.log(tf)) * self.idf[ids] if len(ids) else tf
+        norm = np.sqrt(np.dot(weights, weights))
+        return ids, weights / norm if norm else weights
+    
+    def fit(self, samples):
+        """Entrena con pares (texto normalizado, intención)"""
+        samples = [(text, label) for text, label in samples if text]
+        self.labels = sorted({label for _, label in samples})
+        label_ids = {label: i for i, label in enumerate(self.labels)}
+        
+        # Vocabulario e IDF (suavizado) sobre todas las muestras
+        self.vocab = {}
+        df = Counter()
+        for text, _ in samples:
+            grams = set(char_ngrams(text, self.n))
+            for gram in grams:
+                self.vocab.setdefault(gram, len(self.vocab))
+            df.update(grams)
+        idf = np.zeros(len(self.vocab), dtype=np.float32)
+        for gram, i in self.vocab.items():
+            idf[i] = np.log((1 + len(samples)) / (1 + df[gram])) + 1
+        self.idf = idf
+        
+        # Centroide de cada intención: suma de sus vectores normalizada
+        centroids = np.zeros((len(self.labels), len(self.vocab)), dtype=np.float32)
+        for text, label in samples:
+            ids, weights = self._vector(text)
+            centroids[label_ids[label], ids] += weights
+        norms = np.linalg.norm(centroids, axis=1)
+        norms[norms == 0] = 1
+        centroids /= norms[:, None]
+        
+        # Comprimir por columnas: solo se guardan los pesos distintos de cero
+        columns = centroids.T
+        rows, cols = np.nonzero(columns)
+        self.indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=len(self.vocab))))).astype(np.int32)
+        self.indices = cols.astype(np.int32)
+        self.data = columns[rows, cols]
+        
+        self.temperature = self._calibrate(samples, label_ids, norms)
+        return self
+    
+    def similarities(self, text):
+        """Similitud coseno del texto con el centroide de cada intención"""
+        ids, weights = self._vector(text)
+        if not len(ids):
+            return np.zeros(len(self.labels), dtype=np.float32)
+        starts = self.indptr[ids]
+        lengths = self.indptr[ids + 1] - starts
+        # Posiciones de todas las entradas de las columnas tocadas, sin bucles
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        positions = offsets + np.arange(lengths.sum())
+        return np.bincount(self.indices[positions],
+                           weights=self.data[positions] * np.repeat(weights, lengths),
+                           minlength=len(self.labels))
+    
+    def _softmax(self, sims, temperature):
+        z = (sims - sims.max(axis=-1, keepdims=True)) / temperature
+        e = np.exp(z)
+        return e / e.sum(axis=-1, keepdims=True)
+    
+    def _calibrate(self, samples, label_ids, norms):
+        """Temperatura que minimiza la log-verosimilitud negativa dejando cada muestra fuera"""
+        if len(self.labels) < 2:
+            return self.temperature
+        sims = np.array([self.similarities(text) for text, _ in samples])
+        targets = np.array([label_ids[label] for _, label in samples])
+        
+        # Similitud con el centroide propio sin la muestra: con S la suma sin
+        # normalizar, x·(S - x) / |S - x|, donde x·S = sim * |S| y |x| = 1
+        rows = np.arange(len(targets))
+        norm = norms[targets]
+        dot = sims[rows, targets] * norm
+        rest = np.sqrt(np.maximum(norm * norm - 2 * dot + 1, 0))
+        sims[rows, targets] = np.where(rest > 1e-6, (dot - 1) / np.maximum(rest, 1e-6), 0)
+        best, best_loss = self.temperature, None
+        for temperature in self.TEMPERATURES:
+            probs = self._softmax(sims, temperature)[rows, targets]
+            loss = -np.mean(np.log(np.maximum(probs, 1e-12)))
+            if best_loss is None or loss < best_loss:
+                best, best_loss = temperature, loss
+        return best
+    
+    def predict(self, text, top_k=3):
+        """Intenciones ordenadas con su confianza calibrada y similitud coseno"""
+        if not self.labels:
+            return []
+        sims = self.similarities(text)
+        probs = self._softmax(sims, self.temperature)
+        ranked = np.argsort(-probs, kind='stable')[:top_k]
+        return [(self.labels[i], float(probs[i]), float(sims[i])) for i in ranked]
+
+# ============= ARTEFACTO NLP PRECOMPILADO =============
+# Los índices del NLP se guardan en un binario versionado que se mapea en memoria
+# (mmap) al arrancar: los procesos hijos comparten las páginas y no se recompila nada
+NLP_ARTIFACT_PATH = os.environ.get('BARO_NLP_ARTIFACT', 'baro_nlp.bin')
+NLP_ARTIFACT_MAGIC = b'BARONLP\x00'
+NLP_ARTIFACT_VERSION = 2
+NLP_ARTIFACT_HEADER = struct.Struct('<I32sI')    # versión, hash de las fuentes, nº de secciones
+NLP_ARTIFACT_SECTION = struct.Struct('<16sQQ')   # nombre, desplazamiento, tamaño
+
+class StringTable:
+    """Lista de textos guardada como UTF-8 contiguo con desplazamientos; decodifica bajo demanda"""
+    
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+    
+    @staticmethod
+    def pack(texts):
+        """Devuelve (bytes, desplazamientos) de una lista de textos"""
+        data = bytearray()
+        offsets = array('i', [0])
+        for text in texts:
+            data += text.encode('utf-8')
+            offsets.append(len(data))
+        return bytes(data), offsets
+    
+    def __len__(self):
+        return len(self.offsets) - 1
+    
+    def __getitem__(self, index):
+        return str(self.data[self.offsets[index]:self.offsets[index + 1]], 'utf-8')
+    
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+def write_nlp_artifact(path, source_hash, sections):
+    """Escribe las secciones (buffers) en el artefacto de forma atómica"""
+    names = list(sections)
+    offset = len(NLP_ARTIFACT_MAGIC) + NLP_ARTIFACT_HEADER.size + len(names) * NLP_ARTIFACT_SECTION.size
+    toc = []
+    for name in names:
+        offset = (offset + 7) & ~7  # secciones alineadas a 8 bytes
+        size = memoryview(sections[name]).nbytes
+        toc.append((name, offset, size))
+        offset += size
+    
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(NLP_ARTIFACT_MAGIC)
+        f.write(NLP_ARTIFACT_HEADER.pack(NLP_ARTIFACT_VERSION, source_hash, len(names)))
+        for name, offset, size in toc:
+            f.write(NLP_ARTIFACT_SECTION.pack(name.encode('ascii'), offset, size))
+        for name, offset, size in toc:
+            f.seek(offset)
+            f.write(memoryview(sections[name]).cast('B'))
+    os.replace(tmp_path, path)
+
+def read_nlp_artifact(path, source_hash):
+    """Mapea el artefacto y devuelve sus secciones, o None si falta o está desactualizado"""
+    try:
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    
+    start = len(NLP_ARTIFACT_MAGIC)
+    if len(mapped) < start + NLP_ARTIFACT_HEADER.size or mapped[:start] != NLP_ARTIFACT_MAGIC:
+        mapped.close()
+        return None
+    version, stored_hash, count = NLP_ARTIFACT_HEADER.unpack_from(mapped, start)
+    if version != NLP_ARTIFACT_VERSION or stored_hash != source_hash:
+        mapped.close()
+        return None
+    
+    toc = []
+    position = start + NLP_ARTIFACT_HEADER.size
+    for _ in range(count):
+        name, offset, size = NLP_ARTIFACT_SECTION.unpack_from(mapped, position)
+        position += NLP_ARTIFACT_SECTION.size
+        if offset + size > len(mapped):
+            mapped.close()
+            return None
+        toc.append((name.rstrip(b'\x00').decode('ascii'), offset, size))
+    
+    # Las vistas mantienen vivo el mapeo mientras se usen
+    view = memoryview(mapped)
+    return {name: view[offset:offset + size] for name, offset, size in toc}
+
+# ============= TRIE DE PREFIJOS =============
+class PrefixTrie:
+    """Trie de palabras para encontrar cuál de ellas es prefijo de un texto"""
+    
+    def __init__(self, words):
+        self.words = list(words)
+        self.root = {}
+        for index, word in enumerate(self.words):
+            node = self.root
+            for ch in word:
+                node = node.setdefault(ch, {})
+            # La clave None marca fin de palabra; conserva la primera aparición
+            node.setdefault(None, index)
+    
+    def first_prefix(self, text):
+        """Devuelve la palabra prefijo de text que aparece primero en la lista, o None"""
+        node = self.root
+        best = None
+        for ch in text:
+            node = node.get(ch)
+            if node is None:
+                break
+            index = node.get(None)
+            if index is not None and (best is None or index < best):
+                best = index
+        return None if best is None else self.words[best]
+
+# ============= COMANDO ANALIZADO =============
+# Tabla única de normalización: acentos comunes y signos de puntuación a eliminar
+NORMALIZE_TABLE = str.maketrans({
+    'á': 'a', 'é': 'e', 'í': 'i', 'ó': 'o', 'ú': 'u', 'ü': 'u',
+    '¿': None, '?': None, '!': None
+})
+WHITESPACE_RE = re.compile(r'\s+')
+
+class ParsedCommand:
+    """Comando analizado una sola vez y compartido por todos los manejadores"""
+    
+    def __init__(self, original, text, normalized, activation_word=None):
+        self.original = original                # Texto reconocido tal cual
+        self.text = text                        # Minúsculas, sin palabra de activación
+        self.normalized = normalized            # Sin acentos, puntuación ni espacios repetidos
+        self.tokens = normalized.split()
+        self.activation_word = activation_word  # 'baro', 'varo' o None
+        self.is_question = False                # Empieza con una palabra de pregunta
+        self.question_type = None
+        self.topic = None
+        self.slots = {}                         # Slots tipados de SlotGrammar
+
+# ============= CACHÉ LRU =============
+class LRUCache:
+    """Caché LRU acotada y segura entre hilos, con contadores de aciertos y desalojos"""
+    
+    _MISSING = object()
+    
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get_or_compute(self, key, compute):
+        """Devuelve el valor guardado para key o lo calcula con compute() y lo guarda"""
+        with self._lock:
+            value = self._data.get(key, self._MISSING)
+            if value is not self._MISSING:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+        
+        # Se calcula fuera del candado; si dos hilos coinciden, gana el último
+        value = compute()
+        if self.maxsize > 0:
+            with self._lock:
+                self._data[key] = value
+                self._data.move_to_end(key)
+                self._evict()
+        return value
+    
+    def get(self, key, default=None):
+        """Valor guardado para key (cuenta como acierto o fallo), o default"""
+        with self._lock:
+            value = self._data.get(key, self._MISSING)
+            if value is self._MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def put(self, key, value):
+        if self.maxsize > 0:
+            with self._lock:
+                self._data[key] = value
+                self._data.move_to_end(key)
+                self._evict()
+    
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def discard_matching(self, predicate):
+        """Elimina las entradas cuya clave cumple predicate; devuelve cuántas"""
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+    
+    def _evict(self):
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+    
+    def resize(self, maxsize):
+        """Cambia el tamaño máximo (0 desactiva la caché)"""
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+    
+    def clear(self):
+        """Vacía la caché (los contadores se conservan)"""
+        with self._lock:
+            self._data.clear()
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+# ============= GRAMÁTICA DE SLOTS =============
+# Idiomas de destino (nombre normalizado -> nombre para mostrar, código)
+LANGUAGES = {
+    'ingles': ('inglés', 'en'), 'frances': ('francés', 'fr'), 'aleman': ('alemán', 'de'),
+    'italiano': ('italiano', 'it'), 'portugues': ('portugués', 'pt'), 'chino': ('chino', 'zh'),
+    'japones': ('japonés', 'ja'), 'ruso': ('ruso', 'ru'), 'arabe': ('árabe', 'ar'),
+    'coreano': ('coreano', 'ko'), 'tailandes': ('tailandés', 'th'), 'vietnamita': ('vietnamita', 'vi'),
+    'holandes': ('holandés', 'nl'), 'sueco': ('sueco', 'sv'), 'noruego': ('noruego', 'no'),
+    'danes': ('danés', 'da'), 'griego': ('griego', 'el'), 'turco': ('turco', 'tr'),
+    'hindi': ('hindi', 'hi'), 'bengali': ('bengalí', 'bn'),
+}
+
+# Fuentes de noticias reconocidas (patrón -> fuente de get_news)
+NEWS_SOURCES = {'bbc': 'bbc', 'cnn': 'cnn', r'(?:el\s*)?pais': 'elpais'}
+
+# Palabras de tiempo que no forman parte del nombre de una ciudad
+TIME_WORDS = ['hoy', 'ahora', 'ahorita', 'manana', 'mañana', 'actual', 'ahora mismo',
+              'pasado manana', 'pasado mañana', 'esta manana', 'esta mañana', 'por la manana', 'por la mañana',
+              'esta tarde', 'por la tarde', 'esta noche', 'por la noche',
+              'la manana', 'la mañana', 'la tarde', 'la noche']
+
+class SlotGrammar:
+    """Extrae slots tipados de un comando normalizado en una sola pasada.
+    
+    Todas las reglas van en una única expresión; las que capturan la cola del
+    texto (lugar, expresión) usan anticipación para no consumirla y dejar que
+    el resto de reglas sigan encontrando coincidencias, y se cortan antes del
+    idioma de destino, de las palabras de tiempo o de "en la calculadora". La
+    ciudad solo se extrae para las intenciones de city_intents (clima y hora).
+    """
+    
+    city_intents = frozenset({'clima', 'hora'})
+    
+    def __init__(self, languages=LANGUAGES, news_sources=NEWS_SOURCES, time_words=TIME_WORDS):
+        self.languages = languages
+        self.news_sources = list(news_sources.values())
+        
+        def words(options):
+            return '|'.join(sorted(options, key=len, reverse=True))
+        
+        language = words(re.escape(name) for name in languages)
+        news = '|'.join(f'(?P<news_{i}>{pattern})' for i, pattern in enumerate(news_sources))
+        time = words(re.escape(word) for word in time_words)
+        # Marcas de otros slots que terminan una cola: idioma, tiempo o "en la calculadora"
+        tail_end = rf'(?:\s+(?:(?:al|en|a)\s+(?:{language})|{time}|(?:en|con)\s+(?:la\s+)?calculadora)\b.*)?$'
+        self.regex = re.compile('|'.join([
+            rf'\b(?:al|en|a)\s+(?P<target_language>{language})\b',
+            rf'\b(?:{news})\b',
+            rf'\b(?:calcula(?:me|r)?|cuanto\s+(?:me\s+)?(?:es|son|da)|resuelve|resultado\s+de|opera)\s+(?=(?P<math_expression>.+?){tail_end})',
+            rf'\b(?:donde\s+(?:queda|esta|se\s+encuentra)|como\s+llegar\s+a|ruta\s+a|mapa\s+de|quiero\s+ir\s+a)\s+(?=(?P<place>.+?){tail_end})',
+        ]))
+        # La ciudad no puede empezar por una palabra de tiempo ("clima para mañana")
+        self.city_regex = re.compile(
+            rf'\b(?:en|para)\s+(?!(?:{time})\b)(?P<city>(?:(?!\b(?:en|para)\s).)+?){tail_end}'
+        )
+        # Verbos de traducción que preceden al texto a traducir
+        self.translate_prefix = re.compile(
+            r'^(?:(?:traduce(?:me)?|traducir|traduccion\s+de|como\s+(?:se\s+dice|digo)|que\s+es|dime|por\s+favor)\s+)+'
+        )
+    
+    def extract(self, text, intent=None):
+        """Devuelve un diccionario con los slots encontrados en el texto normalizado"""
+        slots = {}
+        if intent in self.city_intents:
+            match = self.city_regex.search(text)
+            if match:
+                slots['city'] = match.group('city').strip()
+        language_match = None
+        for match in self.regex.finditer(text):
+            kind = match.lastgroup
+            if kind == 'target_language':
+                if language_match is None:
+                    language_match = match
+                    name, code = self.languages[match.group(kind)]
+                    slots['target_language'] = code
+                    slots['language_name'] = name
+            elif kind.startswith('news_'):
+                slots.setdefault('news_source', self.news_sources[int(kind[5:])])
+            elif match.group(kind):
+                slots.setdefault(kind, match.group(kind).strip())
+        
+        # Texto a traducir: lo que va antes del idioma sin el verbo, o lo que va después
+        if language_match:
+            source = self.translate_prefix.sub('', text[:language_match.start()].strip() + ' ').strip()
+            if not source:
+                source = text[language_match.end():].strip()
+            if source:
+                slots['source_text'] = source
+        return slots
 
 # ============= SISTEMA DE NLP MEJORADO =============
 class NLPProcessor:
@@ -199,40 +850,287 @@ class NLPProcessor:
             'razon': r'(por qué|porque|para qué|motivo)\s+(.+)',
             'cantidad': r'(cuánto|cuanto|cuánta|cuanta|cuántos|cuantos|cuántas|cuantas)\s+(.+)'
         }
+        
+        # Palabras de activación del asistente
+        self.activation_words = ['baro', 'varo']
+        
+        # Palabras a eliminar al extraer consultas (activación y relleno)
+        self.stop_words = frozenset([
+            'baro', 'varo', 'por favor', 'porfavor', 'gracias',
+            'como', 'cómo', 'está', 'esta', 'el', 'la', 'de', 'en',
+            'qué', 'que', 'me', 'dime', 'dame', 'ayúdame', 'ayudame'
+        ])
+        
+        # Frases de PRIORIDAD 1 (se evalúan antes que los sinónimos)
+        self.priority_patterns = {
+            'hora': [
+                'qué hora', 'que hora', 'cual es la hora', 'cuál es la hora',
+                'hora actual', 'me dices la hora', 'dime la hora',
+                'dame la hora', 'me das la hora', 'decime la hora', 'avísame la hora',
+                'avisame la hora', 'marca la hora', 'di la hora', 'hora de ahora',
+                'hora exacta', 'hora precisa', 'la hora exacta'
+            ],
+            'fecha': [
+                'qué día', 'que dia', 'cuál es la fecha', 'cual es la fecha',
+                'fecha actual', 'día de hoy', 'dia de hoy', 'hoy es', 'qué fecha',
+                'que fecha', 'dime la fecha', 'dame la fecha', 'la fecha de hoy',
+                'fecha de hoy', 'día actual', 'dia actual', 'fecha exacta',
+                'cuándo es hoy', 'cuando es hoy', 'mes y día', 'mes y dia'
+            ],
+            'ubicacion_usuario': [
+                'dónde estoy', 'donde estoy', 'mi ubicación', 'mi ubicacion',
+                'mi localización', 'mi localizacion', 'donde me encuentro', 'donde estoy',
+                'dónde me encuentro', 'mi posición', 'ubicacion actual', 'ubicación actual'
+            ],
+            'identidad': [
+                'quién eres', 'quien eres',
+                'qué eres', 'que eres', 'cómo fuiste hecho', 'como fuiste hecho',
+                'cómo fuiste creado', 'como fuiste creado', 'quién te creó', 'quien te creo',
+                'quién te hizo', 'quien te hizo', 'tu nombre', 'preséntate', 'presentate'
+            ]
+        }
+        
+        # Caché de resultados por comando normalizado (BARO_NLP_CACHE_SIZE, 0 la desactiva)
+        self.cache = LRUCache(int(os.environ.get('BARO_NLP_CACHE_SIZE', 4096)))
+        
+        # Umbrales del clasificador estadístico de respaldo (PRIORIDAD 3)
+        self.fallback_min_confidence = 0.6
+        self.fallback_min_similarity = 0.3
+        
+        self.compile_patterns()
+    
+    def compile_patterns(self):
+        """Compila los patrones de pregunta y carga los índices precompilados"""
+        # Patrones de pregunta en una sola expresión: cada tipo va en su propia
+        # anticipación con el tema como grupo con nombre, así gana el primer tipo
+        # que aparezca en cualquier parte del texto (igual que probarlos en orden)
+        alternatives = []
+        for q_type, pattern in self.question_patterns.items():
+            prefix = pattern[:-len('(.+)')].replace('(', '(?:')
+            alternatives.append(f'(?=.*?{prefix}(?P<{q_type}>.+))')
+        self.question_regex = re.compile('(?:' + '|'.join(alternatives) + ')')
+        self.question_trie = PrefixTrie(self.question_words)
+        self.slot_grammar = SlotGrammar()
+        
+        # Recorrido plano de sinónimos en el mismo orden que el diccionario
+        self.variations = [
+            (intent, variation)
+            for intent, variations in self.synonyms.items()
+            for variation in variations
+        ]
+        self.intent_names = list(self.synonyms)
+        self.priority_bits = {group: 1 << i for i, group in enumerate(self.priority_patterns)}
+        self._query_stop_words = {}
+        # El clasificador de respaldo se entrena en el primer uso
+        self.classifier = None
+        # Los resultados guardados dependen de las tablas recién compiladas
+        self.cache.clear()
+        
+        self.load_compiled()
+    
+    def reload_synonyms(self, synonyms=None, priority_patterns=None):
+        """Sustituye las tablas de sinónimos/prioridad, recompila e invalida la caché"""
+        if synonyms is not None:
+            self.synonyms = synonyms
+        if priority_patterns is not None:
+            self.priority_patterns = priority_patterns
+        self.compile_patterns()
+    
+    def source_hash(self):
+        """Huella de las tablas de las que sale el artefacto compilado"""
+        source = json.dumps({
+            'version': NLP_ARTIFACT_VERSION,
+            'byteorder': sys.byteorder,
+            'synonyms': self.synonyms,
+            'priority_patterns': self.priority_patterns,
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(source.encode('utf-8')).digest()
+    
+    def load_compiled(self, path=None, rebuild=False):
+        """Mapea el artefacto compilado; si falta o está desactualizado lo regenera"""
+        path = path or NLP_ARTIFACT_PATH
+        source_hash = self.source_hash()
+        sections = None if rebuild else read_nlp_artifact(path, source_hash)
+        if sections is None:
+            built = self._compile_sections()
+            try:
+                write_nlp_artifact(path, source_hash, built)
+                sections = read_nlp_artifact(path, source_hash)
+            except OSError as e:
+                print(f"Error guardando artefacto NLP: {e}")
+            if sections is None:
+                # Sin artefacto en disco se usan las secciones recién compiladas
+                sections = {name: memoryview(bytes(data)) for name, data in built.items()}
+        self._attach(sections)
+        return path
+    
+    def _compile_sections(self):
+        """Compila autómata, índice difuso y matriz de conteo de caracteres en buffers planos"""
+        phrase_ids = {}
+        groups = []
+        intents = []
+        indexes = []
+        
+        def add_phrase(phrase):
+            if phrase not in phrase_ids:
+                phrase_ids[phrase] = len(phrase_ids)
+                groups.append(0)
+                intents.append(-1)
+                indexes.append(-1)
+            return phrase_ids[phrase]
+        
+        for group, patterns in self.priority_patterns.items():
+            for pattern in patterns:
+                groups[add_phrase(pattern)] |= self.priority_bits[group]
+        
+        # Solo la primera aparición de cada variación puede ganar un empate
+        intent_ids = {intent: i for i, intent in enumerate(self.intent_names)}
+        for index, (intent, variation) in enumerate(self.variations):
+            phrase_id = add_phrase(variation)
+            if intents[phrase_id] < 0:
+                intents[phrase_id] = intent_ids[intent]
+                indexes[phrase_id] = index
+        
+        matcher = PhraseMatcher.build(list(phrase_ids))
+        fuzzy = FuzzyIndex.build(variation for _, variation in self.variations)
+        
+        # Matriz de conteo de caracteres (variaciones x rasgos) para clasificación por lotes:
+        # el rasgo (c, k) vale 1 si la variación tiene al menos k veces el carácter c, así
+        # el producto con la de un comando da los caracteres compartidos de quick_ratio.
+        # Las máscaras tienen un bit por posición de cada carácter para el LCS por bits;
+        # las variaciones de más de 63 caracteres no caben en un uint64 y se quedan a cero
+        alphabet = sorted({ch for _, variation in self.variations for ch in variation})
+        columns = {ch: i for i, ch in enumerate(alphabet)}
+        features = {}
+        rows, cols = [], []
+        masks = [[0] * (len(alphabet) + 1) for _ in self.variations]
+        for row, (_, variation) in enumerate(self.variations):
+            for ch, count in Counter(variation).items():
+                for level in range(1, count + 1):
+                    rows.append(row)
+                    cols.append(features.setdefault((columns[ch], level), len(features)))
+            if len(variation) <= 63:
+                for position, ch in enumerate(variation):
+                    masks[row][columns[ch]] |= 1 << position
+        matrix = np.zeros((len(self.variations), len(features)), dtype=np.float32)
+        matrix[rows, cols] = 1
+        
+        return {
+            'pm_alphabet': ''.join(sorted(matcher.alphabet, key=matcher.alphabet.get)).encode('utf-8'),
+            'pm_table': matcher.table,
+            'pm_out_start': matcher.out_start,
+            'pm_out_ids': matcher.out_ids,
+            'ph_length': array('i', (len(phrase) for phrase in phrase_ids)),
+            'ph_groups': array('i', groups),
+            'ph_intent': array('i', intents),
+            'ph_index': array('i', indexes),
+            'var_intent': array('i', (intent_ids[intent] for intent, _ in self.variations)),
+            'fz_entries': fuzzy.entries,
+            'fz_len_start': fuzzy.length_start,
+            'fz_cnt_start': fuzzy.count_start,
+            'fz_cnt_chars': fuzzy.count_chars,
+            'fz_cnt_values': fuzzy.count_values,
+            'cc_shape': array('i', matrix.shape),
+            'cc_matrix': matrix,
+            'cc_codes': array('i', (ord(ch) for ch in alphabet)),
+            'cc_feat_col': array('i', (col for col, _ in features)),
+            'cc_feat_level': array('i', (level for _, level in features)),
+            'cc_masks': np.array(masks, dtype=np.uint64),
+        }
+    
+    def _attach(self, sections):
+        """Enlaza los índices a las secciones (vistas de solo lectura, sin copiar)"""
+        ints = {name: view.cast('i') for name, view in sections.items()
+                if name not in ('pm_alphabet', 'cc_matrix', 'cc_masks')}
+        
+        self.phrase_matcher = PhraseMatcher(
+            str(sections['pm_alphabet'], 'utf-8'),
+            ints['pm_table'], ints['pm_out_start'], ints['pm_out_ids']
+        )
+        self.phrase_lengths = ints['ph_length']
+        self.phrase_groups = ints['ph_groups']
+        self.phrase_intent = ints['ph_intent']
+        self.phrase_index = ints['ph_index']
+        self.variation_intent = ints['var_intent']
+        self.fuzzy_index = FuzzyIndex(
+            [variation for _, variation in self.variations],
+            ints['fz_entries'], ints['fz_len_start'],
+            ints['fz_cnt_start'], ints['fz_cnt_chars'], ints['fz_cnt_values']
+        )
+        
+        rows, cols = ints['cc_shape']
+        self.char_count_matrix = np.frombuffer(sections['cc_matrix'], dtype=np.float32).reshape(rows, cols)
+        self.char_codes = np.frombuffer(sections['cc_codes'], dtype=np.int32)
+        self.char_feature_cols = np.frombuffer(sections['cc_feat_col'], dtype=np.int32)
+        self.char_feature_levels = np.frombuffer(sections['cc_feat_level'], dtype=np.int32)
+        self.char_masks = np.frombuffer(sections['cc_masks'], dtype=np.uint64).reshape(rows, len(self.char_codes) + 1)
+        self.variation_lengths = np.array([len(variation) for _, variation in self.variations], dtype=np.float32)
+    
+    def query_stop_words(self, intent):
+        """Palabras vacías de una intención (relleno + sus sinónimos), calculadas al primer uso"""
+        stop_words = self._query_stop_words.get(intent)
+        if stop_words is None:
+            variations = self.synonyms.get(intent)
+            stop_words = self.stop_words | frozenset(variations) if variations else self.stop_words
+            self._query_stop_words[intent] = stop_words
+        return stop_words
     
     def normalize_text(self, text):
         """Normaliza el texto eliminando caracteres especiales y estandarizando"""
-        text = text.lower().strip()
-        # Reemplazar acentos comunes
-        replacements = {
-            'á': 'a', 'é': 'e', 'í': 'i', 'ó': 'o', 'ú': 'u',
-            'ü': 'u', 'ñ': 'ñ'
-        }
-        for old, new in replacements.items():
-            text = text.replace(old, new)
-        # Eliminar puntuación múltiple
-        text = re.sub(r'[¿?!]+', '', text)
-        text = re.sub(r'\s+', ' ', text)
-        return text.strip()
+        # Acentos y puntuación en una sola pasada, luego espacios repetidos
+        text = text.lower().translate(NORMALIZE_TABLE)
+        return WHITESPACE_RE.sub(' ', text).strip()
+    
+    def parse(self, command):
+        """Analiza el comando una sola vez: activación, normalización, tokens y tipo de pregunta"""
+        text = command.lower().strip()
+        activation_word = None
+        for word in self.activation_words:
+            if text.startswith(word):
+                text = text[len(word):].strip()
+                activation_word = word
+                break
+        
+        parsed = ParsedCommand(command, text, self.normalize_text(text), activation_word)
+        # La comprobación de pregunta mira el texto con acentos, como siempre
+        parsed.is_question = self.question_trie.first_prefix(text) is not None
+        parsed.question_type, parsed.topic = self._question_type(parsed.normalized)
+        parsed.slots = self.command_slots(parsed)
+        return parsed
+    
+    def command_slots(self, parsed, intent=None):
+        """Slots del comando; la ciudad solo se extrae si la intención la usa (clima, hora)"""
+        city = intent in self.slot_grammar.city_intents
+        # Los slots se comparten entre comandos iguales: los manejadores solo los leen
+        return self.cache.get_or_compute(
+            ('slots', parsed.normalized, city), lambda: self.slot_grammar.extract(parsed.normalized, intent)
+        )
+    
+    def _normalized(self, command):
+        """Texto normalizado de un ParsedCommand o de un texto sin analizar"""
+        if isinstance(command, ParsedCommand):
+            return command.normalized
+        return self.normalize_text(command)
     
     def similarity(self, a, b):
         """Calcula similitud entre dos textos"""
         return SequenceMatcher(None, a, b).ratio()
     
-    def detect_intent(self, command):
-        """Detecta la intención del comando usando NLP mejorado y robusto"""
-        command_norm = self.normalize_text(command)
+    def _match_phrases(self, command_norm):
+        """Frases encontradas por el autómata y grupos de prioridad que activan"""
+        matched = self.phrase_matcher.find(command_norm)
+        groups = 0
+        for phrase_id in matched:
+            groups |= self.phrase_groups[phrase_id]
+        return matched, groups
+    
+    def _priority_intent(self, command_norm, groups):
+        """Reglas de PRIORIDAD 1; devuelve (intención, confianza) o None"""
+        bits = self.priority_bits
         
-        # PRIORIDAD 1: Detección exacta de palabras clave críticas (HORA)
+        # Detección exacta de palabras clave críticas (HORA)
         # Excluir búsquedas que tengan 'en' (hora en lugar específico)
-        hora_patterns = [
-            'qué hora', 'que hora', 'cual es la hora', 'cuál es la hora',
-            'hora actual', 'me dices la hora', 'dime la hora',
-            'dame la hora', 'me das la hora', 'decime la hora', 'avísame la hora',
-            'avisame la hora', 'marca la hora', 'di la hora', 'hora de ahora',
-            'hora exacta', 'hora precisa', 'la hora exacta'
-        ]
-        if any(pattern in command_norm for pattern in hora_patterns):
+        if groups & bits['hora']:
             # Si tiene "en [ciudad]" es búsqueda de hora en lugar específico
             if ' en ' in command_norm and not command_norm.endswith('en'):
                 return 'hora', 0.95
@@ -240,77 +1138,222 @@ class NLPProcessor:
             elif 'wikipedia' not in command_norm and 'busca' not in command_norm:
                 return 'hora', 0.99
         
-        # PRIORIDAD 1: Detección exacta de palabras clave críticas (FECHA)
-        fecha_patterns = [
-            'qué día', 'que dia', 'cuál es la fecha', 'cual es la fecha',
-            'fecha actual', 'día de hoy', 'dia de hoy', 'hoy es', 'qué fecha',
-            'que fecha', 'dime la fecha', 'dame la fecha', 'la fecha de hoy',
-            'fecha de hoy', 'día actual', 'dia actual', 'fecha exacta',
-            'cuándo es hoy', 'cuando es hoy', 'mes y día', 'mes y dia'
-        ]
-        if any(pattern in command_norm for pattern in fecha_patterns):
+        # Detección exacta de palabras clave críticas (FECHA)
+        if groups & bits['fecha']:
             return 'fecha', 0.98
         
-        # PRIORIDAD 1: Ubicación del usuario
-        ubicacion_usuario = [
-            'dónde estoy', 'donde estoy', 'mi ubicación', 'mi ubicacion',
-            'mi localización', 'mi localizacion', 'donde me encuentro', 'donde estoy',
-            'dónde me encuentro', 'mi posición', 'ubicacion actual', 'ubicación actual'
-        ]
-        if any(pattern in command_norm for pattern in ubicacion_usuario):
+        # Ubicación del usuario
+        if groups & bits['ubicacion_usuario']:
             return 'ubicación', 0.98
         
-        # PRIORIDAD 1: Identidad - Preguntas sobre quién eres/creación
-        identidad_patterns = [
-            'quién eres', 'quien eres',
-            'qué eres', 'que eres', 'cómo fuiste hecho', 'como fuiste hecho',
-            'cómo fuiste creado', 'como fuiste creado', 'quién te creó', 'quien te creo',
-            'quién te hizo', 'quien te hizo', 'tu nombre', 'preséntate', 'presentate'
-        ]
-        if any(pattern in command_norm for pattern in identidad_patterns):
+        # Identidad - Preguntas sobre quién eres/creación
+        if groups & bits['identidad']:
             # Excluir búsquedas "quién es [persona]" que van a Wikipedia
             if 'quién es ' not in command_norm and 'quien es ' not in command_norm:
                 if 'wikipedia' not in command_norm and 'busca' not in command_norm:
                     return 'identidad', 0.99
         
+        return None
+    
+    def detect_intent(self, command):
+        """Detecta la intención del comando usando NLP mejorado y robusto"""
+        command_norm = self._normalized(command)
+        return self.cache.get_or_compute(('intent', command_norm), lambda: self._detect_intent(command_norm))
+    
+    def _detect_intent(self, command_norm):
+        """Puntuación de intenciones sin caché"""
+        # PRIORIDAD 1: Palabras clave críticas (hora, fecha, ubicación, identidad)
+        matched, groups = self._match_phrases(command_norm)
+        priority = self._priority_intent(command_norm, groups)
+        if priority:
+            return priority
+        
         # PRIORIDAD 2: Buscar coincidencias exactas o similares en sinónimos
+        # Cada candidato lleva su posición en el recorrido de sinónimos
+        # (exacta = 2*i, similitud = 2*i+1) para desempatar igual que antes
         best_match = None
         best_score = 0
+        best_order = None
         
-        for intent, variations in self.synonyms.items():
-            for variation in variations:
-                # Búsqueda exacta
-                if variation in command_norm:
-                    # Puntaje basado en longitud y posición
-                    score = 0.9 - (0.1 * (len(command_norm) - len(variation)) / len(command_norm))
-                    score = max(score, 0.5)
-                    
-                    if score > best_score:
-                        best_score = score
-                        best_match = intent
-                
-                # Búsqueda por similitud
-                sim = self.similarity(command_norm, variation)
-                if sim > 0.75 and sim > best_score:
-                    best_score = sim
-                    best_match = intent
+        for phrase_id in matched:
+            intent_id = self.phrase_intent[phrase_id]
+            if intent_id < 0:
+                continue
+            # Puntaje basado en longitud y posición
+            score = 0.9 - (0.1 * (len(command_norm) - self.phrase_lengths[phrase_id]) / len(command_norm))
+            score = max(score, 0.5)
+            order = 2 * self.phrase_index[phrase_id]
+            if score > best_score or (score == best_score and order < best_order):
+                best_score = score
+                best_match = self.intent_names[intent_id]
+                best_order = order
+        
+        # Búsqueda por similitud (solo candidatos que aún pueden ganar)
+        index, sim = self.fuzzy_index.best_match(command_norm, 0.75, best_score)
+        if index is not None:
+            order = 2 * index + 1
+            if sim > best_score or (sim == best_score and order < best_order):
+                best_score = sim
+                best_match = self.intent_names[self.variation_intent[index]]
         
         return best_match, best_score
     
+    def _char_ids(self, texts):
+        """Matriz (textos x longitud máxima) de columnas del alfabeto; len(alfabeto) = otro carácter o relleno"""
+        codes = self.char_codes
+        lengths = np.array([len(text) for text in texts], dtype=np.int64)
+        ids = np.full((len(texts), max(lengths.max(initial=0), 1)), len(codes), dtype=np.int64)
+        flat = np.frombuffer(''.join(texts).encode('utf-32-le'), dtype=np.int32)
+        cols = np.minimum(np.searchsorted(codes, flat), len(codes) - 1)
+        cols[codes[cols] != flat] = len(codes)
+        rows = np.repeat(np.arange(len(texts)), lengths)
+        ids[rows, np.arange(len(flat)) - np.repeat(np.cumsum(lengths) - lengths, lengths)] = cols
+        return ids, lengths
+    
+    @staticmethod
+    def _lcs_lengths(ids, rows, masks, variation_lengths):
+        """Longitud del LCS de cada pareja (fila de ids, variación) con el algoritmo por bits de Hyyrö"""
+        pairs = np.arange(len(rows))
+        full = (np.uint64(1) << np.minimum(variation_lengths, 63).astype(np.uint64)) - np.uint64(1)
+        vector = full.copy()
+        for position in range(ids.shape[1]):
+            shared = vector & masks[pairs, ids[rows, position]]
+            vector = ((vector + shared) | (vector - shared)) & full
+        return variation_lengths.astype(np.int64) - np.bitwise_count(vector)
+    
+    def detect_intents(self, commands, top_k=3, batch_size=1024):
+        """Clasifica una lista de comandos con las mismas reglas que detect_intent.
+        
+        Devuelve, por comando, las top_k parejas (intención, confianza). Cada intención
+        puntúa como en detect_intent: su mejor frase exacta o su variación más parecida
+        por encima de 0.75, y las reglas de PRIORIDAD 1 encabezan el resultado; así el
+        primero coincide con detect_intent y un comando sin intención da una lista vacía.
+        Las cotas de similitud se calculan para todo el lote con NumPy (caracteres
+        compartidos con un producto de matrices, luego el LCS por bits) y SequenceMatcher
+        solo se ejecuta con las variaciones que aún pueden mejorar el resultado.
+        """
+        results = []
+        texts = self.fuzzy_index.texts
+        width = len(self.char_codes) + 1
+        fits = self.variation_lengths <= 63
+        matchers = {}
+        for start in range(0, len(commands), batch_size):
+            batch = [self.normalize_text(c) for c in commands[start:start + batch_size]]
+            ids, lengths = self._char_ids(batch)
+            
+            # Cota quick_ratio contra todas las variaciones: el rasgo (c, k) indica
+            # al menos k apariciones de c, así el producto cuenta los caracteres compartidos
+            counts = np.bincount((np.arange(len(batch))[:, None] * width + ids).ravel(),
+                                 minlength=len(batch) * width).reshape(len(batch), width)
+            features = (counts[:, self.char_feature_cols] >= self.char_feature_levels).astype(np.float32)
+            shared = features @ self.char_count_matrix.T
+            # 2 * shared / total > 0.75 sin dividir toda la matriz (enteros exactos en float32)
+            margin = shared * 8 - self.variation_lengths * 3 > lengths.astype(np.float32)[:, None] * 3
+            rows, cols = np.divmod(np.flatnonzero(margin), margin.shape[1])
+            totals = lengths[rows] + self.variation_lengths[cols].astype(np.int64)
+            bounds = 2.0 * shared[rows, cols] / totals
+            
+            # Cota más ajustada con el LCS: los bloques de SequenceMatcher son una subsecuencia común
+            if rows.size:
+                lcs = self._lcs_lengths(ids, rows, self.char_masks[cols], self.variation_lengths[cols])
+                bounds = np.where(fits[cols], 2.0 * lcs / totals, bounds)
+            # Candidatos de cada comando de mayor a menor cota (y por posición en los empates)
+            keep = np.flatnonzero(bounds > 0.75)
+            keep = keep[np.lexsort((cols[keep], -bounds[keep]))]
+            candidates = [[] for _ in batch]
+            for row, index, bound in zip(rows[keep].tolist(), cols[keep].tolist(), bounds[keep].tolist()):
+                candidates[row].append((bound, index))
+            
+            for row, command_norm in enumerate(batch):
+                # Mejor (puntaje, -orden) por intención, con el orden de detect_intent
+                best = {}
+                matched, groups = self._match_phrases(command_norm)
+                for phrase_id in matched:
+                    intent_id = self.phrase_intent[phrase_id]
+                    if intent_id < 0:
+                        continue
+                    score = 0.9 - (0.1 * (len(command_norm) - self.phrase_lengths[phrase_id]) / len(command_norm))
+                    key = (max(score, 0.5), -2 * self.phrase_index[phrase_id])
+                    if key > best.get(intent_id, (0, 0)):
+                        best[intent_id] = key
+                
+                # Similitud: de mayor a menor cota, solo si puede mejorar su intención
+                for bound, index in candidates[row]:
+                    intent_id = self.variation_intent[index]
+                    order = -(2 * index + 1)
+                    if (bound, order) < best.get(intent_id, (0, 0)):
+                        continue
+                    matcher = matchers.get(index)
+                    if matcher is None:
+                        matcher = matchers[index] = SequenceMatcher(None, '', texts[index])
+                    matcher.set_seq1(command_norm)
+                    score = matcher.ratio()
+                    if score > 0.75 and (score, order) > best.get(intent_id, (0, 0)):
+                        best[intent_id] = (score, order)
+                
+                ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)
+                top = [(self.intent_names[intent_id], float(score)) for intent_id, (score, _) in ranked[:top_k]]
+                priority = self._priority_intent(command_norm, groups)
+                if priority:
+                    # La regla de prioridad siempre encabeza el resultado
+                    top = [(priority[0], float(priority[1]))] + [t for t in top if t[0] != priority[0]][:top_k - 1]
+                results.append(top)
+        return results
+    
+    def train_classifier(self, interactions=None):
+        """Entrena el clasificador con los sinónimos y las interacciones registradas.
+        
+        interactions es una lista de (comando, intención); si es None se leen de la
+        base de datos las de confianza alta decididas por las reglas. Los
+        resultados de respaldo en caché se descartan porque salían del modelo anterior.
+        """
+        if interactions is None:
+            interactions = load_training_interactions()
+        samples = [(self.normalize_text(v), intent) for intent, v in self.variations]
+        samples += [
+            (self.normalize_text(command), intent)
+            for command, intent in interactions
+            if intent in self.synonyms
+        ]
+        self.classifier = IntentClassifier().fit(samples)
+        self.cache.discard_matching(lambda key: key[0] == 'fallback')
+        return self.classifier
+    
+    def classify(self, command, top_k=3):
+        """Intenciones ordenadas por el clasificador estadístico: [(intención, confianza)]"""
+        if self.classifier is None:
+            self.train_classifier()
+        ranked = self.classifier.predict(self._normalized(command), top_k)
+        return [(intent, confidence) for intent, confidence, _ in ranked]
+    
+    def fallback_intent(self, command):
+        """PRIORIDAD 3: intención del clasificador si supera los umbrales, o None"""
+        command_norm = self._normalized(command)
+        return self.cache.get_or_compute(('fallback', command_norm), lambda: self._fallback_intent(command_norm))
+    
+    def _fallback_intent(self, command_norm):
+        """Clasificador de respaldo sin caché"""
+        if self.classifier is None:
+            self.train_classifier()
+        ranked = self.classifier.predict(command_norm, 1)
+        if ranked:
+            intent, confidence, sim = ranked[0]
+            if confidence >= self.fallback_min_confidence and sim >= self.fallback_min_similarity:
+                return intent, confidence
+        return None
+    
     def extract_query(self, command, intent):
         """Extrae la consulta principal del comando"""
-        command_norm = self.normalize_text(command)
-        
+        command_norm = self._normalized(command)
+        return self.cache.get_or_compute(
+            ('query', command_norm, intent), lambda: self._extract_query(command_norm.split(), intent)
+        )
+    
+    def _extract_query(self, words, intent):
+        """Filtra las palabras vacías de la intención (sin caché)"""
         # Palabras a eliminar: activación, de relleno y de intención
-        stop_words = [
-            'baro', 'varo', 'por favor', 'porfavor', 'gracias',
-            'como', 'cómo', 'está', 'esta', 'el', 'la', 'de', 'en',
-            'qué', 'que', 'me', 'dime', 'dame', 'ayúdame', 'ayudame'
-        ]
-        if intent and intent in self.synonyms:
-            stop_words.extend(self.synonyms[intent])
+        stop_words = self.query_stop_words(intent)
         
-        words = command_norm.split()
         filtered_words = [w for w in words if w not in stop_words and len(w) > 2]
         
         # Asegurar que solo quedemos con palabras significativas
@@ -324,19 +1367,26 @@ class NLPProcessor:
     
     def detect_question_type(self, command):
         """Detecta el tipo de pregunta y extrae el tema"""
-        command_norm = self.normalize_text(command)
-        
-        for q_type, pattern in self.question_patterns.items():
-            match = re.search(pattern, command_norm)
-            if match:
-                topic = match.groups()[-1]
-                return q_type, topic
+        if isinstance(command, ParsedCommand):
+            return command.question_type, command.topic
+        return self._question_type(self.normalize_text(command))
+    
+    def _question_type(self, command_norm):
+        """Tipo de pregunta y tema a partir del texto ya normalizado"""
+        return self.cache.get_or_compute(('qtype', command_norm), lambda: self._match_question(command_norm))
+    
+    def _match_question(self, command_norm):
+        """Patrones de pregunta sin caché"""
+        match = self.question_regex.match(command_norm)
+        if match:
+            q_type = match.lastgroup
+            return q_type, match.group(q_type)
         
         # Detectar si es una pregunta general
-        for qw in self.question_words:
-            if command_norm.startswith(qw):
-                topic = command_norm.replace(qw, '').strip()
-                return 'general', topic
+        qw = self.question_trie.first_prefix(command_norm)
+        if qw:
+            topic = command_norm.replace(qw, '').strip()
+            return 'general', topic
         
         return None, None
 
@@ -358,39 +1408,1045 @@ def generate_audio(text):
             os.unlink(temp_path)
             return data
 
-        return asyncio.run(_gen())
-    except Exception as e:
-        print(f"Error generando audio: {e}")
-        return None
+        return asyncio.run(_gen())
+    except Exception as e:
+        print(f"Error generando audio: {e}")
+        return None
+
+# ============= ALMACENAMIENTO SQLITE =============
+# Ruta de la base de datos (BARO_DB_PATH)
+DB_PATH = os.environ.get('BARO_DB_PATH', 'baro.db')
+
+class PoolLease:
+    """Conexión del pool prestada a un hilo; vuelve al pool con give_back() o al terminar el hilo"""
+    
+    __slots__ = ('storage', 'conn')
+    
+    def __init__(self, storage, conn):
+        self.storage = storage
+        self.conn = conn
+    
+    def give_back(self):
+        conn, self.conn = self.conn, None
+        if conn is not None:
+            self.storage._return(conn)
+    
+    def __del__(self):
+        # El estado local de un hilo se descarta al terminar: su conexión no se pierde
+        try:
+            self.give_back()
+        except Exception:
+            pass
+
+class Storage:
+    """Pool acotado de conexiones SQLite persistentes, en modo WAL.
+    
+    Cada hilo toma una conexión del pool la primera vez que la necesita y la
+    reutiliza (con su caché de sentencias preparadas y sus pragmas ya
+    aplicados) en lugar de abrir la base de datos en cada consulta. Las
+    peticiones de Flask la devuelven al pool con release() al terminar y los
+    demás hilos al acabar; los de larga vida la conservan. Como mucho se abren pool_size
+    conexiones: si no queda ninguna libre se espera checkout_timeout
+    segundos. Con WAL los lectores no se bloquean mientras otro hilo escribe.
+    """
+    
+    PRAGMAS = (
+        'PRAGMA busy_timeout=5000',     # Primero: los demás pragmas pueden esperar al bloqueo
+        'PRAGMA auto_vacuum=INCREMENTAL',  # Solo tiene efecto al crear la base (o tras un VACUUM)
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=NORMAL',    # Seguro con WAL, sin fsync en cada commit
+        'PRAGMA cache_size=-16000',     # 16 MB de caché de páginas
+        'PRAGMA mmap_size=268435456',   # Lecturas mapeadas en memoria (256 MB)
+        'PRAGMA temp_store=MEMORY',
+    )
+    
+    def __init__(self, path=DB_PATH, cached_statements=256, pool_size=10, checkout_timeout=5.0):
+        self.path = path
+        self.cached_statements = cached_statements
+        self.pool_size = pool_size
+        self.checkout_timeout = checkout_timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._idle = queue.Queue(pool_size)     # Conexiones del pool sin hilo asignado
+        self._created = 0
+        self._shared = []
+        self.checkouts = 0
+        self.waits = 0
+    
+    def connect(self, check_same_thread=True):
+        """Abre una conexión nueva con los pragmas de la aplicación"""
+        conn = sqlite3.connect(self.path, cached_statements=self.cached_statements,
+                               check_same_thread=check_same_thread)
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        if not check_same_thread:
+            with self._lock:
+                self._shared.append(conn)
+        return conn
+    
+    def _checkout(self):
+        """Conexión libre del pool; abre una nueva si aún no se llegó a pool_size"""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.pool_size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    conn = self.connect(check_same_thread=False)
+                except sqlite3.Error:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                with self._lock:
+                    self.waits += 1
+                try:
+                    conn = self._idle.get(timeout=self.checkout_timeout)
+                except queue.Empty:
+                    raise sqlite3.OperationalError(f"no hay conexiones libres en el pool ({self.pool_size})")
+        with self._lock:
+            self.checkouts += 1
+        return conn
+    
+    def _return(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.ProgrammingError:
+            return                              # Cerrada por close_all
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            # Solo tras close_all: el pool ya se vació y esta conexión sobra
+            conn.close()
+    
+    def connection(self):
+        """Conexión del hilo actual, tomada del pool en el primer uso"""
+        lease = getattr(self._local, 'lease', None)
+        if lease is None:
+            lease = self._local.lease = PoolLease(self, self._checkout())
+        return lease.conn
+    
+    def execute(self, sql, params=()):
+        return self.connection().execute(sql, params)
+    
+    def release(self):
+        """Devuelve al pool la conexión del hilo actual (al terminar cada petición)"""
+        lease = getattr(self._local, 'lease', None)
+        if lease is not None:
+            self._local.lease = None
+            lease.give_back()
+    
+    def close_all(self):
+        """Cierra las conexiones del pool y las compartidas (al terminar el proceso)"""
+        self.release()
+        with self._lock:
+            connections, self._shared = self._shared, []
+            self._created = 0
+            while True:
+                try:
+                    self._idle.get_nowait()
+                except queue.Empty:
+                    break
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                print(f"Error cerrando conexión: {e}")
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'pool_size': self.pool_size,
+                'open': self._created,
+                'idle': self._idle.qsize(),
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+            }
+
+# Tamaño del pool configurable con BARO_DB_POOL_SIZE
+storage = Storage(pool_size=int(os.environ.get('BARO_DB_POOL_SIZE', 10)))
+atexit.register(storage.close_all)
+
+# ============= REGISTRO DE INTERACCIONES =============
+class InteractionLogger:
+    """Escritor en segundo plano de la tabla interactions.
+    
+    Las peticiones solo encolan la fila; un hilo la escribe en lotes con
+    executemany, una transacción por lote, al llenarse el lote o al pasar
+    flush_interval segundos. Si la cola está llena se espera put_timeout y,
+    si sigue llena, la fila se descarta y se cuenta. Las respuestas se guardan
+    recortadas a max_response_chars caracteres (0 = completas).
+    """
+    
+    _STOP = object()
+    INSERT = '''INSERT INTO interactions (timestamp, command, response, intent, confidence, latency_ms, intent_source)
+                VALUES (?, ?, ?, ?, ?, ?, ?)'''
+    
+    def __init__(self, storage, max_queue=10000, batch_size=200, flush_interval=1.0, put_timeout=0.05,
+                 max_response_chars=500):
+        self.storage = storage
+        self.queue = queue.Queue(max_queue)
+        self.max_response_chars = max_response_chars
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._thread = None
+    
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='interaction-logger', daemon=True)
+            self._thread.start()
+    
+    def log(self, command, response, intent, confidence, latency_ms=None, intent_source=None):
+        """Encola una interacción; devuelve False si se descartó por cola llena.
+        
+        intent_source indica de dónde salió la intención: 'rule' o 'fallback'.
+        """
+        if self.max_response_chars and response and len(response) > self.max_response_chars:
+            response = response[:self.max_response_chars]
+        row = (datetime.datetime.now().isoformat(), command, response, str(intent), confidence, latency_ms, intent_source)
+        try:
+            self.queue.put(row, timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+    
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            
+            # Acumular hasta llenar el lote o agotar el intervalo
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is self._STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                remaining = deadline - time.monotonic()
+                if len(batch) >= self.batch_size or remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            self._write(batch)
+        
+        # Al parar, escribir lo que quede en la cola
+        batch = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not self._STOP:
+                batch.append(item)
+        self._write(batch)
+    
+    def _write(self, batch):
+        if not batch:
+            return
+        conn = self.storage.connection()
+        try:
+            with conn:
+                conn.executemany(self.INSERT, batch)
+            with self._lock:
+                self.written += len(batch)
+                self.batches += 1
+        except sqlite3.Error as e:
+            with self._lock:
+                self.errors += len(batch)
+            print(f"Error guardando interacciones: {e}")
+    
+    def stop(self, timeout=5.0):
+        """Vacía la cola y detiene el hilo (se llama al terminar el proceso)"""
+        if self._thread is None:
+            return
+        try:
+            self.queue.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'queue_depth': self.queue.qsize(),
+                'queue_size': self.queue.maxsize,
+                'written': self.written,
+                'dropped': self.dropped,
+                'batches': self.batches,
+                'errors': self.errors,
+            }
+
+# Configurable con BARO_LOG_QUEUE_SIZE, BARO_LOG_BATCH_SIZE, BARO_LOG_FLUSH_INTERVAL
+# y BARO_LOG_RESPONSE_CHARS
+interaction_logger = InteractionLogger(
+    storage,
+    max_queue=int(os.environ.get('BARO_LOG_QUEUE_SIZE', 10000)),
+    batch_size=int(os.environ.get('BARO_LOG_BATCH_SIZE', 200)),
+    flush_interval=float(os.environ.get('BARO_LOG_FLUSH_INTERVAL', 1.0)),
+    max_response_chars=int(os.environ.get('BARO_LOG_RESPONSE_CHARS', 500)),
+)
+
+# ============= MANTENIMIENTO DE INTERACCIONES =============
+class InteractionMaintenance:
+    """Resumen diario, retención y compactación de la tabla interactions.
+    
+    Un hilo en segundo plano, cada interval segundos:
+    1. suma a interaction_daily las interacciones nuevas (marca de agua
+       rollup_last_id en meta), así el resumen no depende de la retención;
+    2. borra por lotes las filas ya resumidas con más de retention_days días
+       o que exceden max_rows (0 desactiva cada límite);
+    3. devuelve al sistema las páginas libres con PRAGMA incremental_vacuum.
+       En una base creada sin auto_vacuum=INCREMENTAL, la primera pasada lo
+       activa con un VACUUM completo (o antes, con python baro.py vacuum).
+    """
+    
+    ROLLUP = '''INSERT INTO interaction_daily (day, intent, count, confidence_sum, latency_sum, latency_count)
+                SELECT substr(timestamp, 1, 10), COALESCE(intent, 'None'), COUNT(*), TOTAL(confidence), TOTAL(latency_ms), COUNT(latency_ms)
+                FROM interactions WHERE id > ? AND id <= ?
+                GROUP BY 1, 2
+                ON CONFLICT(day, intent) DO UPDATE SET
+                    count = count + excluded.count,
+                    confidence_sum = confidence_sum + excluded.confidence_sum,
+                    latency_sum = latency_sum + excluded.latency_sum,
+                    latency_count = latency_count + excluded.latency_count'''
+    
+    def __init__(self, storage, retention_days=30, max_rows=100000, interval=3600.0, batch_size=5000):
+        self.storage = storage
+        self.retention_days = retention_days
+        self.max_rows = max_rows
+        self.interval = interval
+        self.batch_size = batch_size
+        self.runs = 0
+        self.rolled_up = 0
+        self.pruned = 0
+        self.vacuumed_pages = 0
+        self.last_run = None
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='interaction-maintenance', daemon=True)
+            self._thread.start()
+    
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.interval)
+    
+    def run_once(self):
+        """Una pasada completa: resumen, poda y vacuum incremental"""
+        try:
+            conn = self.storage.connection()
+            last_id = self.rollup(conn)
+            self.prune(conn, last_id)
+            self.vacuum(conn)
+            self.runs += 1
+            self.last_run = datetime.datetime.now().isoformat()
+        except sqlite3.Error as e:
+            print(f"Error en el mantenimiento de interacciones: {e}")
+    
+    def rollup(self, conn):
+        """Resume las interacciones nuevas; devuelve el último id resumido"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'rollup_last_id'").fetchone()
+            last_id = int(row[0]) if row else 0
+            max_id = conn.execute("SELECT MAX(id) FROM interactions").fetchone()[0] or 0
+            if max_id > last_id:
+                conn.execute(self.ROLLUP, (last_id, max_id))
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('rollup_last_id', ?)", (str(max_id),))
+                self.rolled_up += max_id - last_id
+                last_id = max_id
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return last_id
+    
+    def prune(self, conn, last_id):
+        """Borra en transacciones cortas para no bloquear al registro de interacciones.
+        
+        Se conserva siempre la fila last_id: sin AUTOINCREMENT, borrar el id
+        máximo haría que SQLite lo reutilizara y esa fila no se resumiría.
+        """
+        limits = []
+        if self.retention_days:
+            cutoff = (datetime.datetime.now() - datetime.timedelta(days=self.retention_days)).isoformat()
+            limits.append(("timestamp < ?", cutoff))
+        if self.max_rows:
+            row = conn.execute("SELECT id FROM interactions ORDER BY id DESC LIMIT 1 OFFSET ?", (self.max_rows,)).fetchone()
+            if row:
+                limits.append(("id <= ?", row[0]))
+        
+        for condition, value in limits:
+            while True:
+                with conn:
+                    deleted = conn.execute(f'''DELETE FROM interactions WHERE id IN (
+                                                SELECT id FROM interactions WHERE {condition} AND id < ? LIMIT ?
+                                            )''', (value, last_id, self.batch_size)).rowcount
+                self.pruned += deleted
+                if deleted < self.batch_size:
+                    break
+    
+    def vacuum(self, conn):
+        """Libera las páginas vacías del fichero (requiere auto_vacuum=INCREMENTAL)"""
+        if enable_incremental_vacuum(conn):
+            # El VACUUM completo ya dejó el fichero sin páginas libres
+            return
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if free_pages:
+            # executescript lo ejecuta hasta el final; execute liberaría una sola página
+            conn.executescript("PRAGMA incremental_vacuum;")
+            self.vacuumed_pages += free_pages - conn.execute("PRAGMA freelist_count").fetchone()[0]
+    
+    def stop(self, timeout=5.0):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+    
+    def stats(self):
+        return {
+            'runs': self.runs,
+            'last_run': self.last_run,
+            'rolled_up': self.rolled_up,
+            'pruned': self.pruned,
+            'vacuumed_pages': self.vacuumed_pages,
+            'retention_days': self.retention_days,
+            'max_rows': self.max_rows,
+        }
+
+# Configurable con BARO_INTERACTION_RETENTION_DAYS, BARO_INTERACTION_MAX_ROWS
+# y BARO_MAINTENANCE_INTERVAL (segundos)
+interaction_maintenance = InteractionMaintenance(
+    storage,
+    retention_days=int(os.environ.get('BARO_INTERACTION_RETENTION_DAYS', 30)),
+    max_rows=int(os.environ.get('BARO_INTERACTION_MAX_ROWS', 100000)),
+    interval=float(os.environ.get('BARO_MAINTENANCE_INTERVAL', 3600)),
+)
+
+# ============= CACHÉ PERSISTENTE CON TTL =============
+class PersistentCache:
+    """Caché de resultados de red en dos niveles: LRU en memoria y tabla cache_entries.
+    
+    Cada entrada tiene un tipo (kind) con su propio TTL en segundos, de modo que
+    una respuesta válida puede durar días y un "no encontrado" solo unas horas.
+    Los valores se guardan como JSON; las entradas caducadas se borran cada
+    prune_every escrituras. Con max_entries, esa misma limpieza descarta las
+    entradas más antiguas del espacio de nombres que superen el límite.
+    """
+    
+    def __init__(self, storage, namespace, ttls, memory_size=1024, prune_every=100, max_entries=None):
+        self.storage = storage
+        self.namespace = namespace
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self.memory = LRUCache(memory_size)
+        self.prune_every = prune_every
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        """(kind, valor) vigente para key, o None"""
+        now = time.time()
+        entry = self.memory.get(key)
+        if entry is not None:
+            if entry[2] > now:
+                with self._lock:
+                    self.memory_hits += 1
+                return entry[0], entry[1]
+            self.memory.discard(key)
+        
+        try:
+            row = self.storage.execute("SELECT kind, value, expires_at FROM cache_entries WHERE namespace = ? AND key = ? AND expires_at > ?",
+                                       (self.namespace, key, now)).fetchone()
+        except sqlite3.Error as e:
+            print(f"Error leyendo caché {self.namespace}: {e}")
+            row = None
+        if row is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        
+        entry = (row[0], json.loads(row[1]), row[2])
+        self.memory.put(key, entry)
+        with self._lock:
+            self.disk_hits += 1
+        return entry[0], entry[1]
+    
+    def set(self, key, kind, value):
+        """Guarda un resultado con el TTL de su tipo"""
+        now = time.time()
+        entry = (kind, value, now + self.ttls[kind])
+        self.memory.put(key, entry)
+        conn = self.storage.connection()
+        try:
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO cache_entries (namespace, key, kind, value, expires_at) VALUES (?, ?, ?, ?, ?)",
+                             (self.namespace, key, kind, json.dumps(value, ensure_ascii=False), entry[2]))
+                with self._lock:
+                    self.writes += 1
+                    prune = self.writes % self.prune_every == 0
+                if prune:
+                    conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND expires_at <= ?", (self.namespace, now))
+                    if self.max_entries:
+                        conn.execute('''DELETE FROM cache_entries WHERE namespace = ? AND expires_at < (
+                                            SELECT expires_at FROM cache_entries WHERE namespace = ?
+                                            ORDER BY expires_at DESC LIMIT 1 OFFSET ?)''',
+                                     (self.namespace, self.namespace, self.max_entries - 1))
+        except sqlite3.Error as e:
+            print(f"Error guardando caché {self.namespace}: {e}")
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'writes': self.writes,
+                'hit_rate': round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                'memory': self.memory.stats(),
+            }
+
+class SingleFlight:
+    """Agrupa las llamadas concurrentes con la misma clave en una sola ejecución.
+    
+    El primer hilo ejecuta la función; los que llegan mientras tanto esperan
+    y reciben el mismo resultado (o la misma excepción).
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}                      # clave -> {'done', 'result', 'error'}
+        self.executions = 0
+        self.shared = 0
+    
+    def do(self, key, fn):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = {'done': threading.Event(), 'result': None, 'error': None}
+                self.executions += 1
+            else:
+                self.shared += 1
+        
+        if not leader:
+            flight['done'].wait()
+            if flight['error'] is not None:
+                raise flight['error']
+            return flight['result']
+        
+        try:
+            flight['result'] = fn()
+            return flight['result']
+        except Exception as e:
+            flight['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight['done'].set()
+    
+    def stats(self):
+        with self._lock:
+            return {'executions': self.executions, 'shared': self.shared, 'in_flight': len(self._flights)}
+
+# ============= CLIENTE HTTP COMPARTIDO =============
+# Timeout (conexión, lectura) en segundos de cada proveedor externo; el de lectura
+# es también el plazo total de la petición con todos sus reintentos
+HTTP_PROVIDER_TIMEOUTS = {
+    'clima': (3.05, 10),
+    'noticias': (3.05, 10),
+    'ubicacion': (3.05, 10),
+    'traduccion': (3.05, 10),
+    'geoip': (3.05, 5),
+}
+HTTP_DEFAULT_TIMEOUT = (3.05, 10)
+HTTP_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+class HttpClient:
+    """Sesión HTTP única para todos los proveedores externos.
+    
+    Reutiliza conexiones keep-alive con un pool por host, reintenta las
+    peticiones GET ante errores de conexión o respuestas 429/5xx con espera
+    exponencial con jitter, y lleva contadores de latencia y errores por
+    proveedor. Un timeout de lectura no se reintenta (el proveedor ya tardó
+    demasiado) y ningún reintento empieza pasado el plazo total del proveedor. El pool de urllib3 es seguro entre hilos; la sesión no guarda
+    cookies para que los hilos no compartan estado.
+    """
+    
+    def __init__(self, retries=2, backoff=0.3, max_backoff=3.0, pool_connections=10, pool_maxsize=10,
+                 user_agent='BaroAssistant/2.0'):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = user_agent
+        self.session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._lock = threading.Lock()
+        self.providers = {}
+    
+    def _backoff(self, attempt):
+        """Espera exponencial con jitter completo"""
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+    
+    def get(self, provider, url, timeout=None, **kwargs):
+        """GET con reintentos; devuelve la última respuesta o relanza el último error de red"""
+        timeout = timeout or HTTP_PROVIDER_TIMEOUTS.get(provider, HTTP_DEFAULT_TIMEOUT)
+        connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        started = time.perf_counter()
+        deadline = started + read_timeout
+        attempt = 0
+        try:
+            while True:
+                # Se calcula después de cada espera: sleep puede pasarse del plazo y
+                # requests no acepta un timeout de cero o negativo
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    raise requests.Timeout(f"{provider}: plazo de {read_timeout} s agotado tras {attempt} reintentos")
+                try:
+                    # ConnectTimeout es un ConnectionError; ReadTimeout no se reintenta
+                    response = self.session.get(url, timeout=(min(connect_timeout, remaining), remaining), **kwargs)
+                except requests.ConnectionError as e:
+                    retry, response, error = True, None, e
+                else:
+                    retry = response.status_code in HTTP_RETRY_STATUSES
+                
+                wait = self._backoff(attempt)
+                if not retry or attempt >= self.retries or time.perf_counter() + wait >= deadline:
+                    if response is None:
+                        raise error
+                    self._record(provider, started, attempt, response.status_code >= 400)
+                    return response
+                if response is not None:
+                    response.close()
+                time.sleep(wait)
+                attempt += 1
+        except Exception:
+            self._record(provider, started, attempt, True)
+            raise
+    
+    def _record(self, provider, started, retries, error):
+        latency_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            counters = self.providers.get(provider)
+            if counters is None:
+                counters = self.providers[provider] = {'requests': 0, 'errors': 0, 'retries': 0,
+                                                       'latency_ms_total': 0.0, 'latency_ms_max': 0.0}
+            counters['requests'] += 1
+            counters['errors'] += error
+            counters['retries'] += retries
+            counters['latency_ms_total'] += latency_ms
+            counters['latency_ms_max'] = max(counters['latency_ms_max'], latency_ms)
+    
+    def close(self):
+        self.session.close()
+    
+    def stats(self):
+        with self._lock:
+            return {provider: {
+                'requests': c['requests'],
+                'errors': c['errors'],
+                'retries': c['retries'],
+                'latency_ms_avg': round(c['latency_ms_total'] / c['requests'], 2),
+                'latency_ms_max': round(c['latency_ms_max'], 2),
+            } for provider, c in self.providers.items()}
+
+http_client = HttpClient(retries=int(os.environ.get('BARO_HTTP_RETRIES', 2)))
+atexit.register(http_client.close)
+
+# ============= BASE DE DATOS MEJORADA =============
+# Pesos bm25 por columna (topic, keywords, info), los mismos que la puntuación clásica
+KNOWLEDGE_FTS_WEIGHTS = (0.9, 0.5, 0.3)
+# Candidatos que devuelve el índice antes de puntuar en Python
+KNOWLEDGE_FTS_CANDIDATES = 50
+# Temas candidatos (más trigramas en común) a los que se calcula la similitud difusa
+KNOWLEDGE_FUZZY_CANDIDATES = 100
+# Índice en memoria: máximo de entradas de listas de trigramas que se recorren para
+# los candidatos difusos, de la lista más corta a la más larga; las de los trigramas
+# más frecuentes se saltan al agotarse
+KNOWLEDGE_FUZZY_MAX_POSTINGS = 2000
+# Listas que se recorren siempre enteras, aunque superen el máximo: una letra
+# borrada, cambiada o añadida quita a lo sumo 3 trigramas de la consulta, así que
+# un tema a una edición comparte al menos uno de los 4 más raros
+KNOWLEDGE_FUZZY_MIN_LISTS = 4
+# Longitud máxima de tema que cubre el índice de trigramas
+TOPIC_TRIGRAM_MAX_LENGTH = 512
+# Longitud máxima de la lista de palabras clave que los triggers separan
+KEYWORDS_MAX_LENGTH = 4096
+
+# Embeddings locales de cada fila: dimensión del vector float32 y nombre del
+# featurizador guardado junto al vector (si cambia, los vectores se recalculan;
+# v2: el tema pesa KNOWLEDGE_EMBEDDING_TOPIC_WEIGHT)
+KNOWLEDGE_EMBEDDING_DIM = 512
+KNOWLEDGE_EMBEDDING_MODEL = f'hash-ngram-v2-{KNOWLEDGE_EMBEDDING_DIM}'
+# Peso del tema frente a las palabras clave y la información (1.0) en el embedding
+KNOWLEDGE_EMBEDDING_TOPIC_WEIGHT = 2.0
+# Modo híbrido: peso de la similitud coseno sumada a knowledge_score, similitud
+# mínima para que cuente y filas más cercanas añadidas como candidatas
+KNOWLEDGE_VECTOR_WEIGHT = 1.5
+KNOWLEDGE_VECTOR_MIN_SIMILARITY = 0.3
+KNOWLEDGE_VECTOR_CANDIDATES = 20
+KNOWLEDGE_SEARCH_MODES = ('keyword', 'vector', 'hybrid')
+knowledge_fts_enabled = False
+
+# Versión de los datos semilla: cambiarla vuelve a sembrar la tabla knowledge
+KNOWLEDGE_SEED_VERSION = 1
+
+def normalize_topic(topic):
+    """Forma canónica de un tema para la restricción de unicidad"""
+    return WHITESPACE_RE.sub(' ', topic.lower()).strip()
+
+# Aprender un tema ya conocido reemplaza su información en la misma fila
+KNOWLEDGE_UPSERT = '''INSERT INTO knowledge (topic, topic_norm, info, category, keywords)
+                      VALUES (?, ?, ?, ?, ?)
+                      ON CONFLICT(topic_norm) DO UPDATE SET
+                          topic = excluded.topic, info = excluded.info,
+                          category = excluded.category, keywords = excluded.keywords'''
+
+def init_knowledge_fts(c):
+    """Crea la tabla FTS5 de conocimiento y sus triggers; False si FTS5 no está disponible"""
+    try:
+        exists = c.execute("SELECT 1 FROM sqlite_master WHERE name = 'knowledge_fts'").fetchone()
+        # Tokenizador de trigramas: encuentra subcadenas y palabras mal escritas
+        c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS knowledge_fts USING fts5(
+                        topic, keywords, info,
+                        content='knowledge', content_rowid='id', tokenize='trigram'
+                    )''')
+    except sqlite3.OperationalError as e:
+        print(f"FTS5 no disponible, se usará búsqueda lineal: {e}")
+        return False
+    
+    create_knowledge_fts_triggers(c)
+    
+    # Primera vez: indexar las filas que ya existían
+    if not exists:
+        c.execute("INSERT INTO knowledge_fts(knowledge_fts) VALUES ('rebuild')")
+    return True
+
+def create_knowledge_fts_triggers(c):
+    """Triggers que mantienen knowledge_fts sincronizada con knowledge"""
+    c.execute('''CREATE TRIGGER IF NOT EXISTS knowledge_ai AFTER INSERT ON knowledge BEGIN
+                    INSERT INTO knowledge_fts(rowid, topic, keywords, info)
+                    VALUES (new.id, new.topic, new.keywords, new.info);
+                END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS knowledge_ad AFTER DELETE ON knowledge BEGIN
+                    INSERT INTO knowledge_fts(knowledge_fts, rowid, topic, keywords, info)
+                    VALUES ('delete', old.id, old.topic, old.keywords, old.info);
+                END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS knowledge_au AFTER UPDATE ON knowledge BEGIN
+                    INSERT INTO knowledge_fts(knowledge_fts, rowid, topic, keywords, info)
+                    VALUES ('delete', old.id, old.topic, old.keywords, old.info);
+                    INSERT INTO knowledge_fts(rowid, topic, keywords, info)
+                    VALUES (new.id, new.topic, new.keywords, new.info);
+                END''')
+
+# ----- Migraciones (PRAGMA user_version = número de migraciones aplicadas) -----
+def migrate_base_schema(c):
+    """1: tablas de interacciones y conocimiento, índices y FTS5"""
+    # Tabla de interacciones
+    c.execute('''CREATE TABLE IF NOT EXISTS interactions (
+                    id INTEGER PRIMARY KEY,
+                    timestamp TEXT,
+                    command TEXT,
+                    response TEXT,
+                    intent TEXT,
+                    confidence REAL
+                )''')
+    
+    # Tabla de conocimiento expandida
+    c.execute('''CREATE TABLE IF NOT EXISTS knowledge (
+                    id INTEGER PRIMARY KEY,
+                    topic TEXT,
+                    info TEXT,
+                    category TEXT,
+                    keywords TEXT
+                )''')
+    
+    # Crear índices para búsqueda rápida (idx_keywords lo quita la migración 7)
+    c.execute('CREATE INDEX IF NOT EXISTS idx_topic ON knowledge(topic)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_keywords ON knowledge(keywords)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_topic_length ON knowledge(length(topic))')
+    
+    # Índice de texto completo sincronizado por triggers
+    init_knowledge_fts(c)
+
+def create_knowledge_indexes(c):
+    """Índices secundarios actuales de knowledge (la carga masiva los borra y los recrea).
+    
+    No se usa en las migraciones ya aplicadas: los cambios de índices van en migraciones nuevas.
+    """
+    c.execute('CREATE INDEX IF NOT EXISTS idx_topic ON knowledge(topic)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_topic_length ON knowledge(length(topic))')
+
+def migrate_topic_norm(c):
+    """2: tema normalizado único; elimina los duplicados de siembras anteriores"""
+    columns = [row[1] for row in c.execute("PRAGMA table_info(knowledge)")]
+    if 'topic_norm' not in columns:
+        c.execute("ALTER TABLE knowledge ADD COLUMN topic_norm TEXT")
+    rows = c.execute("SELECT id, topic FROM knowledge").fetchall()
+    c.executemany("UPDATE knowledge SET topic_norm = ? WHERE id = ?",
+                  [(normalize_topic(topic or ''), row_id) for row_id, topic in rows])
+    # Se conserva la fila más antigua de cada tema, la que ya ganaba las búsquedas exactas
+    c.execute('''DELETE FROM knowledge WHERE id NOT IN (
+                    SELECT MIN(id) FROM knowledge GROUP BY topic_norm
+                )''')
+    c.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_topic_norm ON knowledge(topic_norm)')
+
+def migrate_meta(c):
+    """3: tabla de metadatos (versión de la siembra)"""
+    c.execute('''CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )''')
+
+def migrate_topic_trigrams(c):
+    """4: índice de trigramas de los temas (con relleno), mantenido por triggers"""
+    # Tabla auxiliar de posiciones: los triggers no admiten CTE recursivas
+    c.execute('CREATE TABLE IF NOT EXISTS knowledge_trigram_positions (n INTEGER PRIMARY KEY)')
+    c.executemany('INSERT OR IGNORE INTO knowledge_trigram_positions (n) VALUES (?)',
+                  [(n,) for n in range(1, TOPIC_TRIGRAM_MAX_LENGTH + 1)])
+    c.execute('''CREATE TABLE IF NOT EXISTS knowledge_trigrams (
+                    trigram TEXT NOT NULL,
+                    knowledge_id INTEGER NOT NULL,
+                    PRIMARY KEY (trigram, knowledge_id)
+                ) WITHOUT ROWID''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_trigrams_knowledge ON knowledge_trigrams(knowledge_id)')
+    create_topic_trigram_triggers(c)
+    
+    # Temas ya existentes
+    rebuild_topic_trigrams(c)
+
+def create_topic_trigram_triggers(c):
+    """Triggers que mantienen knowledge_trigrams sincronizada con los temas"""
+    insert_trigrams = '''INSERT OR IGNORE INTO knowledge_trigrams (trigram, knowledge_id)
+                         SELECT substr(' ' || new.topic || ' ', n, 3), new.id
+                         FROM knowledge_trigram_positions WHERE n <= length(new.topic);'''
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS knowledge_trigrams_ai AFTER INSERT ON knowledge BEGIN
+                    {insert_trigrams}
+                END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS knowledge_trigrams_ad AFTER DELETE ON knowledge BEGIN
+                    DELETE FROM knowledge_trigrams WHERE knowledge_id = old.id;
+                END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS knowledge_trigrams_au AFTER UPDATE OF topic ON knowledge BEGIN
+                    DELETE FROM knowledge_trigrams WHERE knowledge_id = old.id;
+                    {insert_trigrams}
+                END''')
+
+def rebuild_topic_trigrams(c):
+    """Recalcula knowledge_trigrams a partir de todos los temas"""
+    c.execute("DELETE FROM knowledge_trigrams")
+    c.execute('''INSERT OR IGNORE INTO knowledge_trigrams (trigram, knowledge_id)
+                 SELECT substr(' ' || k.topic || ' ', p.n, 3), k.id
+                 FROM knowledge k JOIN knowledge_trigram_positions p ON p.n <= length(k.topic)''')
+
+def migrate_knowledge_embeddings(c):
+    """5: embeddings float32 de cada fila; los triggers borran los desactualizados"""
+    c.execute('''CREATE TABLE IF NOT EXISTS knowledge_embeddings (
+                    knowledge_id INTEGER PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    vector BLOB NOT NULL
+                )''')
+    # Se recalculan desde Python (sync_knowledge_embeddings) al cargar el índice
+    c.execute('''CREATE TRIGGER IF NOT EXISTS knowledge_embeddings_ad AFTER DELETE ON knowledge BEGIN
+                    DELETE FROM knowledge_embeddings WHERE knowledge_id = old.id;
+                END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS knowledge_embeddings_au AFTER UPDATE OF topic, info, keywords ON knowledge BEGIN
+                    DELETE FROM knowledge_embeddings WHERE knowledge_id = old.id;
+                END''')
+
+def migrate_interaction_rollup(c):
+    """6: latencia por interacción, índice por fecha y resumen diario por intención"""
+    columns = [row[1] for row in c.execute("PRAGMA table_info(interactions)")]
+    if 'latency_ms' not in columns:
+        c.execute("ALTER TABLE interactions ADD COLUMN latency_ms REAL")
+    c.execute('CREATE INDEX IF NOT EXISTS idx_interactions_timestamp ON interactions(timestamp)')
+    c.execute('''CREATE TABLE IF NOT EXISTS interaction_daily (
+                    day TEXT NOT NULL,
+                    intent TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    confidence_sum REAL NOT NULL,
+                    latency_sum REAL NOT NULL,
+                    latency_count INTEGER NOT NULL,
+                    PRIMARY KEY (day, intent)
+                )''')
+    # Se guardan sumas para poder acumular; la vista calcula las medias
+    c.execute('''CREATE VIEW IF NOT EXISTS interaction_daily_stats AS
+                    SELECT day, intent, count,
+                           confidence_sum / count AS mean_confidence,
+                           CASE WHEN latency_count THEN latency_sum / latency_count END AS mean_latency_ms
+                    FROM interaction_daily''')
+
+def migrate_knowledge_keywords(c):
+    """7: palabras clave en filas propias (knowledge_keywords) en lugar de idx_keywords"""
+    c.execute('''CREATE TABLE IF NOT EXISTS knowledge_keywords (
+                    id INTEGER PRIMARY KEY,
+                    knowledge_id INTEGER NOT NULL,
+                    keyword TEXT NOT NULL
+                )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_knowledge_keywords_keyword ON knowledge_keywords(keyword)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_knowledge_keywords_length ON knowledge_keywords(length(keyword))')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_knowledge_keywords_knowledge ON knowledge_keywords(knowledge_id)')
+    # Un índice sobre la lista completa no sirve para buscar palabras sueltas
+    c.execute('DROP INDEX IF EXISTS idx_keywords')
+    
+    # Las posiciones también sirven para separar la lista por comas
+    c.executemany('INSERT OR IGNORE INTO knowledge_trigram_positions (n) VALUES (?)',
+                  [(n,) for n in range(TOPIC_TRIGRAM_MAX_LENGTH + 1, KEYWORDS_MAX_LENGTH + 2)])
+    create_knowledge_keyword_triggers(c)
+    rebuild_knowledge_keywords(c)
+
+def keyword_split_select(keywords, row_id, source=''):
+    """SELECT que separa una lista de palabras clave por comas como str.split(',') + strip().
+    
+    Cada palabra empieza en la posición 1 o tras una coma (una coma final
+    produce una palabra vacía, igual que en Python); las repetidas se
+    conservan porque cada una puntúa.
+    """
+    return f'''SELECT {row_id}, trim(substr({keywords}, p.n, instr(substr({keywords}, p.n) || ',', ',') - 1), ' ' || char(9, 10, 13))
+               FROM {source}knowledge_trigram_positions p
+               WHERE {keywords} != '' AND p.n <= length({keywords}) + 1
+                 AND (p.n = 1 OR substr({keywords}, p.n - 1, 1) = ',')'''
+
+def create_knowledge_keyword_triggers(c):
+    """Triggers que mantienen knowledge_keywords sincronizada con knowledge.keywords"""
+    insert_keywords = f'''INSERT INTO knowledge_keywords (knowledge_id, keyword)
+                          {keyword_split_select('new.keywords', 'new.id')};'''
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS knowledge_keywords_ai AFTER INSERT ON knowledge BEGIN
+                    {insert_keywords}
+                END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS knowledge_keywords_ad AFTER DELETE ON knowledge BEGIN
+                    DELETE FROM knowledge_keywords WHERE knowledge_id = old.id;
+                END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS knowledge_keywords_au AFTER UPDATE OF keywords ON knowledge BEGIN
+                    DELETE FROM knowledge_keywords WHERE knowledge_id = old.id;
+                    {insert_keywords}
+                END''')
+
+def rebuild_knowledge_keywords(c):
+    """Recalcula knowledge_keywords a partir de todas las filas"""
+    c.execute("DELETE FROM knowledge_keywords")
+    c.execute(f'''INSERT INTO knowledge_keywords (knowledge_id, keyword)
+                  {keyword_split_select('k.keywords', 'k.id', 'knowledge k, ')}''')
+
+def migrate_cache_entries(c):
+    """8: caché persistente de resultados de red (PersistentCache)"""
+    c.execute('''CREATE TABLE IF NOT EXISTS cache_entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                ) WITHOUT ROWID''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_cache_entries_expires ON cache_entries(namespace, expires_at)')
+
+def migrate_knowledge_version(c):
+    """9: contador knowledge_version en meta, incrementado por triggers en cada cambio de knowledge"""
+    c.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('knowledge_version', 0)")
+    create_knowledge_version_triggers(c)
+
+def create_knowledge_version_triggers(c):
+    """Triggers que cuentan los cambios de knowledge (las demás tablas no lo tocan)"""
+    for name, event in (('ai', 'INSERT'), ('ad', 'DELETE'), ('au', 'UPDATE')):
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS knowledge_version_{name} AFTER {event} ON knowledge BEGIN
+                        UPDATE meta SET value = value + 1 WHERE key = 'knowledge_version';
+                    END''')
+
+def knowledge_version(conn):
+    """Valor actual del contador de cambios de knowledge"""
+    row = conn.execute("SELECT value FROM meta WHERE key = 'knowledge_version'").fetchone()
+    return int(row[0]) if row else 0
+
+def migrate_intent_source(c):
+    """10: origen de la intención de cada interacción ('rule' o 'fallback'; NULL en las anteriores)"""
+    columns = [row[1] for row in c.execute("PRAGMA table_info(interactions)")]
+    if 'intent_source' not in columns:
+        c.execute("ALTER TABLE interactions ADD COLUMN intent_source TEXT")
+
+MIGRATIONS = [migrate_base_schema, migrate_topic_norm, migrate_meta, migrate_topic_trigrams,
+              migrate_knowledge_embeddings, migrate_interaction_rollup, migrate_knowledge_keywords,
+              migrate_cache_entries, migrate_knowledge_version, migrate_intent_source]
 
-# ============= BASE DE DATOS MEJORADA =============
-def init_db():
-    """Inicializa base de datos con conocimiento expandido"""
-    conn = sqlite3.connect('baro.db')
-    c = conn.cursor()
+def run_migrations(conn):
+    """Aplica las migraciones pendientes en una sola transacción"""
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= len(MIGRATIONS):
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Otro proceso pudo migrar mientras se esperaba el bloqueo
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number in range(version, len(MIGRATIONS)):
+            MIGRATIONS[number](conn)
+            conn.execute(f"PRAGMA user_version = {number + 1}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def enable_incremental_vacuum(conn):
+    """Activa auto_vacuum=INCREMENTAL en una base creada sin él (un VACUUM, una sola vez).
     
-    # Tabla de interacciones
-    c.execute('''CREATE TABLE IF NOT EXISTS interactions (
-                    id INTEGER PRIMARY KEY,
-                    timestamp TEXT,
-                    command TEXT,
-                    response TEXT,
-                    intent TEXT,
-                    confidence REAL
-                )''')
+    Bloquea la base mientras reescribe el fichero, así que no se hace al
+    importar el módulo: lo lanza el hilo de mantenimiento o python baro.py vacuum.
+    Devuelve True si hizo el VACUUM.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return False
+    print("Compactando la base de datos para activar el vacuum incremental...")
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    return True
+
+def init_db():
+    """Inicializa la base de datos: migraciones pendientes y siembra si cambió su versión.
     
-    # Tabla de conocimiento expandida
-    c.execute('''CREATE TABLE IF NOT EXISTS knowledge (
-                    id INTEGER PRIMARY KEY,
-                    topic TEXT,
-                    info TEXT,
-                    category TEXT,
-                    keywords TEXT
-                )''')
+    En un arranque normal (esquema y siembra al día) no escribe nada.
+    """
+    global knowledge_fts_enabled
+    conn = storage.connection()
+    run_migrations(conn)
+    seed_knowledge(conn)
+    knowledge_fts_enabled = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'knowledge_fts'").fetchone() is not None
+
+def seed_knowledge(conn):
+    """Siembra la base de conocimiento si su versión no está aplicada"""
+    def seeded():
+        row = conn.execute("SELECT value FROM meta WHERE key = 'seed_version'").fetchone()
+        return row is not None and int(row[0]) >= KNOWLEDGE_SEED_VERSION
     
-    # Crear índices para búsqueda rápida
-    c.execute('CREATE INDEX IF NOT EXISTS idx_topic ON knowledge(topic)')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_keywords ON knowledge(keywords)')
+    if seeded():
+        return
 
     # Base de conocimiento masiva y organizada
     knowledge_data = [
@@ -527,127 +2583,905 @@ def init_db():
         ("biblioteca", "Una biblioteca es un lugar que almacena, organiza y presta libros y otros recursos para lectura, estudio e investigación de la comunidad.", "educacion", "libros,lectura,estudio"),
     ]
 
-    for topic, info, category, keywords in knowledge_data:
-        c.execute("INSERT OR IGNORE INTO knowledge (topic, info, category, keywords) VALUES (?, ?, ?, ?)", 
-                 (topic.lower(), info, category, keywords))
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if not seeded():
+            # Los temas existentes se actualizan salvo los aprendidos del usuario
+            conn.executemany("""INSERT INTO knowledge (topic, topic_norm, info, category, keywords)
+                                VALUES (?, ?, ?, ?, ?)
+                                ON CONFLICT(topic_norm) DO UPDATE SET
+                                    info = excluded.info, category = excluded.category, keywords = excluded.keywords
+                                WHERE knowledge.category != 'usuario'""",
+                             [(topic.lower(), normalize_topic(topic), info, category, keywords)
+                              for topic, info, category, keywords in knowledge_data])
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('seed_version', ?)",
+                         (str(KNOWLEDGE_SEED_VERSION),))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def load_training_interactions(min_confidence=0.9, limit=5000):
+    """Interacciones recientes con intención segura, para entrenar el clasificador.
+    
+    Solo las decididas por las reglas: las del propio clasificador reforzarían sus errores.
+    """
+    try:
+        c = storage.execute('''SELECT command, intent FROM interactions
+                               WHERE intent_source = 'rule' AND confidence >= ? AND intent != 'None'
+                               ORDER BY id DESC LIMIT ?''',
+                            (min_confidence, limit))
+        return c.fetchall()
+    except Exception as e:
+        print(f"Error leyendo interacciones: {e}")
+        return []
+
+# ============= EMBEDDINGS LOCALES =============
+EMBEDDING_WORD_RE = re.compile(r'\w{3,}')
+
+def embedding_features(text):
+    """Palabras (de 3 o más letras) y sus 3-gramas y 4-gramas de caracteres"""
+    features = []
+    for word in EMBEDDING_WORD_RE.findall(text.lower().translate(NORMALIZE_TABLE)):
+        features.append('w:' + word)
+        features.extend(char_ngrams(word, 3))
+        features.extend(char_ngrams(word, 4))
+    return features
+
+def embed_text(parts, dim=KNOWLEDGE_EMBEDDING_DIM):
+    """Vector float32 normalizado de [(texto, peso)] con hashing de rasgos (crc32 con signo)"""
+    vector = np.zeros(dim, dtype=np.float32)
+    for text, weight in parts:
+        features = embedding_features(text or '')
+        if not features:
+            continue
+        hashes = np.fromiter((zlib.crc32(f.encode()) for f in features), dtype=np.uint32, count=len(features))
+        signs = np.where(hashes & 0x80000000, weight, -weight)
+        vector += np.bincount(hashes % dim, weights=signs, minlength=dim).astype(np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+def embed_knowledge(topic, info, keywords):
+    """Embedding de una fila: el tema pesa más que las palabras clave y la información"""
+    return embed_text([(topic, KNOWLEDGE_EMBEDDING_TOPIC_WEIGHT), (keywords, 1.0), (info, 1.0)])
+
+def sync_knowledge_embeddings(conn, batch_size=1000):
+    """Calcula y guarda, por lotes de ids, los embeddings que faltan o son de otro featurizador"""
+    total, last_id = 0, 0
+    while True:
+        rows = conn.execute('''SELECT k.id, k.topic, k.info, k.keywords
+                               FROM knowledge k LEFT JOIN knowledge_embeddings e ON e.knowledge_id = k.id
+                               WHERE e.model IS NOT ? AND k.id > ?
+                               ORDER BY k.id LIMIT ?''', (KNOWLEDGE_EMBEDDING_MODEL, last_id, batch_size)).fetchall()
+        if not rows:
+            return total
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO knowledge_embeddings (knowledge_id, model, vector) VALUES (?, ?, ?)",
+                             [(row_id, KNOWLEDGE_EMBEDDING_MODEL, embed_knowledge(topic, info, keywords).tobytes())
+                              for row_id, topic, info, keywords in rows])
+        total += len(rows)
+        last_id = rows[-1][0]
+
+class VectorIndex:
+    """Embeddings en una matriz NumPy contigua (una fila por id).
+    
+    La búsqueda es un único producto matriz-vector; las altas amplían la
+    matriz por duplicación y las bajas mueven la última fila al hueco.
+    """
+    
+    def __init__(self, dim):
+        self.dim = dim
+        self.matrix = np.zeros((0, dim), dtype=np.float32)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.positions = {}                     # id -> fila de la matriz
+        self.size = 0
+    
+    def load(self, ids, matrix):
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.ids = np.array(ids, dtype=np.int64)
+        self.positions = {row_id: i for i, row_id in enumerate(ids)}
+        self.size = len(ids)
+    
+    def set(self, row_id, vector):
+        position = self.positions.get(row_id)
+        if position is None:
+            if self.size == len(self.matrix):
+                capacity = max(16, 2 * len(self.matrix))
+                matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+                matrix[:self.size] = self.matrix[:self.size]
+                ids = np.zeros(capacity, dtype=np.int64)
+                ids[:self.size] = self.ids[:self.size]
+                self.matrix, self.ids = matrix, ids
+            position = self.size
+            self.positions[row_id] = position
+            self.ids[position] = row_id
+            self.size += 1
+        self.matrix[position] = vector
+    
+    def remove(self, row_id):
+        position = self.positions.pop(row_id, None)
+        if position is None:
+            return
+        self.size -= 1
+        if position != self.size:
+            self.matrix[position] = self.matrix[self.size]
+            self.ids[position] = self.ids[self.size]
+            self.positions[int(self.ids[position])] = position
+    
+    def similarities(self, vector):
+        """Similitud coseno con todas las filas (los vectores ya están normalizados)"""
+        return self.matrix[:self.size] @ vector
+    
+    def top_k(self, similarities, k):
+        """Los k ids más similares, de mayor a menor similitud"""
+        if k < len(similarities):
+            best = np.argpartition(-similarities, k)[:k]
+        else:
+            best = np.arange(len(similarities))
+        best = best[np.argsort(-similarities[best], kind='stable')]
+        return [(int(self.ids[i]), float(similarities[i])) for i in best]
+
+# ============= IMPORTACIÓN Y EXPORTACIÓN DE CONOCIMIENTO =============
+KNOWLEDGE_FIELDS = ('topic', 'info', 'category', 'keywords')
+# Filas por executemany durante la carga masiva
+KNOWLEDGE_IMPORT_BATCH = 5000
+# Triggers e índices secundarios que la carga masiva quita y reconstruye al final
+KNOWLEDGE_BULK_TRIGGERS = ('knowledge_ai', 'knowledge_ad', 'knowledge_au',
+                           'knowledge_trigrams_ai', 'knowledge_trigrams_ad', 'knowledge_trigrams_au',
+                           'knowledge_keywords_ai', 'knowledge_keywords_ad', 'knowledge_keywords_au',
+                           'knowledge_version_ai', 'knowledge_version_ad', 'knowledge_version_au')
+KNOWLEDGE_BULK_INDEXES = ('idx_topic', 'idx_topic_length')
+
+def knowledge_file_format(path):
+    """'csv' o 'jsonl' según la extensión del fichero"""
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+def read_knowledge_file(path):
+    """(número de línea, registro) del fichero uno a uno, sin cargarlo entero (None si una línea no es JSON)"""
+    with open(path, encoding='utf-8', newline='') as f:
+        if knowledge_file_format(path) == 'csv':
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield reader.line_num, record
+            return
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if line:
+                try:
+                    yield line_number, json.loads(line)
+                except json.JSONDecodeError:
+                    yield line_number, None
+
+def knowledge_row(record, default_category):
+    """Parámetros de KNOWLEDGE_UPSERT para un registro, o None si le falta tema o información
+    o sus palabras clave no son texto, número ni lista de ellos"""
+    if not isinstance(record, dict):
+        return None
+    topic = str(record.get('topic') or '').strip().lower()
+    info = str(record.get('info') or '').strip()
+    if not topic or not info:
+        return None
+    keywords = record.get('keywords') or ''
+    if isinstance(keywords, list):
+        if not all(isinstance(kw, (str, int, float)) for kw in keywords):
+            return None
+        keywords = ','.join(str(kw) for kw in keywords)
+    elif isinstance(keywords, (int, float)):
+        keywords = str(keywords)
+    elif not isinstance(keywords, str):
+        return None
+    return (topic, normalize_topic(topic), info, record.get('category') or default_category, keywords.lower())
+
+def import_knowledge(path, category='importado', batch_size=KNOWLEDGE_IMPORT_BATCH):
+    """Carga masiva de un fichero JSONL o CSV en knowledge, con upsert por tema.
+    
+    Todo el fichero entra en una única transacción, así que las demás
+    escrituras esperan a que termine (es una operación de mantenimiento). Los
+    triggers de FTS5, de trigramas, de palabras clave y de versión y los índices secundarios se quitan
+    durante la carga y se reconstruyen una sola vez al final; si algo falla,
+    el rollback los restaura. Después se calculan los embeddings de las filas
+    nuevas.
+    Devuelve un diccionario con filas cargadas, descartadas (y sus números de
+    línea) y filas por segundo.
+    """
+    started = time.perf_counter()
+    loaded = skipped = 0
+    skipped_lines = []
+    conn = storage.connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for trigger in KNOWLEDGE_BULK_TRIGGERS:
+                conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            for index in KNOWLEDGE_BULK_INDEXES:
+                conn.execute(f"DROP INDEX IF EXISTS {index}")
+            
+            batch = []
+            for line_number, record in read_knowledge_file(path):
+                row = knowledge_row(record, category)
+                if row is None:
+                    skipped += 1
+                    skipped_lines.append(line_number)
+                    continue
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    conn.executemany(KNOWLEDGE_UPSERT, batch)
+                    loaded += len(batch)
+                    batch = []
+            if batch:
+                conn.executemany(KNOWLEDGE_UPSERT, batch)
+                loaded += len(batch)
+            
+            # Índices y tablas derivadas, de una vez
+            create_knowledge_indexes(conn)
+            rebuild_topic_trigrams(conn)
+            create_topic_trigram_triggers(conn)
+            rebuild_knowledge_keywords(conn)
+            create_knowledge_keyword_triggers(conn)
+            if knowledge_fts_enabled:
+                conn.execute("INSERT INTO knowledge_fts(knowledge_fts) VALUES ('rebuild')")
+                create_knowledge_fts_triggers(conn)
+            # Un solo cambio de versión para toda la carga
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'knowledge_version'")
+            create_knowledge_version_triggers(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        load_seconds = time.perf_counter() - started
+        
+        embedded = 0
+        if knowledge_index.search_mode != 'keyword':
+            embedded = sync_knowledge_embeddings(conn)
+    finally:
+        conn.close()
+    
+    elapsed = time.perf_counter() - started
+    return {
+        'loaded': loaded,
+        'skipped': skipped,
+        'skipped_lines': skipped_lines,
+        'embedded': embedded,
+        'seconds': round(elapsed, 2),
+        'rows_per_second': round(loaded / load_seconds) if load_seconds else 0,
+    }
 
-    conn.commit()
-    conn.close()
+def export_knowledge(path):
+    """Escribe la tabla knowledge en JSONL o CSV recorriendo el cursor (memoria constante)"""
+    started = time.perf_counter()
+    exported = 0
+    cursor = storage.connection().execute("SELECT topic, info, category, keywords FROM knowledge ORDER BY id")
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        if knowledge_file_format(path) == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(KNOWLEDGE_FIELDS)
+            for row in cursor:
+                writer.writerow(row)
+                exported += 1
+        else:
+            for row in cursor:
+                f.write(json.dumps(dict(zip(KNOWLEDGE_FIELDS, row)), ensure_ascii=False) + '\n')
+                exported += 1
+    
+    elapsed = time.perf_counter() - started
+    return {
+        'exported': exported,
+        'seconds': round(elapsed, 2),
+        'rows_per_second': round(exported / elapsed) if elapsed else 0,
+    }
 
 # ============= BÚSQUEDA INTELIGENTE =============
-def search_knowledge(query, threshold=0.6):
-    """Búsqueda inteligente en base de conocimientos con puntuación"""
-    conn = sqlite3.connect('baro.db')
-    c = conn.cursor()
+def knowledge_score(query_lower, topic, info, keywords, keyword_hits=None):
+    """Puntuación de una fila de conocimiento para la consulta.
     
-    query_lower = query.lower()
+    keyword_hits: palabras clave coincidentes ya contadas por knowledge_keyword_hits;
+    sin él se separa la lista de la fila.
+    """
+    score = 0
+    
+    # Búsqueda en topic
+    if query_lower in topic:
+        score += 0.9
+    elif nlp.similarity(query_lower, topic) > 0.7:
+        score += 0.7
+    
+    # Búsqueda en keywords
+    if keyword_hits is not None:
+        score += 0.5 * keyword_hits
+    elif keywords:
+        keyword_list = keywords.split(',')
+        for kw in keyword_list:
+            if kw.strip() in query_lower or query_lower in kw.strip():
+                score += 0.5
+    
+    # Búsqueda en info (menos peso)
+    if query_lower in info.lower():
+        score += 0.3
+    
+    return score
+
+def fts_match_expression(text):
+    """Consulta FTS5 con los trigramas del texto unidos por OR"""
+    trigrams = dict.fromkeys(text[i:i + 3] for i in range(len(text) - 2))
+    return ' OR '.join('"' + t.replace('"', '""') + '"' for t in trigrams)
+
+def knowledge_keyword_hits(c, query_lower):
+    """{id: palabras clave coincidentes} por consulta indexada a knowledge_keywords.
+    
+    Una palabra clave coincide si está contenida en la consulta (búsqueda por
+    igualdad de cada subcadena de la consulta, hasta la palabra más larga) o
+    si la contiene (filas candidatas de knowledge_fts, comprobadas con instr).
+    Solo devuelve las filas que coinciden.
+    """
+    max_length = c.execute("SELECT MAX(length(keyword)) FROM knowledge_keywords").fetchone()[0]
+    if max_length is None:
+        return {}
+    length = len(query_lower)
+    substrings = {query_lower[start:end]
+                  for start in range(length + 1)
+                  for end in range(start, min(length, start + max_length) + 1)}
+    
+    if knowledge_fts_enabled and length >= 3:
+        contains = '''(knowledge_id IN (SELECT rowid FROM knowledge_fts WHERE knowledge_fts MATCH ?)
+                      AND instr(keyword, ?) > 0)'''
+        params = ('keywords : "' + query_lower.replace('"', '""') + '"', query_lower)
+    else:
+        # Menos de un trigrama: recorrido de la tabla de palabras clave
+        contains = 'instr(keyword, ?) > 0'
+        params = (query_lower,)
+    c.execute(f'''SELECT knowledge_id, COUNT(*) FROM knowledge_keywords
+                  WHERE keyword IN (SELECT value FROM json_each(?)) OR {contains}
+                  GROUP BY knowledge_id''', (json.dumps(list(substrings)), *params))
+    return dict(c.fetchall())
+
+def search_knowledge_db(query_lower):
+    """Mejor fila de conocimiento (info, puntuación) consultando la base de datos"""
+    c = storage.connection().cursor()
     results = []
     
     # Búsqueda exacta
     c.execute("SELECT topic, info, keywords FROM knowledge WHERE topic = ?", (query_lower,))
     exact_match = c.fetchone()
     if exact_match:
-        conn.close()
         return exact_match[1], 1.0
     
-    # Búsqueda por palabras clave
-    c.execute("SELECT topic, info, keywords FROM knowledge")
-    all_knowledge = c.fetchall()
+    # Palabras clave: consulta indexada; sus filas también son candidatas
+    keyword_hits = knowledge_keyword_hits(c, query_lower)
+    
+    # Candidatos: top-k del índice FTS5 por bm25. Sin FTS5, o con consultas de
+    # menos de un trigrama, se recorre toda la tabla
+    if knowledge_fts_enabled and len(query_lower) >= 3:
+        c.execute('''SELECT k.id, k.topic, k.info, k.keywords
+                     FROM knowledge_fts JOIN knowledge k ON k.id = knowledge_fts.rowid
+                     WHERE knowledge_fts MATCH ?
+                     ORDER BY bm25(knowledge_fts, ?, ?, ?) LIMIT ?''',
+                  (fts_match_expression(query_lower), *KNOWLEDGE_FTS_WEIGHTS, KNOWLEDGE_FTS_CANDIDATES))
+    else:
+        c.execute("SELECT id, topic, info, keywords FROM knowledge")
+    candidates = c.fetchall()
+    missing = set(keyword_hits).difference(row[0] for row in candidates)
+    if missing:
+        c.execute("SELECT id, topic, info, keywords FROM knowledge WHERE id IN (SELECT value FROM json_each(?))",
+                  (json.dumps(list(missing)),))
+        candidates += c.fetchall()
+    
+    for row_id, topic, info, keywords in candidates:
+        score = knowledge_score(query_lower, topic, info, keywords, keyword_hits.get(row_id, 0))
+        if score > 0:
+            results.append((row_id, info, score))
+    
+    # Temas mal escritos: los de longitud compatible (2·min / suma > 0.7) con más
+    # trigramas en común, según el índice knowledge_trigrams
+    if max((r[2] for r in results), default=0) < 0.7:
+        seen = {r[0] for r in results}
+        grams = list(dict.fromkeys(char_ngrams(query_lower)))
+        length = len(query_lower)
+        c.execute(f'''SELECT k.id, k.topic, k.info, k.keywords
+                      FROM knowledge_trigrams t JOIN knowledge k ON k.id = t.knowledge_id
+                      WHERE t.trigram IN ({','.join('?' * len(grams))})
+                        AND length(k.topic) BETWEEN ? AND ?
+                      GROUP BY k.id ORDER BY COUNT(*) DESC, k.id LIMIT ?''',
+                  (*grams, int(length * 0.7 / 1.3), int(length * 1.3 / 0.7) + 1, KNOWLEDGE_FUZZY_CANDIDATES))
+        for row_id, topic, info, keywords in c.fetchall():
+            if row_id not in seen:
+                score = knowledge_score(query_lower, topic, info, keywords, keyword_hits.get(row_id, 0))
+                if score > 0:
+                    results.append((row_id, info, score))
+    
+    if results:
+        # A igual puntuación gana la fila más antigua, como en el recorrido completo
+        results.sort(key=lambda x: (-x[2], x[0]))
+        return results[0][1], results[0][2]
+    
+    return None, 0
+
+class KnowledgeIndex:
+    """Índice en memoria de la tabla knowledge.
+    
+    Mantiene un mapa de temas exactos, listas de trigramas y de palabras clave,
+    los trigramas de los temas para la similitud difusa y, salvo en el modo
+    'keyword', los embeddings de cada fila, de modo que las búsquedas no tocan
+    el disco. learn() escribe en la base de datos con su propia conexión y sin
+    el lock de las búsquedas, y después actualiza el índice; si otra
+    conexión modifica la tabla (el contador knowledge_version de meta cambia)
+    se recarga en un hilo aparte y el índice nuevo sustituye al anterior de una
+    vez, sin bloquear las búsquedas mientras se construye.
+    
+    Modos de búsqueda: 'keyword' (knowledge_score), 'vector' (similitud coseno)
+    y 'hybrid' (knowledge_score más la similitud coseno ponderada).
+    """
+    
+    def __init__(self, storage, reload_interval=5.0, search_mode='hybrid'):
+        if search_mode not in KNOWLEDGE_SEARCH_MODES:
+            print(f"Modo de búsqueda desconocido '{search_mode}', se usará 'keyword'")
+            search_mode = 'keyword'
+        self.storage = storage
+        self.reload_interval = reload_interval
+        self.search_mode = search_mode
+        self.conn = None
+        self.write_conn = None
+        self.loaded = False
+        self.reloads = 0
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()          # una escritura de learn() cada vez
+        self._version = None
+        self._checked_at = 0.0
+        self._reloading = False
+        self._pending = []                          # learn() durante una recarga
+        self._reset()
+    
+    def _reset(self):
+        self.rows = {}                              # id -> (topic, info, keywords)
+        self.topics = {}                            # topic -> id más antiguo
+        self.keywords = defaultdict(list)           # palabra clave -> ids
+        self.trigrams = defaultdict(lambda: array('i'))  # trigrama -> ids (topic, keywords, info)
+        self.topic_trigrams = defaultdict(lambda: array('i'))  # trigrama del topic (con relleno) -> ids
+        self.max_keyword = 0
+        self.vectors = VectorIndex(KNOWLEDGE_EMBEDDING_DIM)
+    
+    @staticmethod
+    def _terms(topic, info, keywords):
+        """Palabras clave (sin repetir) y trigramas de una fila"""
+        keyword_list = list(dict.fromkeys(kw.strip() for kw in keywords.split(','))) if keywords else []
+        text = '\n'.join([topic, info.lower()] + keyword_list)
+        return keyword_list, {text[i:i + 3] for i in range(len(text) - 2)}
+    
+    def _add(self, row_id, topic, info, keywords):
+        self.rows[row_id] = (topic, info, keywords)
+        self.topics.setdefault(topic, row_id)
+        for gram in set(char_ngrams(topic)):
+            self.topic_trigrams[gram].append(row_id)
+        
+        keyword_list, grams = self._terms(topic, info, keywords)
+        for kw in keyword_list:
+            self.keywords[kw].append(row_id)
+            self.max_keyword = max(self.max_keyword, len(kw))
+        for gram in grams:
+            self.trigrams[gram].append(row_id)
+    
+    def _remove(self, row_id):
+        topic, info, keywords = self.rows.pop(row_id)
+        if self.topics.get(topic) == row_id:
+            del self.topics[topic]
+        for gram in set(char_ngrams(topic)):
+            self.topic_trigrams[gram].remove(row_id)
+        
+        keyword_list, grams = self._terms(topic, info, keywords)
+        for kw in keyword_list:
+            self.keywords[kw].remove(row_id)
+        for gram in grams:
+            self.trigrams[gram].remove(row_id)
+    
+    # Estructuras que load() construye aparte y sustituye de una vez
+    INDEX_FIELDS = ('rows', 'topics', 'keywords', 'trigrams', 'topic_trigrams', 'max_keyword', 'vectors')
+    
+    def load(self):
+        """Lee toda la tabla de conocimiento y reconstruye el índice sin bloquear las búsquedas"""
+        with self._lock:
+            if self.conn is None:
+                # Conexión de las comprobaciones de versión y otra para learn(), de
+                # modo que una transacción abierta no se mezcle con las lecturas
+                self.conn = self.storage.connect(check_same_thread=False)
+                self.write_conn = self.storage.connect(check_same_thread=False)
+            self._reloading = True
+            self._pending = []
+        try:
+            snapshot = self._read_snapshot()
+            if snapshot is None:
+                return False
+            version, rows, embeddings = snapshot
+            
+            staging = KnowledgeIndex(self.storage, self.reload_interval, self.search_mode)
+            for row in rows:
+                staging._add(*row)
+            if embeddings:
+                # Una sola copia de los BLOB a la matriz contigua
+                ids, blobs = zip(*embeddings)
+                matrix = np.frombuffer(b''.join(blobs), dtype=np.float32).reshape(len(ids), KNOWLEDGE_EMBEDDING_DIM)
+                staging.vectors.load(ids, matrix)
+            
+            with self._lock:
+                # Lo aprendido mientras se construía puede no estar en la instantánea
+                for row_id, topic, info, keywords, vector in self._pending:
+                    if row_id in staging.rows:
+                        staging._remove(row_id)
+                    staging._add(row_id, topic, info, keywords)
+                    if vector is not None:
+                        staging.vectors.set(row_id, vector)
+                for name in self.INDEX_FIELDS:
+                    setattr(self, name, getattr(staging, name))
+                self._version = version
+                self._checked_at = time.monotonic()
+                self.loaded = True
+                self.reloads += 1
+            return True
+        finally:
+            with self._lock:
+                self._reloading = False
+                self._pending = []
     
-    for topic, info, keywords in all_knowledge:
-        score = 0
+    def _read_snapshot(self):
+        """(versión, filas, embeddings) leídos en una misma transacción, con una conexión propia"""
+        conn = self.storage.connect()
+        try:
+            if self.search_mode != 'keyword':
+                # Calcula antes los embeddings que falten
+                sync_knowledge_embeddings(conn)
+            conn.execute("BEGIN")
+            version = knowledge_version(conn)
+            rows = conn.execute("SELECT id, topic, info, keywords FROM knowledge ORDER BY id").fetchall()
+            embeddings = []
+            if self.search_mode != 'keyword':
+                embeddings = conn.execute("SELECT knowledge_id, vector FROM knowledge_embeddings WHERE model = ? ORDER BY knowledge_id",
+                                          (KNOWLEDGE_EMBEDDING_MODEL,)).fetchall()
+            conn.commit()
+            return version, rows, embeddings
+        except sqlite3.Error as e:
+            print(f"Error cargando índice de conocimiento: {e}")
+            return None
+        finally:
+            conn.close()
+    
+    def maybe_reload(self):
+        """Lanza una recarga en segundo plano si knowledge cambió desde la última carga"""
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        with self._lock:
+            if self._reloading or now - self._checked_at < self.reload_interval:
+                return
+            self._checked_at = now
+            try:
+                version = knowledge_version(self.conn)
+            except sqlite3.Error as e:
+                print(f"Error comprobando cambios de conocimiento: {e}")
+                return
+            if version == self._version:
+                return
+            self._reloading = True
+        threading.Thread(target=self.load, name='knowledge-reload', daemon=True).start()
+    
+    def learn(self, topic, info, category, keywords):
+        """Guarda (o reemplaza) un tema y actualiza el índice sin recargar.
         
-        # Búsqueda en topic
-        if query_lower in topic:
-            score += 0.9
-        elif nlp.similarity(query_lower, topic) > 0.7:
-            score += 0.7
+        BEGIN IMMEDIATE puede esperar hasta busy_timeout a otro escritor, así que
+        la transacción se confirma antes de tomar self._lock: las búsquedas solo
+        se paran mientras se actualizan las estructuras en memoria.
+        """
+        topic_norm = normalize_topic(topic)
+        vector = None
+        if self.search_mode != 'keyword':
+            vector = embed_knowledge(topic, info, keywords)
+        with self._write_lock:
+            conn = self.write_conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                before = knowledge_version(conn)
+                conn.execute(KNOWLEDGE_UPSERT, (topic, topic_norm, info, category, keywords))
+                after = knowledge_version(conn)
+                row_id = conn.execute("SELECT id FROM knowledge WHERE topic_norm = ?", (topic_norm,)).fetchone()[0]
+                if vector is not None:
+                    # El trigger de actualización borró el embedding anterior
+                    conn.execute("INSERT OR REPLACE INTO knowledge_embeddings (knowledge_id, model, vector) VALUES (?, ?, ?)",
+                                 (row_id, KNOWLEDGE_EMBEDDING_MODEL, vector.tobytes()))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            # _write_lock sigue tomado: los cambios en memoria van en el orden de los commits
+            with self._lock:
+                # El cambio propio no obliga a recargar, salvo que hubiera cambios ajenos pendientes
+                if before == self._version:
+                    self._version = after
+                if row_id in self.rows:
+                    self._remove(row_id)
+                self._add(row_id, topic, info, keywords)
+                if vector is not None:
+                    self.vectors.set(row_id, vector)
+                if self._reloading:
+                    self._pending.append((row_id, topic, info, keywords, vector))
+    
+    def _candidates(self, query_lower):
+        """Filas que pueden puntuar por encima de cero para la consulta"""
+        if len(query_lower) < 3:
+            return set(self.rows)
         
-        # Búsqueda en keywords
-        if keywords:
-            keyword_list = keywords.split(',')
-            for kw in keyword_list:
-                if kw.strip() in query_lower or query_lower in kw.strip():
-                    score += 0.5
+        # La consulta contenida en topic, keywords o info: lista del trigrama más raro
+        grams = {query_lower[i:i + 3] for i in range(len(query_lower) - 2)}
+        rarest = min((self.trigrams.get(g, ()) for g in grams), key=len)
+        candidates = set(rarest)
         
-        # Búsqueda en info (menos peso)
-        if query_lower in info.lower():
-            score += 0.3
+        # Palabras clave contenidas en la consulta (cualquier subcadena, incluida la vacía)
+        length = len(query_lower)
+        for start in range(length + 1):
+            for end in range(start, min(length, start + self.max_keyword) + 1):
+                ids = self.keywords.get(query_lower[start:end])
+                if ids:
+                    candidates.update(ids)
         
-        if score > 0:
-            results.append((topic, info, score))
+        # Temas que pueden superar 0.7 de similitud: de longitud compatible y con
+        # algún trigrama en común. Las listas se recorren de la más corta a la más
+        # larga hasta agotar KNOWLEDGE_FUZZY_MAX_POSTINGS entradas: con pocos temas
+        # se ven todas; con muchos se saltan las de los trigramas más frecuentes,
+        # que apenas distinguen un tema de otro, y el coste deja de crecer con la tabla.
+        # Las KNOWLEDGE_FUZZY_MIN_LISTS primeras van siempre, para no perder un tema
+        # corto con una errata cuyos trigramas compartidos son todos frecuentes
+        grams = sorted(set(char_ngrams(query_lower)), key=lambda gram: len(self.topic_trigrams.get(gram, ())))
+        fuzzy = set()
+        budget = KNOWLEDGE_FUZZY_MAX_POSTINGS
+        for position, gram in enumerate(grams):
+            postings = self.topic_trigrams.get(gram, ())
+            if position >= KNOWLEDGE_FUZZY_MIN_LISTS and len(postings) > budget:
+                break
+            fuzzy.update(postings)
+            budget -= len(postings)
+        
+        # La consulta va como segunda secuencia para preparar su tabla una sola vez
+        low, high = int(length * 0.7 / 1.3), int(length * 1.3 / 0.7) + 1
+        matcher = SequenceMatcher(None)
+        matcher.set_seq2(query_lower)
+        for row_id in fuzzy.difference(candidates):
+            topic = self.rows[row_id][0]
+            if not low <= len(topic) <= high:
+                continue
+            matcher.set_seq1(topic)
+            if matcher.quick_ratio() > 0.7:
+                candidates.add(row_id)
+        return candidates
     
-    conn.close()
+    def search(self, query_lower, mode=None):
+        """Mejor fila de conocimiento (info, puntuación) sin tocar el disco"""
+        self.maybe_reload()
+        mode = mode or self.search_mode
+        with self._lock:
+            row_id = self.topics.get(query_lower)
+            if row_id is not None:
+                return self.rows[row_id][1], 1.0
+            
+            if mode == 'keyword' or not self.vectors.size:
+                candidates, similarity = self._candidates(query_lower), {}
+            else:
+                # Un producto matriz-vector para todas las filas; las más cercanas
+                # se añaden a los candidatos por palabras clave
+                similarities = self.vectors.similarities(embed_text([(query_lower, 1.0)]))
+                nearest = self.vectors.top_k(similarities, KNOWLEDGE_VECTOR_CANDIDATES)
+                if mode == 'vector':
+                    row_id, value = nearest[0]
+                    if value < KNOWLEDGE_VECTOR_MIN_SIMILARITY:
+                        return None, 0
+                    return self.rows[row_id][1], value
+                candidates = self._candidates(query_lower) | {row_id for row_id, _ in nearest}
+                positions = self.vectors.positions
+                similarity = {row_id: float(similarities[positions[row_id]])
+                              for row_id in candidates if row_id in positions}
+            
+            best = None
+            for row_id in candidates:
+                topic, info, keywords = self.rows[row_id]
+                score = knowledge_score(query_lower, topic, info, keywords)
+                value = similarity.get(row_id, 0)
+                if value >= KNOWLEDGE_VECTOR_MIN_SIMILARITY:
+                    score += KNOWLEDGE_VECTOR_WEIGHT * value
+                # A igual puntuación gana la fila más antigua
+                if score > 0 and (best is None or (-score, row_id) < (-best[1], best[0])):
+                    best = (row_id, score)
+            if best is None:
+                return None, 0
+            return self.rows[best[0]][1], best[1]
     
-    if results:
-        results.sort(key=lambda x: x[2], reverse=True)
-        if results[0][2] >= threshold:
-            return results[0][1], results[0][2]
+    def stats(self):
+        return {'loaded': self.loaded, 'rows': len(self.rows), 'reloads': self.reloads,
+                'search_mode': self.search_mode, 'vectors': self.vectors.size}
+
+def search_knowledge(query, threshold=0.6, mode=None):
+    """Búsqueda inteligente en base de conocimientos con puntuación"""
+    query_lower = query.lower()
+    
+    # Índice en memoria; la consulta a la base de datos (solo por palabras clave)
+    # queda como respaldo
+    if knowledge_index.loaded:
+        info, score = knowledge_index.search(query_lower, mode)
+    else:
+        info, score = search_knowledge_db(query_lower)
     
+    if info is not None and score >= threshold:
+        return info, score
     return None, 0
 
-def search_wikipedia(query):
-    """Búsqueda mejorada en Wikipedia con manejo de errores"""
-    if not query or len(query.strip()) < 2:
-        return "Necesito un tema válido para buscar en Wikipedia."
-    
+# TTL en segundos por tipo de resultado; los errores de red no se guardan
+WIKIPEDIA_CACHE_TTLS = {
+    'summary': 7 * 86400,
+    'disambiguation': 86400,
+    'suggestions': 86400,
+    'not_found': 6 * 3600,      # Caché negativa: evita repetir búsquedas sin resultado
+}
+
+# Tamaño del nivel en memoria configurable con BARO_WIKIPEDIA_CACHE_SIZE
+wikipedia_cache = PersistentCache(storage, 'wikipedia', WIKIPEDIA_CACHE_TTLS,
+                                  memory_size=int(os.environ.get('BARO_WIKIPEDIA_CACHE_SIZE', 1024)))
+
+def wikipedia_cache_key(query):
+    """Consulta normalizada con el idioma de Wikipedia"""
+    return f"{WIKIPEDIA_LANGUAGE}:{normalize_topic(query).strip('¿?¡!.,;: ')}"
+
+def fetch_wikipedia(query):
+    """Consulta Wikipedia por la red; devuelve (kind, valor)"""
     try:
         # Intentar búsqueda directa
-        summary = wikipedia.summary(query, sentences=3, auto_suggest=True)
-        return summary
+        return 'summary', wikipedia.summary(query, sentences=3, auto_suggest=True)
     except wikipedia.exceptions.DisambiguationError as e:
         # Múltiples opciones encontradas
-        options = e.options[:6]
-        return f"Encontré varias opciones para '{query}'. ¿Te refieres a: {', '.join(options)}? Especifica cuál quieres."
+        return 'disambiguation', e.options[:6]
     except wikipedia.exceptions.PageError:
         # Página no encontrada, intentar búsqueda
         try:
             search_results = wikipedia.search(query, results=5)
             if search_results:
-                return f"No encontré '{query}' exactamente, pero encontré: {', '.join(search_results)}. ¿Cuál te interesa?"
-            else:
-                return f"No encontré información sobre '{query}' en Wikipedia. Intenta reformular tu búsqueda."
-        except:
-            return f"No pude encontrar '{query}' en Wikipedia."
+                return 'suggestions', search_results
+            return 'not_found', None
+        except Exception:
+            return 'search_error', None
     except Exception as e:
         print(f"Error en Wikipedia: {e}")
-        return "Hubo un error al buscar en Wikipedia. Intenta de nuevo."
+        return 'error', None
+
+def search_wikipedia(query):
+    """Búsqueda mejorada en Wikipedia con manejo de errores y caché persistente"""
+    if not query or len(query.strip()) < 2:
+        return "Necesito un tema válido para buscar en Wikipedia."
+    
+    key = wikipedia_cache_key(query)
+    cached = wikipedia_cache.get(key)
+    if cached is None:
+        cached = fetch_wikipedia(query)
+        if cached[0] in WIKIPEDIA_CACHE_TTLS:
+            wikipedia_cache.set(key, *cached)
+    kind, value = cached
+    
+    if kind == 'summary':
+        return value
+    if kind == 'disambiguation':
+        return f"Encontré varias opciones para '{query}'. ¿Te refieres a: {', '.join(value)}? Especifica cuál quieres."
+    if kind == 'suggestions':
+        return f"No encontré '{query}' exactamente, pero encontré: {', '.join(value)}. ¿Cuál te interesa?"
+    if kind == 'not_found':
+        return f"No encontré información sobre '{query}' en Wikipedia. Intenta reformular tu búsqueda."
+    if kind == 'search_error':
+        return f"No pude encontrar '{query}' en Wikipedia."
+    return "Hubo un error al buscar en Wikipedia. Intenta de nuevo."
+
+# Condiciones actuales válidas 10 minutos; el pronóstico de varios días, 3 horas.
+# Los errores del servicio (kind 'error') no se guardan
+WEATHER_CURRENT_TTL = 600
+WEATHER_CACHE_TTLS = {'forecast': 3 * 3600, 'not_found': 3600}
+# Hora representativa de cada parte del día en el pronóstico por horas de wttr.in
+WEATHER_PARTS = {'manana': (900, 'por la mañana'), 'tarde': (1500, 'por la tarde'), 'noche': (2100, 'por la noche')}
+WEATHER_DAYS = {0: 'hoy', 1: 'mañana', 2: 'pasado mañana'}
+WEATHER_PERIOD_RE = re.compile(
+    r'\b(?:(?P<after>pasado\s+ma[nñ]ana)|(?:esta|por\s+la|en\s+la)\s+(?P<part>ma[nñ]ana|tarde|noche)'
+    r'|(?P<tomorrow>ma[nñ]ana)|hoy|ahora|ahorita)\b'
+)
 
-def get_weather(location="La Habana"):
-    """Obtener clima con mejor formato y respuesta natural"""
+# Traducción simple de condiciones comunes
+WEATHER_TRANSLATIONS = {
+    'Sunny': 'soleado',
+    'Clear': 'despejado',
+    'Partly cloudy': 'parcialmente nublado',
+    'Cloudy': 'nublado',
+    'Overcast': 'muy nublado',
+    'Mist': 'neblina',
+    'Fog': 'niebla',
+    'Light rain': 'lluvia ligera',
+    'Rain': 'lluvia',
+    'Heavy rain': 'lluvia fuerte',
+    'Thunderstorm': 'tormenta',
+    'Snow': 'nieve'
+}
+
+weather_cache = PersistentCache(storage, 'weather', WEATHER_CACHE_TTLS, memory_size=256)
+weather_flights = SingleFlight()
+
+def weather_period(text):
+    """(día, parte del día) pedidos en el texto: 0 hoy, 1 mañana, 2 pasado mañana"""
+    day, part = 0, None
+    for match in WEATHER_PERIOD_RE.finditer(text):
+        if match.group('after'):
+            day = 2
+        elif match.group('tomorrow'):
+            day = 1
+        elif match.group('part'):
+            part = match.group('part').replace('ñ', 'n')
+    return day, part
+
+def weather_condition(entry):
+    condition = entry['weatherDesc'][0]['value'].strip()
+    return WEATHER_TRANSLATIONS.get(condition, condition.lower())
+
+def fetch_weather(location_url):
+    """Descarga el pronóstico completo; se guardan las condiciones actuales y los días por horas"""
+    response = http_client.get('clima', f"http://wttr.in/{location_url}?format=j1")
+    # Solo un 404 o una ubicación desconocida es "no encontrado"; 429/5xx tras los reintentos no se guardan
+    if response.status_code == 404 or 'unknown location' in response.text[:200].lower():
+        return 'not_found', None
+    if response.status_code != 200:
+        print(f"Error clima: HTTP {response.status_code}")
+        return 'error', None
+    data = response.json()
+    if not data.get('current_condition'):
+        return 'not_found', None
+    hourly_fields = ('time', 'tempC', 'FeelsLikeC', 'humidity', 'chanceofrain', 'weatherDesc')
+    return 'forecast', {
+        'fetched_at': time.time(),
+        'current': {k: data['current_condition'][0][k] for k in ('temp_C', 'FeelsLikeC', 'humidity', 'weatherDesc')},
+        'days': [{
+            'date': day['date'],
+            'maxtempC': day['maxtempC'],
+            'mintempC': day['mintempC'],
+            'hourly': [{k: hour.get(k) for k in hourly_fields} for hour in day['hourly']],
+        } for day in data.get('weather', [])],
+    }
+
+def weather_data(location_clean, max_age):
+    """(kind, datos) de la caché si tienen menos de max_age segundos; si no, una sola descarga por ciudad"""
+    key = location_clean.lower()
+    cached = weather_cache.get(key)
+    if cached and (cached[0] == 'not_found' or time.time() - cached[1]['fetched_at'] < max_age):
+        return cached
+    
+    def fetch():
+        result = fetch_weather(location_clean.replace(' ', '+'))
+        if result[0] in WEATHER_CACHE_TTLS:
+            weather_cache.set(key, *result)
+        return result
+    
+    # Los fallos simultáneos para la misma ciudad comparten la descarga
+    return weather_flights.do(key, fetch)
+
+def get_weather(location="La Habana", day=0, part=None):
+    """Obtener clima con mejor formato y respuesta natural.
+    
+    Sin día ni parte del día responde con las condiciones actuales; con ellos,
+    con el pronóstico guardado en la misma descarga.
+    """
     try:
         # Limpiar la ubicación
         location_clean = location.strip().title()
-        location_url = location_clean.replace(' ', '+')
         
-        url = f"http://wttr.in/{location_url}?format=j1"
-        response = requests.get(url, timeout=10)
+        if day == 0 and part is None:
+            kind, data = weather_data(location_clean, WEATHER_CURRENT_TTL)
+        else:
+            kind, data = weather_data(location_clean, WEATHER_CACHE_TTLS['forecast'])
+        if kind == 'not_found':
+            return f"No pude obtener el clima de '{location}'. Verifica que el nombre de la ciudad sea correcto."
+        if kind == 'error':
+            return "El servicio de clima no responde ahora mismo. Intenta de nuevo en unos minutos."
         
-        if response.status_code == 200:
-            data = response.json()
-            current = data['current_condition'][0]
+        if day == 0 and part is None:
+            current = data['current']
             temp_c = current['temp_C']
             feels_like = current['FeelsLikeC']
             humidity = current['humidity']
-            condition = current['weatherDesc'][0]['value']
-            
-            # Traducción simple de condiciones comunes
-            translations = {
-                'Sunny': 'soleado',
-                'Clear': 'despejado',
-                'Partly cloudy': 'parcialmente nublado',
-                'Cloudy': 'nublado',
-                'Overcast': 'muy nublado',
-                'Mist': 'neblina',
-                'Fog': 'niebla',
-                'Light rain': 'lluvia ligera',
-                'Rain': 'lluvia',
-                'Heavy rain': 'lluvia fuerte',
-                'Thunderstorm': 'tormenta',
-                'Snow': 'nieve'
-            }
-            
-            condition_es = translations.get(condition, condition.lower())
+            condition_es = weather_condition(current)
             
             # Respuesta más natural y formateada con pausas
             respuestas = [
@@ -657,41 +3491,176 @@ def get_weather(location="La Habana"):
                 f"El pronóstico en {location_clean}: {temp_c} grados centígrados, {condition_es}. Sensación térmica de {feels_like} grados. Con una humedad de {humidity} por ciento en el ambiente.",
             ]
             return random.choice(respuestas)
-        else:
-            return f"No pude obtener el clima de '{location}'. Verifica que el nombre de la ciudad sea correcto."
+        
+        # Pronóstico: día pedido y, si se indicó, la hora representativa de esa parte del día
+        if day >= len(data['days']):
+            return f"Solo tengo el pronóstico de {location_clean} para los próximos {len(data['days'])} días."
+        forecast = data['days'][day]
+        when = WEATHER_DAYS.get(day, forecast['date'])
+        if part:
+            hour, part_name = WEATHER_PARTS[part]
+            entry = min(forecast['hourly'], key=lambda h: abs(int(h['time']) - hour))
+            return (f"En {location_clean} {when} {part_name}: {entry['tempC']} grados, {weather_condition(entry)}. "
+                    f"Sensación térmica de {entry['FeelsLikeC']} grados y {entry['chanceofrain']} por ciento de probabilidad de lluvia.")
+        
+        midday = min(forecast['hourly'], key=lambda h: abs(int(h['time']) - 1200))
+        rain = max(int(h['chanceofrain'] or 0) for h in forecast['hourly'])
+        return (f"El pronóstico para {when} en {location_clean}: máxima de {forecast['maxtempC']} y mínima de "
+                f"{forecast['mintempC']} grados, {weather_condition(midday)}. Probabilidad de lluvia de hasta {rain} por ciento.")
     except Exception as e:
         print(f"Error clima: {e}")
         return "No pude conectarme al servicio de clima. Revisa tu conexión a internet."
 
+RSS_FEEDS = {
+    "google": "https://news.google.com/rss?hl=es&gl=ES&ceid=ES:es",
+    "bbc": "http://feeds.bbci.co.uk/mundo/rss.xml",
+    "elpais": "https://feeds.elpais.com/elpais/portada.xml",
+    "cnn": "http://cnnespanol.cnn.com/feed/"
+}
+
+class NewsPrefetcher:
+    """Mantiene en memoria los titulares de cada fuente de RSS_FEEDS.
+    
+    Un hilo en segundo plano refresca todas las fuentes cada interval segundos
+    con peticiones condicionales (If-None-Match / If-Modified-Since), así que
+    un feed sin cambios no se vuelve a descargar. Si un refresco falla se
+    conservan los titulares anteriores, se anota el error para informar de
+    su antigüedad y esa fuente se reintenta con espera exponencial desde
+    retry_backoff segundos (sin pasar de interval). El hilo arranca con el
+    servidor o con la primera consulta; si llega una petición antes del
+    primer refresco de su fuente, espera a ese refresco (como mucho
+    first_wait segundos) en lugar de descargar el feed por su cuenta.
+    """
+    
+    def __init__(self, feeds, interval=600.0, timeout=None, max_headlines=5, first_wait=10.0, retry_backoff=15.0):
+        self.feeds = feeds
+        self.interval = interval
+        self.timeout = timeout
+        self.max_headlines = max_headlines
+        self.first_wait = first_wait
+        self.retry_backoff = retry_backoff
+        self._ready = {source: threading.Event() for source in feeds}
+        self.state = {source: {'headlines': [], 'etag': None, 'modified': None, 'updated_at': None,
+                               'checked_at': None, 'error': None, 'failures': 0, 'not_modified': 0}
+                      for source in feeds}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='news-prefetcher', daemon=True)
+                self._thread.start()
+    
+    def _run(self):
+        due = dict.fromkeys(self.feeds, 0.0)
+        failed = dict.fromkeys(self.feeds, 0)      # fallos seguidos de cada fuente
+        while not self._stop.is_set():
+            for source in self.feeds:
+                if time.monotonic() < due[source]:
+                    continue
+                self.refresh(source)
+                with self._lock:
+                    failed[source] = failed[source] + 1 if self.state[source]['error'] else 0
+                delay = self.interval
+                if failed[source]:
+                    delay = min(self.interval, self.retry_backoff * 2 ** min(failed[source] - 1, 10))
+                due[source] = time.monotonic() + delay
+            self._stop.wait(max(0.0, min(due.values()) - time.monotonic()))
+    
+    def refresh(self, source):
+        """Descarga el feed si cambió y actualiza sus titulares"""
+        with self._lock:
+            state = dict(self.state[source])
+        headers = {}
+        if state['etag']:
+            headers['If-None-Match'] = state['etag']
+        if state['modified']:
+            headers['If-Modified-Since'] = state['modified']
+        
+        update = {'checked_at': time.time()}
+        try:
+            response = http_client.get('noticias', self.feeds[source], headers=headers, timeout=self.timeout)
+            if response.status_code == 304:
+                update['error'] = None
+                update['not_modified'] = state['not_modified'] + 1
+            elif response.status_code == 200:
+                feed = feedparser.parse(response.content)
+                if not feed.entries:
+                    raise ValueError("feed sin entradas")
+                update.update({
+                    'headlines': [entry.title for entry in feed.entries[:self.max_headlines]],
+                    'etag': response.headers.get('ETag'),
+                    'modified': response.headers.get('Last-Modified'),
+                    'updated_at': update['checked_at'],
+                    'error': None,
+                })
+            else:
+                raise ValueError(f"HTTP {response.status_code}")
+        except Exception as e:
+            print(f"Error noticias ({source}): {e}")
+            update['error'] = str(e)
+            update['failures'] = state['failures'] + 1
+        with self._lock:
+            self.state[source].update(update)
+        self._ready[source].set()
+    
+    def get(self, source):
+        """Copia del estado de una fuente; antes del primer refresco espera al hilo"""
+        self.start()
+        self._ready[source].wait(self.first_wait)
+        with self._lock:
+            return dict(self.state[source])
+    
+    def stop(self, timeout=5.0):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+    
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return {source: {
+                'headlines': len(state['headlines']),
+                'age_seconds': round(now - state['updated_at']) if state['updated_at'] else None,
+                'not_modified': state['not_modified'],
+                'failures': state['failures'],
+                'error': state['error'],
+            } for source, state in self.state.items()}
+
+# Intervalo de refresco y primera espera tras un fallo configurables con
+# BARO_NEWS_REFRESH_INTERVAL y BARO_NEWS_RETRY_BACKOFF (segundos)
+news_prefetcher = NewsPrefetcher(RSS_FEEDS, interval=float(os.environ.get('BARO_NEWS_REFRESH_INTERVAL', 600)),
+                                 retry_backoff=float(os.environ.get('BARO_NEWS_RETRY_BACKOFF', 15)))
+
 def get_news(source="google"):
-    """Obtener noticias con mejor formato"""
-    rss_feeds = {
-        "google": "https://news.google.com/rss?hl=es&gl=ES&ceid=ES:es",
-        "bbc": "http://feeds.bbci.co.uk/mundo/rss.xml",
-        "elpais": "https://feeds.elpais.com/elpais/portada.xml",
-        "cnn": "http://cnnespanol.cnn.com/feed/"
-    }
+    """Obtener noticias con mejor formato, desde los titulares precargados"""
+    feed_source = source.lower() if source.lower() in RSS_FEEDS else "google"
+    state = news_prefetcher.get(feed_source)
     
-    url = rss_feeds.get(source.lower(), rss_feeds["google"])
+    if not state['headlines']:
+        if state['error']:
+            return "Error al conectar con el servicio de noticias."
+        return "No pude obtener noticias en este momento. Intenta más tarde."
     
-    try:
-        feed = feedparser.parse(url)
-        if feed.entries:
-            headlines = [entry.title for entry in feed.entries[:5]]
-            source_name = source.upper() if source != "google" else "Google Noticias"
-            return f"Últimas noticias de {source_name}: {'. '.join(headlines)}."
-        else:
-            return "No pude obtener noticias en este momento. Intenta más tarde."
-    except Exception as e:
-        print(f"Error noticias: {e}")
-        return "Error al conectar con el servicio de noticias."
+    source_name = source.upper() if source != "google" else "Google Noticias"
+    response = f"Últimas noticias de {source_name}: {'. '.join(state['headlines'])}."
+    if state['error']:
+        # El último refresco falló: avisar de la antigüedad de los titulares
+        minutes = max(1, round((time.time() - state['updated_at']) / 60))
+        response += f" Son de hace {minutes} minutos; no pude actualizarlas."
+    return response
 
 def get_location(query):
     """Búsqueda de ubicación mejorada"""
     try:
         url = f"https://nominatim.openstreetmap.org/search?q={query}&format=json&limit=1"
         headers = {'User-Agent': 'BaroAssistant/2.0'}
-        response = requests.get(url, headers=headers, timeout=10)
+        response = http_client.get('ubicacion', url, headers=headers)
         
         if response.status_code == 200:
             data = response.json()
@@ -711,118 +3680,220 @@ def get_location(query):
 
 def learn_new(topic, info):
     """Aprender nueva información"""
-    conn = sqlite3.connect('baro.db')
-    c = conn.cursor()
-    c.execute("INSERT OR REPLACE INTO knowledge (topic, info, category, keywords) VALUES (?, ?, ?, ?)", 
-             (topic.lower(), info, "usuario", topic.lower()))
-    conn.commit()
-    conn.close()
+    if knowledge_index.loaded:
+        # Escribe en la base de datos y actualiza el índice en memoria
+        knowledge_index.learn(topic.lower(), info, "usuario", topic.lower())
+    else:
+        conn = storage.connection()
+        conn.execute(KNOWLEDGE_UPSERT, (topic.lower(), normalize_topic(topic), info, "usuario", topic.lower()))
+        conn.commit()
     return f"¡Perfecto! Aprendí sobre '{topic}'. Ahora puedes preguntarme sobre esto cuando quieras."
 
+# Nombres de idiomas en español y códigos de idioma
+TRANSLATION_LANGUAGES = {
+    'ingles': 'en',
+    'english': 'en',
+    'en': 'en',
+    'frances': 'fr',
+    'francés': 'fr',
+    'french': 'fr',
+    'fr': 'fr',
+    'aleman': 'de',
+    'alemán': 'de',
+    'deutsch': 'de',
+    'german': 'de',
+    'de': 'de',
+    'portugues': 'pt',
+    'portugués': 'pt',
+    'portuguese': 'pt',
+    'pt': 'pt',
+    'italiano': 'it',
+    'italian': 'it',
+    'it': 'it',
+    'chino': 'zh',
+    'chino simplificado': 'zh-CN',
+    'chino tradicional': 'zh-TW',
+    'chinese': 'zh',
+    'zh': 'zh',
+    'japones': 'ja',
+    'japonés': 'ja',
+    'japanese': 'ja',
+    'ja': 'ja',
+    'ruso': 'ru',
+    'russian': 'ru',
+    'ru': 'ru',
+    'arabe': 'ar',
+    'árabe': 'ar',
+    'arabic': 'ar',
+    'ar': 'ar',
+    'coreano': 'ko',
+    'korean': 'ko',
+    'ko': 'ko',
+    'tailandes': 'th',
+    'tailandés': 'th',
+    'thai': 'th',
+    'th': 'th',
+    'vietnamita': 'vi',
+    'vietnamese': 'vi',
+    'vi': 'vi',
+    'holandes': 'nl',
+    'holandés': 'nl',
+    'dutch': 'nl',
+    'nl': 'nl',
+    'sueco': 'sv',
+    'swedish': 'sv',
+    'sv': 'sv',
+    'noruego': 'no',
+    'norwegian': 'no',
+    'no': 'no',
+    'danes': 'da',
+    'danés': 'da',
+    'danish': 'da',
+    'da': 'da',
+    'griego': 'el',
+    'greek': 'el',
+    'el': 'el',
+    'turco': 'tr',
+    'turkish': 'tr',
+    'tr': 'tr',
+    'hindi': 'hi',
+    'hi': 'hi',
+    'bengali': 'bn',
+    'bn': 'bn',
+    'polaco': 'pl',
+    'polish': 'pl',
+    'pl': 'pl',
+    'rumano': 'ro',
+    'romanian': 'ro',
+    'ro': 'ro',
+    'ucraniano': 'uk',
+    'ukrainian': 'uk',
+    'uk': 'uk',
+    'hebreo': 'he',
+    'hebrew': 'he',
+    'he': 'he',
+    'finlandés': 'fi',
+    'finnish': 'fi',
+    'fi': 'fi',
+    'islandés': 'is',
+    'icelandic': 'is',
+    'is': 'is',
+    'checoslovaco': 'cs',
+    'czech': 'cs',
+    'cs': 'cs',
+}
+
+TRANSLATION_LANGUAGE_NAMES = {
+    'en': 'inglés',
+    'fr': 'francés',
+    'de': 'alemán',
+    'it': 'italiano',
+    'pt': 'portugués',
+    'zh': 'chino',
+    'ja': 'japonés',
+    'ru': 'ruso',
+    'ar': 'árabe',
+    'ko': 'coreano',
+    'th': 'tailandés',
+    'vi': 'vietnamita',
+    'nl': 'holandés',
+    'sv': 'sueco',
+    'no': 'noruego',
+    'da': 'danés',
+    'el': 'griego',
+    'tr': 'turco',
+    'hi': 'hindi',
+    'bn': 'bengalí',
+    'pl': 'polaco',
+    'ro': 'rumano',
+    'uk': 'ucraniano',
+    'he': 'hebreo',
+    'fi': 'finlandés',
+    'is': 'islandés',
+    'cs': 'checo',
+}
+
+# Memoria de traducción: las traducciones apenas cambian, se guardan 90 días
+TRANSLATION_CACHE_TTLS = {'translation': 90 * 86400}
+
+# Límites configurables con BARO_TRANSLATION_MEMORY_SIZE (memoria) y BARO_TRANSLATION_MEMORY_MAX (disco)
+translation_memory = PersistentCache(storage, 'translation', TRANSLATION_CACHE_TTLS,
+                                     memory_size=int(os.environ.get('BARO_TRANSLATION_MEMORY_SIZE', 2048)),
+                                     max_entries=int(os.environ.get('BARO_TRANSLATION_MEMORY_MAX', 50000)))
+
+# Frases por llamada a translate_batch (POST /translate) y peticiones simultáneas a
+# MyMemory; no pasa del tamaño del pool de http_client por host
+TRANSLATION_BATCH_MAX = 100
+translation_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='traduccion')
+
+def translation_language_code(target_language):
+    """Código de idioma para un nombre o código, o None si no se reconoce"""
+    target_lang = target_language.lower().strip()
+    lang_code = TRANSLATION_LANGUAGES.get(target_lang, target_lang)
+    return lang_code if len(lang_code) >= 2 else None
+
+def translation_key(text, lang_code):
+    """Texto de origen normalizado con el idioma de destino"""
+    return f"{lang_code}:{WHITESPACE_RE.sub(' ', text.lower()).strip('¿?¡!.,;: ')}"
+
+def fetch_translation(text, lang_code):
+    """Traduce con MyMemory (API gratuita); devuelve (kind, valor)"""
+    try:
+        api_url = f"https://api.mymemory.translated.net/get?q={quote(text)}&langpair=es|{lang_code}"
+        response = http_client.get('traduccion', api_url)
+        if response.status_code != 200:
+            return 'http_error', None
+        data = response.json()
+        if data['responseStatus'] != 200:
+            return 'untranslated', None
+        return 'translation', data['responseData']['translatedText']
+    except Exception as e:
+        print(f"Error en traducción: {e}")
+        return 'error', None
+
+def lookup_translation(text, lang_code):
+    """Consulta la memoria de traducción antes que la red; solo se guardan los aciertos"""
+    key = translation_key(text, lang_code)
+    cached = translation_memory.get(key)
+    if cached is not None:
+        return cached
+    kind, translated = fetch_translation(text, lang_code)
+    if kind == 'translation':
+        translation_memory.set(key, kind, translated)
+    return kind, translated
+
+def translate_batch(texts, lang_code):
+    """Traduce varias frases; solo las que no están en la memoria van a la red.
+    
+    Las que faltan (sin repetir) se piden a la vez por el pool de http_client.
+    Devuelve una traducción (o None si falló) por cada texto, en el mismo orden.
+    """
+    keys = [translation_key(text, lang_code) for text in texts]
+    results = {}
+    misses = {}
+    for text, key in zip(texts, keys):
+        if key in results or key in misses:
+            continue
+        cached = translation_memory.get(key)
+        if cached is not None:
+            results[key] = cached[1]
+        else:
+            misses[key] = text
+    
+    futures = {key: translation_executor.submit(fetch_translation, text, lang_code) for key, text in misses.items()}
+    for key, future in futures.items():
+        kind, translated = future.result()
+        if kind == 'translation':
+            translation_memory.set(key, kind, translated)
+        results[key] = translated
+    return [results[key] for key in keys]
+
 def translate_text(text, target_language):
-    """Traducir texto a otros idiomas usando Google Translate API"""
+    """Traducir texto a otros idiomas usando la memoria de traducción y MyMemory"""
     try:
-        # Mapeo de idiomas en español a códigos de idioma
-        language_map = {
-            'ingles': 'en',
-            'english': 'en',
-            'en': 'en',
-            'frances': 'fr',
-            'francés': 'fr',
-            'french': 'fr',
-            'fr': 'fr',
-            'aleman': 'de',
-            'alemán': 'de',
-            'deutsch': 'de',
-            'german': 'de',
-            'de': 'de',
-            'portugues': 'pt',
-            'portugués': 'pt',
-            'portuguese': 'pt',
-            'pt': 'pt',
-            'italiano': 'it',
-            'italian': 'it',
-            'it': 'it',
-            'chino': 'zh',
-            'chino simplificado': 'zh-CN',
-            'chino tradicional': 'zh-TW',
-            'chinese': 'zh',
-            'zh': 'zh',
-            'japones': 'ja',
-            'japonés': 'ja',
-            'japanese': 'ja',
-            'ja': 'ja',
-            'ruso': 'ru',
-            'russian': 'ru',
-            'ru': 'ru',
-            'arabe': 'ar',
-            'árabe': 'ar',
-            'arabic': 'ar',
-            'ar': 'ar',
-            'coreano': 'ko',
-            'korean': 'ko',
-            'ko': 'ko',
-            'tailandes': 'th',
-            'tailandés': 'th',
-            'thai': 'th',
-            'th': 'th',
-            'vietnamita': 'vi',
-            'vietnamese': 'vi',
-            'vi': 'vi',
-            'holandes': 'nl',
-            'holandés': 'nl',
-            'dutch': 'nl',
-            'nl': 'nl',
-            'sueco': 'sv',
-            'swedish': 'sv',
-            'sv': 'sv',
-            'noruego': 'no',
-            'norwegian': 'no',
-            'no': 'no',
-            'danes': 'da',
-            'danés': 'da',
-            'danish': 'da',
-            'da': 'da',
-            'griego': 'el',
-            'greek': 'el',
-            'el': 'el',
-            'turco': 'tr',
-            'turkish': 'tr',
-            'tr': 'tr',
-            'hindi': 'hi',
-            'hi': 'hi',
-            'bengali': 'bn',
-            'bn': 'bn',
-            'polaco': 'pl',
-            'polish': 'pl',
-            'pl': 'pl',
-            'rumano': 'ro',
-            'romanian': 'ro',
-            'ro': 'ro',
-            'ucraniano': 'uk',
-            'ukrainian': 'uk',
-            'uk': 'uk',
-            'hebreo': 'he',
-            'hebrew': 'he',
-            'he': 'he',
-            'finlandés': 'fi',
-            'finnish': 'fi',
-            'fi': 'fi',
-            'islandés': 'is',
-            'icelandic': 'is',
-            'is': 'is',
-            'sueco': 'sv',
-            'checoslovaco': 'cs',
-            'czech': 'cs',
-            'cs': 'cs',
-        }
-        
-        # Normalizar el idioma de destino
-        target_lang = target_language.lower().strip()
-        lang_code = language_map.get(target_lang, target_lang)
-        
-        # Si no se encuentra el idioma, devolver error
-        if len(lang_code) < 2:
+        # Normalizar el idioma de destino; si no se encuentra, devolver error
+        lang_code = translation_language_code(target_language)
+        if lang_code is None:
             respuestas_error = [
                 f"No reconozco el idioma '{target_language}'. Intenta con idiomas como inglés, francés, alemán, italiano, japonés, chino, portugués, ruso, árabe, coreano, etc.",
                 f"Ese idioma no está disponible. Puedo traducir a: inglés, francés, alemán, italiano, japonés, chino, portugués, ruso, árabe, y otros idiomas principales.",
@@ -830,73 +3901,25 @@ def translate_text(text, target_language):
             ]
             return random.choice(respuestas_error), None
         
-        # Usar Google Translate API (URL pública sin API key)
-        url = "https://translate.googleapis.com/translate_a/element.js?cb=googleTranslateElementInit"
-        
-        # Alternativa: usar servicio de Google Translate sin API key
-        try:
-            # Intentar con mymemorytranslator.com (API gratuita)
-            from urllib.parse import quote
-            api_url = f"https://api.mymemory.translated.net/get?q={quote(text)}&langpair=es|{lang_code}"
-            
-            response = requests.get(api_url, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
-                
-                if data['responseStatus'] == 200:
-                    translated = data['responseData']['translatedText']
-                    
-                    # Nombres de idiomas en español
-                    lang_names = {
-                        'en': 'inglés',
-                        'fr': 'francés',
-                        'de': 'alemán',
-                        'it': 'italiano',
-                        'pt': 'portugués',
-                        'zh': 'chino',
-                        'ja': 'japonés',
-                        'ru': 'ruso',
-                        'ar': 'árabe',
-                        'ko': 'coreano',
-                        'th': 'tailandés',
-                        'vi': 'vietnamita',
-                        'nl': 'holandés',
-                        'sv': 'sueco',
-                        'no': 'noruego',
-                        'da': 'danés',
-                        'el': 'griego',
-                        'tr': 'turco',
-                        'hi': 'hindi',
-                        'bn': 'bengalí',
-                        'pl': 'polaco',
-                        'ro': 'rumano',
-                        'uk': 'ucraniano',
-                        'he': 'hebreo',
-                        'fi': 'finlandés',
-                        'is': 'islandés',
-                        'cs': 'checo',
-                    }
-                    
-                    lang_display = lang_names.get(lang_code, target_language)
-                    
-                    respuestas_exito = [
-                        f"'{text}' en {lang_display} se dice: '{translated}'",
-                        f"La traducción al {lang_display} es: '{translated}'",
-                        f"'{text}' se traduce al {lang_display} como: '{translated}'",
-                        f"En {lang_display}, '{text}' es: '{translated}'",
-                        f"Así se dice en {lang_display}: '{translated}'",
-                    ]
-                    
-                    return random.choice(respuestas_exito), translated
-                else:
-                    return "No pude traducir ese texto. Intenta con otra frase.", None
-            else:
-                return "Error al conectar con el servicio de traducción.", None
-                
-        except Exception as e:
-            print(f"Error en traducción: {e}")
+        kind, translated = lookup_translation(text, lang_code)
+        if kind == 'http_error':
+            return "Error al conectar con el servicio de traducción.", None
+        if kind == 'untranslated':
+            return "No pude traducir ese texto. Intenta con otra frase.", None
+        if kind == 'error':
             return "Error en el servicio de traducción. Intenta de nuevo más tarde.", None
+        
+        lang_display = TRANSLATION_LANGUAGE_NAMES.get(lang_code, target_language)
+        
+        respuestas_exito = [
+            f"'{text}' en {lang_display} se dice: '{translated}'",
+            f"La traducción al {lang_display} es: '{translated}'",
+            f"'{text}' se traduce al {lang_display} como: '{translated}'",
+            f"En {lang_display}, '{text}' es: '{translated}'",
+            f"Así se dice en {lang_display}: '{translated}'",
+        ]
+        
+        return random.choice(respuestas_exito), translated
             
     except Exception as e:
         print(f"Error general traducción: {e}")
@@ -1105,10 +4128,12 @@ def get_time_in_city(city_name):
     except Exception as e:
         print(f"Error obteniendo hora en ciudad: {e}")
         return None
+
+def get_user_location():
     """Obtener ubicación del usuario usando su IP"""
     try:
         # Usar un servicio de geolocalización por IP
-        response = requests.get('https://ipapi.co/json/', timeout=5)
+        response = http_client.get('geoip', 'https://ipapi.co/json/')
         if response.status_code == 200:
             data = response.json()
             city = data.get('city', 'Desconocida')
@@ -1191,26 +4216,33 @@ def calculate_expression(expr):
 # ============= PROCESADOR PRINCIPAL MEJORADO =============
 def process_command(command):
     """Procesador de comandos principal con IA mejorada"""
-    original_command = command
-    command = command.lower().strip()
-    
-    # Detectar activación
-    activation_words = ["baro", "varo"]
-    activated = False
-    for word in activation_words:
-        if command.startswith(word):
-            command = command[len(word):].strip()
-            activated = True
-            break
-    
-    if not activated:
+    started = time.perf_counter()
+    
+    # Analizar el comando una sola vez (activación, normalización, tokens, tipo de pregunta)
+    parsed = nlp.parse(command)
+    command = parsed.text
+    command_norm = parsed.normalized
+    
+    if not parsed.activation_word:
         return "Di 'Baro' o 'Varo' al inicio para activarme."
     
     if not command:
         return "¿En qué puedo ayudarte? Puedes preguntarme sobre cualquier tema, el clima, noticias, hacer cálculos y mucho más."
     
     response = ""
-    intent, confidence = nlp.detect_intent(command)
+    intent, confidence = nlp.detect_intent(parsed)
+    intent_source = 'rule' if intent else None
+    
+    # PRIORIDAD 3: sin coincidencia clara y sin forma de pregunta, probar el
+    # clasificador estadístico antes de caer en la búsqueda de conocimiento
+    if (intent is None or confidence < 0.8) and not parsed.is_question and parsed.question_type is None:
+        fallback = nlp.fallback_intent(parsed)
+        if fallback and (intent is None or fallback[1] > confidence):
+            intent, confidence = fallback
+            intent_source = 'fallback'
+    
+    # Con la intención decidida, la ciudad solo se busca para clima y hora
+    parsed.slots = nlp.command_slots(parsed, intent)
     
     # === COMANDO APRENDER ===
     if "aprende" in command or "recuerda" in command:
@@ -1258,28 +4290,18 @@ def process_command(command):
     
     # === HORA Y FECHA ===
     # Hora: CON CONTEXTO DE TIEMPO DEL DÍA
-    if intent == "hora":
-        # Verificar si es una pregunta de hora en una ciudad específica
-        city_match = None
-        if ' en ' in command_norm:
-            # Extraer ciudad después de "en"
-            parts = command_norm.split(' en ')
-            if len(parts) > 1:
-                city_name = parts[-1].strip().rstrip('?.,!')
-                if city_name and len(city_name) > 2:
-                    city_time = get_time_in_city(city_name)
-                    if city_time:
-                        response = city_time
-                    else:
-                        # Si no se encuentra la ciudad, mostrar hora local
-                        response = f"No encuentro '{city_name}' en mi base de datos de zonas horarias. Intenta con otra ciudad."
-                else:
-                    city_time = None
+    elif intent == "hora":
+        # Hora en una ciudad específica ("qué hora es en [ciudad]")
+        city_name = parsed.slots.get('city')
+        if city_name and len(city_name) > 2:
+            city_time = get_time_in_city(city_name)
+            if city_time:
+                response = city_time
             else:
-                city_time = None
+                response = f"No encuentro '{city_name}' en mi base de datos de zonas horarias. Intenta con otra ciudad."
         
-        # Si no se detectó una ciudad o no se encontró, mostrar hora local
-        if ' en ' not in command_norm or not city_match:
+        # Si no se pidió una ciudad, mostrar hora local
+        else:
             now = datetime.datetime.now()
             hora = now.hour
             minutos = now.minute
@@ -1347,14 +4369,17 @@ def process_command(command):
     
     # === CLIMA ===
     elif intent == "clima":
-        location = nlp.extract_query(command, "clima")
-        if not location or location in ["hoy", "ahora", "actual", "clima", "tiempo", "el", "la", ""]:
+        location = parsed.slots.get('city') or nlp.extract_query(parsed, "clima")
+        # "mañana", "esta tarde"...: se responde con el pronóstico ya descargado
+        day, part = weather_period(parsed.normalized)
+        location = WHITESPACE_RE.sub(' ', WEATHER_PERIOD_RE.sub('', location or '')).strip()
+        if not location or location in ["hoy", "ahora", "actual", "clima", "tiempo", "el", "la", "por", "esta", "hace", "en", "para", ""]:
             location = "La Habana"
-        response = get_weather(location)
+        response = get_weather(location, day, part)
     
     # === BÚSQUEDAS EN INTERNET ===
     elif intent == "buscar":
-        query = nlp.extract_query(command, "buscar")
+        query = nlp.extract_query(parsed, "buscar")
         if query and len(query.strip()) > 0:
             local_result, local_score = search_knowledge(query, threshold=0.5)
             if local_result and local_score > 0.6:
@@ -1367,7 +4392,7 @@ def process_command(command):
     
     # === YOUTUBE ===
     elif intent == "youtube":
-        query = nlp.extract_query(command, "youtube")
+        query = nlp.extract_query(parsed, "youtube")
         if query and len(query.strip()) > 0:
             local_result, local_score = search_knowledge(query, threshold=0.4)
             if local_result and local_score > 0.5:
@@ -1384,7 +4409,7 @@ def process_command(command):
     
     # === CALCULADORA ===
     elif intent == "calculadora":
-        query = nlp.extract_query(command, "calculadora")
+        query = parsed.slots.get('math_expression') or nlp.extract_query(parsed, "calculadora")
         if query and len(query.strip()) > 0:
             result = calculate_expression(query)
             if result is not None:
@@ -1433,14 +4458,7 @@ def process_command(command):
     
     # === NOTICIAS ===
     elif intent == "noticias":
-        source = "google"
-        if "bbc" in command:
-            source = "bbc"
-        elif "pais" in command or "elpais" in command:
-            source = "elpais"
-        elif "cnn" in command:
-            source = "cnn"
-        response = get_news(source)
+        response = get_news(parsed.slots.get('news_source', 'google'))
     
     # === UBICACIÓN DEL USUARIO ===
     elif intent == "ubicación" and any(phrase in command for phrase in ["dónde estoy", "donde estoy", "mi ubicación", "mi ubicacion", "mi localización", "localización actual", "mi posición", "donde me encuentro"]):
@@ -1455,7 +4473,7 @@ def process_command(command):
     
     # === BÚSQUEDA DE UBICACIONES ===
     elif intent == "ubicación":
-        query = nlp.extract_query(command, "ubicacion")
+        query = parsed.slots.get('place') or nlp.extract_query(parsed, "ubicacion")
         if query and len(query.strip()) > 0:
             response = get_location(query)
         else:
@@ -1463,97 +4481,19 @@ def process_command(command):
     
     # === TRADUCCIÓN ===
     elif intent == "traducir":
-        # Extraer palabras clave para idioma
-        query = nlp.extract_query(command, "traducir").lower()
-        
-        # Detectar idioma y texto a traducir
-        idiomas = {
-            'en ': ('inglés', 'en'),
-            'al ingles': ('inglés', 'en'),
-            'en inglés': ('inglés', 'en'),
-            'en ingles': ('inglés', 'en'),
-            'al francés': ('francés', 'fr'),
-            'al frances': ('francés', 'fr'),
-            'en francés': ('francés', 'fr'),
-            'en frances': ('francés', 'fr'),
-            'al alemán': ('alemán', 'de'),
-            'al aleman': ('alemán', 'de'),
-            'en alemán': ('alemán', 'de'),
-            'en aleman': ('alemán', 'de'),
-            'al italiano': ('italiano', 'it'),
-            'en italiano': ('italiano', 'it'),
-            'al portugués': ('portugués', 'pt'),
-            'al portugues': ('portugués', 'pt'),
-            'en portugués': ('portugués', 'pt'),
-            'en portugues': ('portugués', 'pt'),
-            'al chino': ('chino', 'zh'),
-            'en chino': ('chino', 'zh'),
-            'al japonés': ('japonés', 'ja'),
-            'al japones': ('japonés', 'ja'),
-            'en japonés': ('japonés', 'ja'),
-            'en japones': ('japonés', 'ja'),
-            'al ruso': ('ruso', 'ru'),
-            'en ruso': ('ruso', 'ru'),
-            'al árabe': ('árabe', 'ar'),
-            'al arabe': ('árabe', 'ar'),
-            'en árabe': ('árabe', 'ar'),
-            'en arabe': ('árabe', 'ar'),
-            'al coreano': ('coreano', 'ko'),
-            'en coreano': ('coreano', 'ko'),
-            'al tailandés': ('tailandés', 'th'),
-            'al tailandes': ('tailandés', 'th'),
-            'en tailandés': ('tailandés', 'th'),
-            'en tailandes': ('tailandés', 'th'),
-            'al vietnamita': ('vietnamita', 'vi'),
-            'en vietnamita': ('vietnamita', 'vi'),
-            'al holandés': ('holandés', 'nl'),
-            'al holandes': ('holandés', 'nl'),
-            'en holandés': ('holandés', 'nl'),
-            'en holandes': ('holandés', 'nl'),
-            'al sueco': ('sueco', 'sv'),
-            'en sueco': ('sueco', 'sv'),
-            'al noruego': ('noruego', 'no'),
-            'en noruego': ('noruego', 'no'),
-            'al danés': ('danés', 'da'),
-            'al danes': ('danés', 'da'),
-            'en danés': ('danés', 'da'),
-            'en danes': ('danés', 'da'),
-            'al griego': ('griego', 'el'),
-            'en griego': ('griego', 'el'),
-            'al turco': ('turco', 'tr'),
-            'en turco': ('turco', 'tr'),
-            'al hindi': ('hindi', 'hi'),
-            'en hindi': ('hindi', 'hi'),
-            'al bengalí': ('bengalí', 'bn'),
-            'al bengali': ('bengalí', 'bn'),
-            'en bengalí': ('bengalí', 'bn'),
-            'en bengali': ('bengalí', 'bn'),
-        }
+        # Idioma de destino (código) y texto a traducir vienen de la gramática de slots
+        target_code = parsed.slots.get('target_language')
+        text_to_translate = parsed.slots.get('source_text')
         
-        # Buscar el idioma en el comando
-        target_lang = None
-        target_code = None
-        text_to_translate = command.lower()
-        
-        for idioma_key, (idioma_name, idioma_code) in idiomas.items():
-            if idioma_key in command_norm:
-                target_lang = idioma_name
-                target_code = idioma_code
-                # Extraer texto a traducir (lo que viene antes de la palabra del idioma)
-                parts = command_norm.split(idioma_key)
-                if len(parts) > 0:
-                    text_to_translate = parts[0].replace('traduce', '').replace('traduceme', '').replace('en ', '').replace('cómo digo', '').replace('como digo', '').replace('qué es', '').replace('que es', '').strip()
-                break
-        
-        if target_lang and text_to_translate and len(text_to_translate) > 0:
-            response, _ = translate_text(text_to_translate, target_lang)
+        if target_code and text_to_translate:
+            response, _ = translate_text(text_to_translate, target_code)
         else:
             response = "Para traducir, di: 'Baro traduce [palabra] al [idioma]'. Por ejemplo: 'Baro traduce hola al inglés' o 'Baro cómo digo casa en francés'."
     
     # === PREGUNTAS DE CONOCIMIENTO ===
-    elif any(command.startswith(qw) for qw in nlp.question_words):
+    elif parsed.is_question:
         # Detectar tipo de pregunta
-        q_type, topic = nlp.detect_question_type(command)
+        q_type, topic = nlp.detect_question_type(parsed)
         
         if topic:
             # Buscar en conocimiento local
@@ -1582,24 +4522,50 @@ def process_command(command):
             else:
                 response = "No estoy seguro de qué me preguntas. Puedes: pedirme la hora, el clima, noticias, que busque en internet, reproduzca música, cuente un chiste, haga cálculos, o preguntarme sobre cualquier tema. También puedo aprender: di 'Baro aprende [tema]: [información]'."
     
-    # Registrar interacción
-    try:
-        conn = sqlite3.connect('baro.db')
-        c = conn.cursor()
-        c.execute("INSERT INTO interactions (timestamp, command, response, intent, confidence) VALUES (?, ?, ?, ?, ?)",
-                  (datetime.datetime.now().isoformat(), command, response, str(intent), confidence))
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        print(f"Error guardando interacción: {e}")
+    # Registrar interacción (en segundo plano, sin esperar a la base de datos)
+    interaction_logger.log(command, response, intent, confidence, (time.perf_counter() - started) * 1000, intent_source)
     
     return response
 
 # Inicializar base de datos
 init_db()
 
+# Índice de conocimiento residente en memoria (BARO_KNOWLEDGE_RELOAD_INTERVAL en
+# segundos; BARO_KNOWLEDGE_SEARCH_MODE: keyword, vector o hybrid)
+knowledge_index = KnowledgeIndex(storage, float(os.environ.get('BARO_KNOWLEDGE_RELOAD_INTERVAL', 5)),
+                                 os.environ.get('BARO_KNOWLEDGE_SEARCH_MODE', 'hybrid'))
+knowledge_index.load()
+
+# Los hilos en segundo plano arrancan con el servidor (start_background_services),
+# no al importar: los comandos de consola, los benchmarks y los tests no usan la
+# red ni escriben en segundo plano. Al salir, el registro de interacciones se
+# vacía antes de cerrar las conexiones; parar un hilo sin arrancar no hace nada
+atexit.register(interaction_logger.stop)
+atexit.register(news_prefetcher.stop)
+atexit.register(interaction_maintenance.stop)
+
 # ============= APLICACIÓN FLASK =============
 app = Flask(__name__)
+background_lock = threading.Lock()
+background_started = False
+
+@app.before_request
+def start_background_services():
+    """Arranca una sola vez el registro de interacciones, los titulares y el mantenimiento"""
+    global background_started
+    if background_started:
+        return
+    with background_lock:
+        if not background_started:
+            interaction_logger.start()
+            news_prefetcher.start()
+            interaction_maintenance.start()
+            background_started = True
+
+@app.teardown_appcontext
+def release_db_connection(exception=None):
+    """Cada petición usa un hilo nuevo: su conexión SQLite vuelve al pool al terminar"""
+    storage.release()
 
 @app.route('/')
 def index():
@@ -1966,7 +4932,98 @@ def process():
             'audio': None
         })
 
+@app.route('/intents', methods=['POST'])
+def classify_intents():
+    """Clasificar por lotes una lista de comandos (sin palabra de activación)"""
+    data = request.get_json(silent=True) or {}
+    commands = data.get('commands')
+    if not isinstance(commands, list) or not all(isinstance(c, str) for c in commands):
+        return jsonify({'error': "Envía 'commands' como una lista de textos."}), 400
+    
+    try:
+        top_k = max(1, int(data.get('top_k', 3)))
+    except (TypeError, ValueError):
+        return jsonify({'error': "'top_k' debe ser un número entero."}), 400
+    
+    ranked = nlp.detect_intents(commands, top_k=top_k)
+    return jsonify({
+        'results': [
+            {
+                'command': command,
+                'intents': [{'intent': intent, 'confidence': round(conf, 4)} for intent, conf in top]
+            }
+            for command, top in zip(commands, ranked)
+        ]
+    })
+
+@app.route('/translate', methods=['POST'])
+def translate_phrases():
+    """Traducir por lotes una lista de frases con la memoria de traducción"""
+    data = request.get_json(silent=True) or {}
+    texts = data.get('texts')
+    if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+        return jsonify({'error': "Envía 'texts' como una lista de textos."}), 400
+    if len(texts) > TRANSLATION_BATCH_MAX:
+        return jsonify({'error': f"Como máximo {TRANSLATION_BATCH_MAX} textos por petición."}), 400
+    
+    language = data.get('language')
+    lang_code = translation_language_code(language) if isinstance(language, str) else None
+    if lang_code is None:
+        return jsonify({'error': "Envía 'language' con un idioma o código válido, por ejemplo 'francés' o 'fr'."}), 400
+    
+    translations = translate_batch(texts, lang_code)
+    return jsonify({
+        'language': lang_code,
+        'results': [{'text': text, 'translation': translated} for text, translated in zip(texts, translations)]
+    })
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Contadores internos del asistente"""
+    return jsonify({
+        'nlp_cache': nlp.cache.stats(),
+        'db_pool': storage.stats(),
+        'knowledge_index': knowledge_index.stats(),
+        'interaction_logger': interaction_logger.stats(),
+        'interaction_maintenance': interaction_maintenance.stats(),
+        'wikipedia_cache': wikipedia_cache.stats(),
+        'weather_cache': weather_cache.stats(),
+        'weather_fetches': weather_flights.stats(),
+        'news': news_prefetcher.stats(),
+        'http': http_client.stats(),
+        'translation_memory': translation_memory.stats(),
+    })
+
 if __name__ == '__main__':
+    # python baro.py build-nlp: regenera el artefacto NLP (paso de despliegue)
+    if len(sys.argv) > 1 and sys.argv[1] == 'build-nlp':
+        path = nlp.load_compiled(sys.argv[2] if len(sys.argv) > 2 else None, rebuild=True)
+        print(f"✅ Artefacto NLP generado en {path}")
+        sys.exit(0)
+    
+    # python baro.py vacuum: activa el vacuum incremental en una base antigua (VACUUM completo)
+    if len(sys.argv) > 1 and sys.argv[1] == 'vacuum':
+        if enable_incremental_vacuum(storage.connection()):
+            print("✅ Vacuum incremental activado")
+        else:
+            print("✅ La base de datos ya tenía el vacuum incremental activado")
+        sys.exit(0)
+    
+    # python baro.py import-knowledge|export-knowledge <fichero.jsonl|fichero.csv>
+    if len(sys.argv) > 2 and sys.argv[1] == 'import-knowledge':
+        result = import_knowledge(sys.argv[2])
+        print(f"✅ {result['loaded']} filas importadas ({result['skipped']} descartadas, "
+              f"{result['embedded']} embeddings) en {result['seconds']} s: {result['rows_per_second']} filas/s")
+        if result['skipped_lines']:
+            lines = ', '.join(str(n) for n in result['skipped_lines'][:20])
+            more = '...' if len(result['skipped_lines']) > 20 else ''
+            print(f"⚠️ Registros descartados en las líneas: {lines}{more}")
+        sys.exit(0)
+    if len(sys.argv) > 2 and sys.argv[1] == 'export-knowledge':
+        result = export_knowledge(sys.argv[2])
+        print(f"✅ {result['exported']} filas exportadas en {result['seconds']} s: {result['rows_per_second']} filas/s")
+        sys.exit(0)
+    
     print("=" * 60)
     print("🚀 BARO AI - ASISTENTE INTELIGENTE v2.0")
     print("=" * 60)
@@ -1977,4 +5034,7 @@ if __name__ == '__main__':
     print("=" * 60)
     print("🌐 Servidor iniciando en http://localhost:8000")
     print("=" * 60)
+    # Con debug=True el proceso padre solo vigila los ficheros; los hilos van en el que sirve
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_services()
     app.run(host='0.0.0.0', port=8000, debug=True)
@@ -0,0 +1,61 @@
+"""Benchmark de NLPProcessor.detect_intents frente a llamar detect_intent en bucle.
+
+Uso:
+    python benchmarks/bench_batch_intents.py [--size N]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Base de datos y artefacto NLP en un directorio temporal: no toca baro.db
+TMP_DIR = tempfile.TemporaryDirectory(prefix='baro_bench_')
+os.environ['BARO_DB_PATH'] = os.path.join(TMP_DIR.name, 'bench.db')
+os.environ['BARO_NLP_ARTIFACT'] = os.path.join(TMP_DIR.name, 'bench_nlp.bin')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from baro import nlp
+
+# Se mide el cálculo, no la caché de resultados
+nlp.cache.resize(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+    
+    # Comandos sintéticos a partir de las variaciones de sinónimos
+    rng = random.Random(args.seed)
+    words = [w for _, variation in nlp.variations for w in variation.split()]
+    commands = [
+        ' '.join(rng.choice(words) for _ in range(rng.randint(1, 6)))
+        for _ in range(args.size)
+    ]
+    
+    start = time.perf_counter()
+    looped = [nlp.detect_intent(c) for c in commands]
+    loop_time = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    batched = nlp.detect_intents(commands, top_k=3)
+    batch_time = time.perf_counter() - start
+    
+    # Sin intención, detect_intent da (None, 0) y detect_intents una lista vacía
+    agree = sum(1 for looped_top, top in zip(looped, batched)
+                if (top[0] if top else (None, 0)) == looped_top)
+    answered = sum(1 for intent, _ in looped if intent)
+    
+    print(f"Comandos: {len(commands)} ({answered} con intención)")
+    print(f"detect_intent en bucle: {len(commands) / loop_time:,.0f} comandos/s")
+    print(f"detect_intents por lotes: {len(commands) / batch_time:,.0f} comandos/s")
+    print(f"Aceleración: {loop_time / batch_time:.1f}x")
+    print(f"Top-1 igual a detect_intent (intención y confianza): {agree}/{len(commands)}")
+    return 0 if agree == len(commands) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
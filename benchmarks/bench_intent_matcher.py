@@ -0,0 +1,126 @@
+"""Benchmark de NLPProcessor.detect_intent: recorrido lineal vs autómata de frases e índice difuso.
+
+Uso:
+    python benchmarks/bench_intent_matcher.py [--repeat N]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+# Base de datos y artefacto NLP en un directorio temporal: no toca baro.db
+TMP_DIR = tempfile.TemporaryDirectory(prefix='baro_bench_')
+os.environ['BARO_DB_PATH'] = os.path.join(TMP_DIR.name, 'bench.db')
+os.environ['BARO_NLP_ARTIFACT'] = os.path.join(TMP_DIR.name, 'bench_nlp.bin')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from baro import nlp
+
+# Se mide el cálculo, no la caché de resultados
+nlp.cache.resize(0)
+
+COMMANDS = [
+    'qué hora es', 'me dices la hora en madrid', 'qué día es hoy', 'dónde estoy',
+    'quién eres', 'quien es albert einstein', 'cómo está el clima en la habana',
+    'busca información sobre la salsa', 'pon música de celia cruz', 'últimas noticias de la bbc',
+    'cuéntame un chiste', 'cuánto es 25 por 8', 'dónde queda el museo del prado',
+    'hola baro', 'hasta luego', 'aprende python: es un lenguaje', 'traduce hola al inglés',
+    'que es la fotosintesis', 'hora exacta por favor', 'el tiempo en madrid mañana',
+]
+
+
+def misspellings(text):
+    """Variantes con errores típicos de reconocimiento de voz (corpus de referencia difuso)"""
+    variants = []
+    if len(text) > 3:
+        middle = len(text) // 2
+        variants.append(text[:middle] + text[middle + 1:])
+        variants.append(text[:middle - 1] + text[middle] + text[middle - 1] + text[middle + 1:])
+    for old, new in (('b', 'v'), ('v', 'b'), ('s', 'z'), ('ll', 'y'), ('c', 's')):
+        if old in text:
+            variants.append(text.replace(old, new, 1))
+    return variants
+
+
+def legacy_detect_intent(processor, command):
+    """Implementación anterior: un escaneo de subcadenas por cada frase"""
+    command_norm = processor.normalize_text(command)
+    patterns = processor.priority_patterns
+    
+    if any(pattern in command_norm for pattern in patterns['hora']):
+        if ' en ' in command_norm and not command_norm.endswith('en'):
+            return 'hora', 0.95
+        elif 'wikipedia' not in command_norm and 'busca' not in command_norm:
+            return 'hora', 0.99
+    if any(pattern in command_norm for pattern in patterns['fecha']):
+        return 'fecha', 0.98
+    if any(pattern in command_norm for pattern in patterns['ubicacion_usuario']):
+        return 'ubicación', 0.98
+    if any(pattern in command_norm for pattern in patterns['identidad']):
+        if 'quién es ' not in command_norm and 'quien es ' not in command_norm:
+            if 'wikipedia' not in command_norm and 'busca' not in command_norm:
+                return 'identidad', 0.99
+    
+    best_match = None
+    best_score = 0
+    for intent, variations in processor.synonyms.items():
+        for variation in variations:
+            if variation in command_norm:
+                score = 0.9 - (0.1 * (len(command_norm) - len(variation)) / len(command_norm))
+                score = max(score, 0.5)
+                if score > best_score:
+                    best_score = score
+                    best_match = intent
+            sim = processor.similarity(command_norm, variation)
+            if sim > 0.75 and sim > best_score:
+                best_score = sim
+                best_match = intent
+    return best_match, best_score
+
+
+def time_per_call(func, commands, repeat):
+    """Latencia media por llamada en microsegundos"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for command in commands:
+            func(command)
+    elapsed = time.perf_counter() - start
+    return elapsed / (repeat * len(commands)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    
+    corpus = COMMANDS + [variation for _, variation in nlp.variations]
+    corpus += [typo for command in list(corpus) for typo in misspellings(command)]
+    
+    mismatches = 0
+    for command in corpus:
+        expected = legacy_detect_intent(nlp, command)
+        got = nlp.detect_intent(command)
+        if expected != got:
+            mismatches += 1
+            print(f"Diferencia en '{command}': antes={expected} ahora={got}")
+    
+    # Solo la etapa de frases exactas (sin similitud difusa)
+    phrases = [pattern for patterns in nlp.priority_patterns.values() for pattern in patterns]
+    phrases += [variation for _, variation in nlp.variations]
+    normalized = [nlp.normalize_text(c) for c in corpus]
+    scan = time_per_call(lambda c: [p for p in phrases if p in c], normalized, args.repeat)
+    automaton = time_per_call(nlp.phrase_matcher.find, normalized, args.repeat)
+    
+    before = time_per_call(lambda c: legacy_detect_intent(nlp, c), corpus, max(1, args.repeat // 10))
+    after = time_per_call(nlp.detect_intent, corpus, max(1, args.repeat // 10))
+    
+    print(f"Comandos evaluados: {len(corpus)} ({len(phrases)} frases compiladas)")
+    print(f"Coincidencias exactas: escaneo {scan:.1f} µs/llamada, autómata {automaton:.1f} µs/llamada")
+    print(f"detect_intent: antes {before:.1f} µs/llamada, ahora {after:.1f} µs/llamada")
+    print(f"Resultados distintos: {mismatches}")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""Benchmark de la búsqueda difusa de temas con muchos temas sintéticos.
+
+Compara el recorrido lineal con difflib (una similitud por tema) con el índice
+de trigramas en memoria (KnowledgeIndex) y con la tabla knowledge_trigrams de
+SQLite, para bases de conocimiento de tamaño creciente. Usa una base de datos
+temporal: no toca baro.db.
+
+Comprueba además que el índice en memoria crece de forma sublineal: el exponente
+log(t_final / t_inicial) / log(n_final / n_inicial) debe quedar por debajo de
+--max-growth-exponent; si no, termina con código 1. También termina con código 1
+si en algún tamaño el tema original de alguna consulta con errata no está entre
+los candidatos del índice (exhaustividad por debajo de --min-recall).
+
+Uso:
+    python benchmarks/bench_knowledge_topics.py [--sizes 1000,10000,100000] [--queries 50]
+        [--max-growth-exponent 0.8] [--min-recall 1.0]
+"""
+import argparse
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from difflib import SequenceMatcher
+
+TMP_DIR = tempfile.mkdtemp(prefix='baro_bench_')
+os.environ['BARO_DB_PATH'] = os.path.join(TMP_DIR, 'bench.db')
+os.environ['BARO_NLP_ARTIFACT'] = os.path.join(TMP_DIR, 'bench_nlp.bin')
+# Solo la búsqueda por palabras clave y temas: sin embeddings
+os.environ['BARO_KNOWLEDGE_SEARCH_MODE'] = 'keyword'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import baro
+
+SYLLABLES = ['ma', 'ri', 'po', 'sa', 'te', 'lu', 'cor', 'ban', 'tri', 'vel', 'qui', 'dos',
+             'nar', 'fe', 'gol', 'mi', 'ra', 'son', 'ple', 'du', 'ca', 'jo', 'zen', 'bro']
+
+
+def synthetic_topics(rng, count, existing):
+    """Temas únicos de 1 a 3 palabras inventadas"""
+    topics = []
+    while len(topics) < count:
+        topic = ' '.join(
+            ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+            for _ in range(rng.randint(1, 3))
+        )
+        if topic not in existing:
+            existing.add(topic)
+            topics.append(topic)
+    return topics
+
+
+def misspell(rng, topic):
+    """Una letra borrada o cambiada"""
+    i = rng.randrange(len(topic))
+    if rng.random() < 0.5:
+        return topic[:i] + topic[i + 1:]
+    return topic[:i] + rng.choice('aeiourst') + topic[i + 1:]
+
+
+def linear_best(query, topics):
+    """Recorrido clásico: similitud con todos los temas"""
+    best, best_score = None, 0.7
+    for topic in topics:
+        score = SequenceMatcher(None, query, topic).ratio()
+        if score > best_score:
+            best, best_score = topic, score
+    return best
+
+
+def per_query_ms(func, queries):
+    start = time.perf_counter()
+    for query in queries:
+        func(query)
+    return (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--linear-queries', type=int, default=5,
+                        help='consultas para el recorrido lineal (es lento con muchos temas)')
+    parser.add_argument('--seed', type=int, default=3)
+    parser.add_argument('--max-growth-exponent', type=float, default=0.8,
+                        help='exponente máximo del tiempo del índice en memoria frente al número de temas')
+    parser.add_argument('--min-recall', type=float, default=1.0,
+                        help='fracción mínima de consultas con el tema original entre los candidatos')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    conn = baro.storage.connection()
+    existing = {row[0] for row in conn.execute("SELECT topic FROM knowledge")}
+    synthetic = []
+    timings = []
+    recall_failures = []
+
+    print(f"{'temas':>8} {'lineal ms':>10} {'memoria ms':>11} {'sqlite ms':>10} {'candidatos':>11}")
+    for size in (int(s) for s in args.sizes.split(',')):
+        # Insertar los temas que faltan para llegar al tamaño pedido
+        new_topics = synthetic_topics(rng, size - len(synthetic), existing)
+        with conn:
+            conn.executemany(baro.KNOWLEDGE_UPSERT, [
+                (topic, baro.normalize_topic(topic), f"Información sintética sobre {topic}.", 'sintetico', '')
+                for topic in new_topics
+            ])
+        synthetic += new_topics
+        baro.knowledge_index.load()
+
+        targets = [rng.choice(synthetic) for _ in range(args.queries)]
+        queries = [misspell(rng, topic) for topic in targets]
+        all_topics = list(baro.knowledge_index.topics)
+
+        linear = per_query_ms(lambda q: linear_best(q, all_topics), queries[:args.linear_queries])
+        memory = per_query_ms(lambda q: baro.knowledge_index.search(q), queries)
+        sqlite = per_query_ms(baro.search_knowledge_db, queries)
+
+        # Exhaustividad: el tema original está entre los candidatos del índice
+        # (la elección final la sigue haciendo knowledge_score, igual que antes)
+        hits = sum(1 for topic, query in zip(targets, queries)
+                   if baro.knowledge_index.topics[topic] in baro.knowledge_index._candidates(query))
+        print(f"{len(all_topics):>8} {linear:>10.2f} {memory:>11.2f} {sqlite:>10.2f} {hits:>6}/{len(queries)}")
+        timings.append((len(all_topics), memory))
+        if hits < args.min_recall * len(queries):
+            recall_failures.append((len(all_topics), hits, len(queries)))
+
+    baro.interaction_logger.stop()
+    baro.storage.close_all()
+    shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+    status = 0
+    for size, hits, total in recall_failures:
+        print(f"Regresión: con {size} temas solo {hits}/{total} consultas tienen su tema entre los candidatos "
+              f"(mínimo {args.min_recall:.0%})")
+        status = 1
+    if len(timings) < 2:
+        return status
+    (first_size, first_ms), (last_size, last_ms) = timings[0], timings[-1]
+    exponent = math.log(last_ms / first_ms) / math.log(last_size / first_size)
+    print()
+    print(f"Crecimiento del índice en memoria: t ~ n^{exponent:.2f} (máximo {args.max_growth_exponent})")
+    if exponent >= args.max_growth_exponent:
+        print("Regresión: la búsqueda difusa en memoria ya no crece de forma sublineal")
+        return 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,187 @@
+"""Benchmark de precisión y latencia del NLPProcessor sobre el corpus etiquetado.
+
+Informa la precisión por intención, la matriz de confusión y las latencias
+p50/p95/p99 de detect_intent, extract_query y detect_question_type. Con
+--output escribe el resultado en JSON; con --baseline compara contra un
+resultado anterior y termina con código 1 si hay una regresión.
+
+Uso:
+    python benchmarks/run_nlp_benchmark.py [--output resultado.json]
+        [--baseline anterior.json] [--max-accuracy-drop 0.0] [--max-latency-increase 0.25]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+# Base de datos y artefacto NLP en un directorio temporal: no toca baro.db
+TMP_DIR = tempfile.TemporaryDirectory(prefix='baro_bench_')
+os.environ['BARO_DB_PATH'] = os.path.join(TMP_DIR.name, 'bench.db')
+os.environ['BARO_NLP_ARTIFACT'] = os.path.join(TMP_DIR.name, 'bench_nlp.bin')
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from baro import nlp
+
+# Se mide el cálculo, no la caché de resultados
+nlp.cache.resize(0)
+
+NO_INTENT = 'ninguna'
+
+
+def load_corpus(path):
+    """Lee el corpus JSONL: una línea por comando con su intención esperada"""
+    corpus = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                corpus.append(json.loads(line))
+    return corpus
+
+
+def percentiles(samples):
+    """p50/p95/p99 en microsegundos"""
+    samples = sorted(samples)
+
+    def pick(q):
+        return round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1e6, 2)
+
+    return {'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99)}
+
+
+def time_calls(func, args_list, repeat):
+    """Latencia de cada llamada individual, repetida sobre todo el corpus"""
+    samples = []
+    clock = time.perf_counter
+    for _ in range(repeat):
+        for args in args_list:
+            start = clock()
+            func(*args)
+            samples.append(clock() - start)
+    return percentiles(samples)
+
+
+def evaluate(corpus, repeat):
+    """Ejecuta el corpus y devuelve el informe como diccionario"""
+    per_intent = defaultdict(lambda: {'total': 0, 'correct': 0})
+    confusion = defaultdict(lambda: defaultdict(int))
+    errors = []
+
+    texts = []
+    for item in corpus:
+        parsed = nlp.parse(item['command'])
+        predicted, confidence = nlp.detect_intent(parsed)
+        expected = item['intent'] or NO_INTENT
+        predicted = predicted or NO_INTENT
+
+        per_intent[expected]['total'] += 1
+        confusion[expected][predicted] += 1
+        if predicted == expected:
+            per_intent[expected]['correct'] += 1
+        else:
+            errors.append({'command': item['command'], 'expected': expected,
+                           'predicted': predicted, 'confidence': round(confidence, 4)})
+        texts.append((parsed.text, None if predicted == NO_INTENT else predicted))
+
+    for stats in per_intent.values():
+        stats['accuracy'] = round(stats['correct'] / stats['total'], 4)
+    correct = sum(s['correct'] for s in per_intent.values())
+
+    # Las latencias se miden con el texto sin analizar para incluir la normalización
+    latency = {
+        'detect_intent': time_calls(nlp.detect_intent, [(t,) for t, _ in texts], repeat),
+        'extract_query': time_calls(nlp.extract_query, texts, repeat),
+        'detect_question_type': time_calls(nlp.detect_question_type, [(t,) for t, _ in texts], repeat),
+    }
+
+    return {
+        'corpus_size': len(corpus),
+        'accuracy': round(correct / len(corpus), 4),
+        'per_intent': dict(sorted(per_intent.items())),
+        'confusion': {label: dict(sorted(row.items())) for label, row in sorted(confusion.items())},
+        'latency_us': latency,
+        'errors': errors,
+    }
+
+
+def compare(report, baseline, max_accuracy_drop, max_latency_increase):
+    """Lista de regresiones frente a un resultado anterior"""
+    regressions = []
+    if report['accuracy'] < baseline['accuracy'] - max_accuracy_drop:
+        regressions.append(f"precisión global {baseline['accuracy']} -> {report['accuracy']}")
+    for intent, stats in baseline['per_intent'].items():
+        current = report['per_intent'].get(intent)
+        if current and current['accuracy'] < stats['accuracy'] - max_accuracy_drop:
+            regressions.append(f"precisión de '{intent}' {stats['accuracy']} -> {current['accuracy']}")
+    for func, values in baseline['latency_us'].items():
+        current = report['latency_us'].get(func, {})
+        for key in ('p50', 'p95', 'p99'):
+            if key in current and current[key] > values[key] * (1 + max_latency_increase):
+                regressions.append(f"latencia {func} {key} {values[key]} -> {current[key]} µs")
+    return regressions
+
+
+def print_report(report):
+    print(f"Corpus: {report['corpus_size']} comandos | precisión global: {report['accuracy']:.2%}")
+    print()
+    print("Precisión por intención:")
+    for intent, stats in report['per_intent'].items():
+        print(f"  {intent:<12} {stats['correct']:>3}/{stats['total']:<3} {stats['accuracy']:.0%}")
+
+    print()
+    print("Matriz de confusión (fila = esperada, columna = detectada):")
+    labels = sorted(set(report['confusion']) | {p for row in report['confusion'].values() for p in row})
+    print(' ' * 13 + ' '.join(f"{label[:5]:>5}" for label in labels))
+    for expected in labels:
+        row = report['confusion'].get(expected, {})
+        print(f"  {expected:<11}" + ' '.join(f"{row.get(label, 0) or '.':>5}" for label in labels))
+
+    print()
+    print("Latencia por llamada (µs):")
+    for func, values in report['latency_us'].items():
+        print(f"  {func:<22} p50 {values['p50']:>9}  p95 {values['p95']:>9}  p99 {values['p99']:>9}")
+
+    if report['errors']:
+        print()
+        print("Errores:")
+        for error in report['errors']:
+            print(f"  '{error['command']}': esperada {error['expected']}, detectada {error['predicted']} ({error['confidence']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', default=os.path.join(BENCH_DIR, 'intent_corpus.jsonl'))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='ruta del resultado en JSON')
+    parser.add_argument('--baseline', help='resultado JSON anterior para detectar regresiones')
+    parser.add_argument('--max-accuracy-drop', type=float, default=0.0)
+    parser.add_argument('--max-latency-increase', type=float, default=0.25,
+                        help='aumento relativo máximo de cada percentil (0.25 = 25%%)')
+    args = parser.parse_args()
+
+    report = evaluate(load_corpus(args.corpus), args.repeat)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.max_accuracy_drop, args.max_latency_increase)
+        if regressions:
+            print()
+            print("Regresiones:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""La expresión única de preguntas y el PrefixTrie clasifican igual que el recorrido patrón a patrón.
+
+Uso:
+    python -m pytest tests/test_question_type.py
+"""
+import os
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+
+TMP_DIR = tempfile.mkdtemp(prefix='baro_test_')
+os.environ['BARO_DB_PATH'] = os.path.join(TMP_DIR, 'test.db')
+os.environ['BARO_NLP_ARTIFACT'] = os.path.join(TMP_DIR, 'test_nlp.bin')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import baro
+from baro import nlp, PrefixTrie
+
+QUESTIONS = [
+    # Un tipo de pregunta cada una
+    'qué es la fotosíntesis', 'que es python', 'define democracia', 'definición de átomo',
+    'qué significa resiliencia', 'explica la relatividad', 'explicame los agujeros negros',
+    'quién es messi', 'quien fue einstein', 'háblame de cuba', 'cuéntame sobre roma', 'info sobre marte',
+    'dónde está el museo del prado', 'donde queda la habana', 'ubicación se encuentra paris',
+    'cuándo fue la revolución francesa', 'cuando es navidad', 'cuándo ocurrió el big bang',
+    'cómo se hace el pan', 'como funciona un motor', 'cómo hacer una tortilla',
+    'por qué el cielo es azul', 'para qué sirve el hígado', 'porque llueve', 'motivo de la guerra',
+    'cuánto mide el everest', 'cuántos años tiene la tierra', 'cuantas patas tiene una araña',
+    # Varios patrones en la misma frase: gana el primero de la lista
+    'cómo se dice qué es en inglés', 'donde esta lo que es bueno', 'por qué quién es importante',
+    'cuando fue que es la fiesta', 'explica cuánto cuesta',
+    # Preguntas generales (solo palabra de pregunta) y la rareza de replace()
+    'cuál es tu color favorito', 'cuáles son los planetas', 'qué tal', 'quién sabe',
+    'dónde dónde', 'que queso es mejor', 'como como', 'cuando cuando llueve',
+    # Sin pregunta
+    'pon música', 'hola baro', 'la hora', 'dime un chiste', 'abre el navegador', '', 'es',
+    # Acentos, mayúsculas y puntuación
+    '¿Qué es la FOTOSÍNTESIS?', '¿Dónde está Madrid?', 'Baro, ¿cómo funciona internet?',
+    'varo quién es shakira', 'baro cuánto es dos más dos',
+]
+
+
+def legacy_question_type(command_norm):
+    """Implementación anterior: re.search con cada patrón en orden y luego las palabras de pregunta"""
+    for q_type, pattern in nlp.question_patterns.items():
+        match = re.search(pattern, command_norm)
+        if match:
+            return q_type, match.groups()[-1]
+    for qw in nlp.question_words:
+        if command_norm.startswith(qw):
+            return 'general', command_norm.replace(qw, '').strip()
+    return None, None
+
+
+def legacy_first_prefix(words, text):
+    """Primera palabra de la lista que es prefijo del texto"""
+    for word in words:
+        if text.startswith(word):
+            return word
+    return None
+
+
+class QuestionTypeTest(unittest.TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        baro.interaction_logger.stop()
+        baro.interaction_maintenance.stop()
+        baro.storage.close_all()
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+    def test_merged_regex_matches_pattern_loop(self):
+        for question in QUESTIONS:
+            command_norm = nlp.normalize_text(question.lower().strip())
+            with self.subTest(question=question):
+                self.assertEqual(nlp._match_question(command_norm), legacy_question_type(command_norm))
+
+    def test_parse_matches_pattern_loop(self):
+        for question in QUESTIONS:
+            parsed = nlp.parse(question)
+            with self.subTest(question=question):
+                self.assertEqual((parsed.question_type, parsed.topic), legacy_question_type(parsed.normalized))
+                self.assertEqual(parsed.is_question, legacy_first_prefix(nlp.question_words, parsed.text) is not None)
+
+    def test_trie_returns_first_listed_prefix(self):
+        for question in QUESTIONS:
+            text = question.lower().strip()
+            with self.subTest(question=question):
+                self.assertEqual(nlp.question_trie.first_prefix(text), legacy_first_prefix(nlp.question_words, text))
+
+    def test_trie_prefers_list_order_over_length(self):
+        trie = PrefixTrie(['por', 'por qué', 'p', 'por'])
+        self.assertEqual(trie.first_prefix('por qué llueve'), 'por')
+        self.assertEqual(trie.first_prefix('pan'), 'p')
+        self.assertIsNone(trie.first_prefix('qué'))
+        self.assertIsNone(PrefixTrie([]).first_prefix('qué'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+"""La gramática de slots corta cada cola en las marcas de otros slots y solo busca ciudad para clima y hora.
+
+Uso:
+    python -m pytest tests/test_slot_grammar.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+TMP_DIR = tempfile.mkdtemp(prefix='baro_test_')
+os.environ['BARO_DB_PATH'] = os.path.join(TMP_DIR, 'test.db')
+os.environ['BARO_NLP_ARTIFACT'] = os.path.join(TMP_DIR, 'test_nlp.bin')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import baro
+from baro import nlp
+
+# (comando, intención, slots esperados)
+CASES = [
+    # Otras intenciones no sacan ciudad de "en ..."
+    ('calcula 2 + 2 en la calculadora', 'calculadora', {'math_expression': '2 + 2'}),
+    ('cuanto es 5 por 3', 'calculadora', {'math_expression': '5 por 3'}),
+    ('traduce buenos dias en la mañana al ingles', 'traducir',
+     {'target_language': 'en', 'language_name': 'inglés', 'source_text': 'buenos dias en la mañana'}),
+    ('traduce hola al frances', 'traducir',
+     {'target_language': 'fr', 'language_name': 'francés', 'source_text': 'hola'}),
+    ('como llegar a la plaza mayor mañana', 'ubicación', {'place': 'la plaza mayor'}),
+    ('noticias de la bbc', 'noticias', {'news_source': 'bbc'}),
+    ('clima en madrid', None, {}),
+    # Clima y hora: la ciudad termina en las palabras de tiempo o en el idioma
+    ('clima en madrid mañana por la tarde', 'clima', {'city': 'madrid'}),
+    ('clima en la habana', 'clima', {'city': 'la habana'}),
+    ('clima en casa en madrid', 'clima', {'city': 'madrid'}),
+    ('clima en la mañana', 'clima', {}),
+    ('clima para mañana', 'clima', {}),
+    ('que hora es en nueva york', 'hora', {'city': 'nueva york'}),
+    ('hora en tokio ahora', 'hora', {'city': 'tokio'}),
+    ('traduce buenos dias en la mañana al ingles', 'clima',
+     {'target_language': 'en', 'language_name': 'inglés', 'source_text': 'buenos dias en la mañana'}),
+]
+
+
+class SlotGrammarTest(unittest.TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        baro.storage.close_all()
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+    def test_extract(self):
+        for command, intent, expected in CASES:
+            with self.subTest(command=command, intent=intent):
+                self.assertEqual(nlp.slot_grammar.extract(nlp.normalize_text(command), intent), expected)
+
+    def test_parse_has_no_city_until_intent_is_known(self):
+        parsed = nlp.parse('baro clima en madrid')
+        self.assertNotIn('city', parsed.slots)
+        self.assertEqual(nlp.command_slots(parsed, 'clima'), {'city': 'madrid'})
+        self.assertEqual(nlp.command_slots(parsed, 'calculadora'), {})
+
+
+if __name__ == '__main__':
+    unittest.main()